@@ -0,0 +1,445 @@
+"""Async JSON API for the forum, served alongside the Streamlit UI.
+
+Uses the same service layer as the pages, so a mobile client, a bot or a
+cache warmer sees exactly what the UI sees:
+
+    uvicorn api:app --port 8000
+
+Blocking SQLite work runs in the threadpool on pooled connections, so the
+event loop only handles I/O. Post and listing responses carry an ETag and
+answer If-None-Match with 304; larger bodies are gzip-compressed.
+Write endpoints take a session token from /api/auth/login as
+"Authorization: Bearer <token>", or HTTP Basic credentials.
+
+Uploaded images are served from /media/<folder>/<file> with long-lived
+immutable caching, ETag/Last-Modified validation and Range requests, so pages
+can point the browser (or a CDN in front of this app) at URLs instead of
+pushing pixels through the Streamlit websocket. Set FORUM_MEDIA_URL for the
+UI to use them.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import math
+import os
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+import fanout
+import mentions
+import ratelimit
+import service
+import sessions
+import tagging
+import warmup
+from db import close_pool
+from dedupe import DuplicateContent
+from media import CHUNK_SIZE, CONTENT_TYPES, IMMUTABLE_NAME, image_url, resolve_upload
+
+MEDIA_PREFIX = '/media/'
+
+
+class GZipExceptMedia(GZipMiddleware):
+    """Gzip JSON, but leave already-compressed images (and their byte ranges) alone"""
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(MEDIA_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(warmup.warm_up)
+    stop_fanout = fanout.start_worker() if fanout.IN_APP else None
+    yield
+    if stop_fanout:
+        stop_fanout.set()
+    close_pool()
+
+
+app = FastAPI(title="Advanced Forum API", lifespan=lifespan)
+app.add_middleware(GZipExceptMedia, minimum_size=1000)
+
+
+class Credentials(BaseModel):
+    username: str
+    password: str
+
+
+class Registration(BaseModel):
+    username: str
+    email: str
+    password: str
+
+
+class PostIn(BaseModel):
+    category_id: int
+    title: str
+    content: str
+    tags: Optional[list[str]] = None
+
+
+class CommentIn(BaseModel):
+    content: str
+
+
+def to_dict(row):
+    """Row as a dict, with a browser URL next to any stored image path"""
+    data = dict(row)
+    if data.get('image_path'):
+        data['image_url'] = image_url(data['image_path'])
+    return data
+
+
+def to_dicts(rows):
+    return [to_dict(row) for row in rows]
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [value.strip() for value in header.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def cached_json(request, payload):
+    """JSON response with a content ETag; 304 when the client already has it"""
+    body = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def client_ip(request):
+    return ratelimit.client_address(request.client.host if request.client else None,
+                                    request.headers.get('x-forwarded-for'))
+
+
+def enforce_limit(request, action, *keys):
+    """Spend the caller's budget for an action, answering 429 when it's gone"""
+    decision = ratelimit.check(action, f'ip:{client_ip(request)}', *keys)
+    if not decision.allowed:
+        raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS, ratelimit.describe(decision),
+                            headers={'Retry-After': str(math.ceil(decision.retry_after))})
+
+
+def unauthorized(detail):
+    return HTTPException(status.HTTP_401_UNAUTHORIZED, detail,
+                         headers={'WWW-Authenticate': 'Bearer, Basic realm="forum"'})
+
+
+async def current_user(request: Request):
+    scheme, _, value = request.headers.get('authorization', '').partition(' ')
+    scheme = scheme.lower()
+    if scheme == 'bearer':
+        user = await run_in_threadpool(sessions.load_session, value.strip())
+        if not user:
+            raise unauthorized("Session expired or invalid")
+        return user
+    if scheme == 'basic':
+        try:
+            username, _, password = base64.b64decode(value).decode().partition(':')
+        except (binascii.Error, UnicodeDecodeError):
+            raise unauthorized("Malformed credentials")
+        enforce_limit(request, 'api_auth', f'account:{username.lower()}')
+        user = await run_in_threadpool(service.authenticate, username, password)
+        if not user:
+            raise unauthorized("Invalid username or password")
+        return user
+    raise unauthorized("Login required")
+
+
+async def editable_post(post_id, user):
+    post = await run_in_threadpool(service.get_post, post_id)
+    if not post:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Post not found")
+    if not service.can_edit(user, post['user_id']):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "You are not authorized to edit this post")
+    return post
+
+
+async def validate_post(post):
+    """Reject a new or edited post with a blank title or body, or an unknown category"""
+    if not post.title or not post.content:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Please fill in both title and content")
+    if not await run_in_threadpool(service.get_category, post.category_id):
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Unknown category")
+
+
+# Reads
+@app.get('/api/categories')
+async def categories(request: Request):
+    rows = await run_in_threadpool(service.get_categories)
+    return cached_json(request, to_dicts(rows))
+
+
+@app.get('/api/posts')
+async def list_posts(request: Request, category_id: Optional[int] = None,
+                     limit: int = Query(20, ge=1, le=200),
+                     sort: str = Query('recent', pattern='^(recent|trending)$'),
+                     tags: Optional[str] = None, match: str = Query('all', pattern='^(all|any)$')):
+    if tags:
+        rows = await run_in_threadpool(service.list_tagged_posts, tagging.normalize_tags(tags), match,
+                                       category_id, limit)
+    elif sort == 'trending':
+        rows = await run_in_threadpool(service.list_trending_posts, category_id, limit)
+    elif category_id is None:
+        rows = await run_in_threadpool(service.list_recent_posts, limit)
+    else:
+        rows = await run_in_threadpool(service.list_category_posts, category_id, limit)
+    return cached_json(request, to_dicts(rows))
+
+
+@app.get('/api/tags')
+async def list_tags(request: Request, prefix: Optional[str] = None, limit: int = Query(10, ge=1, le=100)):
+    """Autocomplete for a prefix, otherwise the most used tags"""
+    if prefix:
+        rows = await run_in_threadpool(tagging.autocomplete, prefix, limit)
+    else:
+        rows = await run_in_threadpool(tagging.popular_tags, limit)
+    return cached_json(request, to_dicts(rows))
+
+
+@app.get('/api/users/complete')
+async def complete_usernames(request: Request, prefix: str, limit: int = Query(8, ge=1, le=50)):
+    """Usernames starting with prefix, for @mention autocomplete"""
+    return cached_json(request, await run_in_threadpool(mentions.complete, prefix, limit))
+
+
+@app.get('/api/posts/{post_id}')
+async def get_post(request: Request, post_id: int):
+    post = await run_in_threadpool(service.get_post, post_id)
+    if not post:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Post not found")
+    comments = await run_in_threadpool(service.list_comments, post_id)
+    return cached_json(request, {'post': to_dict(post), 'comments': to_dicts(comments)})
+
+
+@app.post('/api/posts/{post_id}/views', status_code=status.HTTP_204_NO_CONTENT)
+async def count_view(post_id: int):
+    """Views are counted explicitly so crawlers and cache warmers don't inflate them"""
+    if not await run_in_threadpool(service.view_post, post_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Post not found")
+
+
+@app.get('/api/changes')
+async def changes(since: int = Query(0, ge=0), post_id: Optional[int] = None,
+                  category_id: Optional[int] = None):
+    """A thread's new comments (or new posts) after seq `since`; since=0 just returns the current seq"""
+    if since == 0:
+        return {'seq': await run_in_threadpool(service.latest_seq), 'rows': []}
+    if post_id is not None:
+        rows = await run_in_threadpool(service.comments_since, post_id, since)
+    else:
+        rows = await run_in_threadpool(service.posts_since, since, category_id)
+    seq = max((row['seq'] for row in rows), default=since)
+    return {'seq': seq, 'rows': to_dicts(rows)}
+
+
+@app.get('/api/search')
+async def search(request: Request, q: str = Query(..., min_length=1), limit: int = Query(50, ge=1, le=200)):
+    enforce_limit(request, 'search')
+    rows = await run_in_threadpool(service.search_posts, q, limit)
+    return cached_json(request, to_dicts(rows))
+
+
+# Auth
+@app.post('/api/auth/login')
+async def login(request: Request, credentials: Credentials):
+    enforce_limit(request, 'login', f'account:{credentials.username.lower()}')
+    user = await run_in_threadpool(service.authenticate, credentials.username, credentials.password)
+    if not user:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Invalid username or password")
+    token = await run_in_threadpool(sessions.create_session, user)
+    return {'token': token, 'user': user}
+
+
+@app.post('/api/auth/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(request: Request):
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        await run_in_threadpool(sessions.destroy_session, token.strip())
+
+
+@app.post('/api/auth/register', status_code=status.HTTP_201_CREATED)
+async def register(request: Request, registration: Registration):
+    enforce_limit(request, 'register')
+    if len(registration.password) < 6:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Password must be at least 6 characters")
+    user = await run_in_threadpool(service.register, registration.username, registration.email,
+                                   registration.password)
+    if not user:
+        raise HTTPException(status.HTTP_409_CONFLICT, "Username or email already exists")
+    token = await run_in_threadpool(sessions.create_session, user)
+    return {'token': token, 'user': user}
+
+
+@app.get('/api/me')
+async def me(user=Depends(current_user)):
+    profile = await run_in_threadpool(sessions.get_profile, user['id'])
+    return to_dict(profile)
+
+
+# Commands
+@app.post('/api/posts', status_code=status.HTTP_201_CREATED)
+async def create_post(request: Request, post: PostIn, user=Depends(current_user)):
+    await validate_post(post)
+    enforce_limit(request, 'post', f"user:{user['id']}")
+    try:
+        post_id = await run_in_threadpool(service.create_post, user['id'], post.category_id, post.title,
+                                          post.content, None, post.tags or ())
+    except DuplicateContent as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, str(e))
+    return {'id': post_id}
+
+
+@app.put('/api/posts/{post_id}')
+async def update_post(post_id: int, post: PostIn, user=Depends(current_user)):
+    existing = await editable_post(post_id, user)
+    await validate_post(post)
+    try:
+        await run_in_threadpool(service.update_post, post_id, post.title, post.content, post.category_id,
+                                existing['image_path'], post.tags)
+    except DuplicateContent as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, str(e))
+    return {'id': post_id}
+
+
+@app.delete('/api/posts/{post_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def delete_post(post_id: int, user=Depends(current_user)):
+    await editable_post(post_id, user)
+    await run_in_threadpool(service.delete_post, post_id)
+
+
+@app.post('/api/posts/{post_id}/comments', status_code=status.HTTP_201_CREATED)
+async def add_comment(request: Request, post_id: int, comment: CommentIn, user=Depends(current_user)):
+    if not comment.content:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, "Please enter a comment")
+    enforce_limit(request, 'comment', f"user:{user['id']}")
+    if not await run_in_threadpool(service.get_post, post_id):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Post not found")
+    try:
+        comment_id = await run_in_threadpool(service.add_comment, post_id, user['id'], comment.content)
+    except DuplicateContent as e:
+        raise HTTPException(status.HTTP_409_CONFLICT, str(e))
+    return {'id': comment_id}
+
+
+@app.delete('/api/comments/{comment_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def delete_comment(comment_id: int, user=Depends(current_user)):
+    comment = await run_in_threadpool(service.get_comment, comment_id)
+    if not comment:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Comment not found")
+    if not service.can_edit(user, comment['user_id']):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "You are not authorized to delete this comment")
+    await run_in_threadpool(service.delete_comment, comment_id)
+
+
+# Static images
+def parse_range(header, size):
+    """Return (start, end) for a single 'bytes=' range, None to ignore it, or raise for 416"""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def read_file_range(file_path, start, end):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def not_modified_since(request, mtime):
+    header = request.headers.get('if-modified-since')
+    if not header:
+        return False
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+@app.api_route(MEDIA_PREFIX + '{folder}/{filename}', methods=['GET', 'HEAD'])
+async def media_file(request: Request, folder: str, filename: str):
+    file_path = resolve_upload(folder, filename)
+    try:
+        stat = await run_in_threadpool(os.stat, file_path) if file_path else None
+    except OSError:
+        stat = None
+    if stat is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Image not found")
+
+    content_hash = IMMUTABLE_NAME.match(filename)
+    if content_hash:
+        etag = f'"{content_hash.group(1)}"'
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        cache_control = 'public, max-age=3600'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+    media_type = CONTENT_TYPES.get(filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if etag_matches(request, etag) or ('if-none-match' not in request.headers
+                                       and not_modified_since(request, stat.st_mtime)):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    start, end, status_code = 0, stat.st_size - 1, status.HTTP_200_OK
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and stat.st_size and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            headers={**headers, 'Content-Range': f'bytes */{stat.st_size}'})
+        if byte_range:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    headers['Content-Length'] = str(end - start + 1 if stat.st_size else 0)
+    if request.method == 'HEAD' or not stat.st_size:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(read_file_range(file_path, start, end), status_code=status_code,
+                             headers=headers, media_type=media_type)
@@ -0,0 +1,142 @@
+"""Archive tiering: move cold threads out of the hot posts/comments tables.
+
+A thread (a post and all its comments) with no new post, edit or comment for
+ARCHIVE_AFTER_DAYS moves into the posts/comments tables of the attached
+archive database (forum_archive.db, or FORUM_ARCHIVE_DB), and its post_tags
+rows move along (the tag-count triggers drop them from the counts). Listings,
+counts and indexes on the live tables then only cover active content, while
+service's reads (get_post, list_comments, search) fall through to the archive
+so old links keep working. Commenting on or editing an archived thread
+brings it back first. Pinned threads are never archived.
+
+    python archive.py                  # archive threads idle for ARCHIVE_AFTER_DAYS
+    python archive.py --days 90 --dry-run
+
+Threads move in batches, one transaction each. With WAL a transaction over
+two database files is atomic per file rather than as a whole, so rows are
+copied with INSERT OR REPLACE before being deleted: a crash mid-batch leaves
+a thread in both tiers (reads prefer the live copy) and the next run
+finishes the move.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import COMMENT_COLUMNS, DB_PATH, POST_COLUMNS, open_connection
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('FORUM_ARCHIVE_AFTER_DAYS', '180'))
+BATCH_SIZE = 500
+
+
+def cutoff_for(days, now=None):
+    """created_at-style timestamp `days` before now (UTC, like CURRENT_TIMESTAMP)"""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def find_cold_threads(conn, cutoff, limit=BATCH_SIZE, after_id=0):
+    """Ids (ascending, above after_id) of unpinned posts with no activity since cutoff"""
+    rows = conn.execute('''
+        SELECT p.id FROM posts p
+        WHERE p.id > ? AND p.is_pinned = 0 AND p.created_at < ? AND p.updated_at < ?
+          AND NOT EXISTS (SELECT 1 FROM comments c WHERE c.post_id = p.id AND c.created_at >= ?)
+        ORDER BY p.id
+        LIMIT ?
+    ''', (after_id, cutoff, cutoff, cutoff, limit)).fetchall()
+    return [row[0] for row in rows]
+
+
+def archive_threads(conn, post_ids):
+    """Move posts and their comments into the archive (inside the caller's transaction)"""
+    ids = json.dumps(post_ids)
+    in_ids = 'IN (SELECT value FROM json_each(?))'
+    conn.execute(f'INSERT OR REPLACE INTO archive.posts ({POST_COLUMNS}) '
+                 f'SELECT {POST_COLUMNS} FROM posts WHERE id {in_ids}', (ids,))
+    conn.execute(f'INSERT OR REPLACE INTO archive.comments ({COMMENT_COLUMNS}) '
+                 f'SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id {in_ids}', (ids,))
+    conn.execute(f'INSERT OR REPLACE INTO archive.post_tags (tag, post_id) '
+                 f'SELECT tag, post_id FROM post_tags WHERE post_id {in_ids}', (ids,))
+    conn.execute(f'DELETE FROM post_tags WHERE post_id {in_ids}', (ids,))
+    conn.execute(f'DELETE FROM comments WHERE post_id {in_ids}', (ids,))
+    conn.execute(f'DELETE FROM posts WHERE id {in_ids}', (ids,))
+
+
+def restore_thread(conn, post_id):
+    """Bring an archived thread back into the live tables; False if it wasn't archived"""
+    if not conn.execute('SELECT 1 FROM archive.posts WHERE id = ?', (post_id,)).fetchone():
+        return False
+    # The insert triggers would announce the old rows as new; drop what they log
+    seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+    conn.execute(f'INSERT OR IGNORE INTO posts ({POST_COLUMNS}) '
+                 f'SELECT {POST_COLUMNS} FROM archive.posts WHERE id = ?', (post_id,))
+    conn.execute(f'INSERT OR IGNORE INTO comments ({COMMENT_COLUMNS}) '
+                 f'SELECT {COMMENT_COLUMNS} FROM archive.comments WHERE post_id = ?', (post_id,))
+    conn.execute('DELETE FROM change_log WHERE seq > ?', (seq,))
+    conn.execute('INSERT OR IGNORE INTO post_tags (tag, post_id) SELECT tag, post_id FROM archive.post_tags '
+                 'WHERE post_id = ?', (post_id,))
+    conn.execute('DELETE FROM archive.post_tags WHERE post_id = ?', (post_id,))
+    conn.execute('DELETE FROM archive.comments WHERE post_id = ?', (post_id,))
+    conn.execute('DELETE FROM archive.posts WHERE id = ?', (post_id,))
+    return True
+
+
+def run(conn, days=ARCHIVE_AFTER_DAYS, batch_size=BATCH_SIZE, dry_run=False, progress=None):
+    """Archive every cold thread in batches; returns the number of threads moved"""
+    cutoff = cutoff_for(days)
+    if dry_run:
+        return len(find_cold_threads(conn, cutoff, limit=-1))
+    with conn:
+        # Threads archived before tags moved with them
+        conn.execute('BEGIN IMMEDIATE')
+        stray = [row[0] for row in conn.execute(
+            'SELECT DISTINCT post_id FROM post_tags WHERE post_id IN (SELECT id FROM archive.posts) '
+            'AND post_id NOT IN (SELECT id FROM posts)')]
+        if stray:
+            conn.execute('INSERT OR REPLACE INTO archive.post_tags (tag, post_id) SELECT tag, post_id '
+                         'FROM post_tags WHERE post_id IN (SELECT value FROM json_each(?))', (json.dumps(stray),))
+            conn.execute('DELETE FROM post_tags WHERE post_id IN (SELECT value FROM json_each(?))',
+                         (json.dumps(stray),))
+    moved = 0
+    after_id = 0
+    while True:
+        with conn:
+            # Take the write lock first so no comment lands between find and move
+            conn.execute('BEGIN IMMEDIATE')
+            post_ids = find_cold_threads(conn, cutoff, batch_size, after_id)
+            if post_ids:
+                archive_threads(conn, post_ids)
+        if not post_ids:
+            return moved
+        # Walk the table by id so each batch doesn't rescan the active threads
+        after_id = post_ids[-1]
+        moved += len(post_ids)
+        if progress:
+            progress(moved)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help='archive threads idle this long')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='threads moved per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='only count the threads that would move')
+    args = parser.parse_args(argv)
+
+    def progress(count):
+        print(f'\rarchived {count:,} threads', end='', file=sys.stderr, flush=True)
+
+    conn = open_connection(args.db)
+    start = time.perf_counter()
+    moved = run(conn, args.days, args.batch_size, args.dry_run, progress)
+    conn.close()
+    print(file=sys.stderr)
+    verb = 'would archive' if args.dry_run else 'archived'
+    print(f"{verb} {moved:,} threads idle for {args.days} days in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
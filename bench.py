@@ -0,0 +1,310 @@
+"""Load-testing harness for fourm.py.
+
+Drives the app headlessly with streamlit.testing's AppTest, one AppTest per
+simulated session, against a throwaway copy of the database seeded with a
+synthetic corpus. Realistic journeys (home -> category -> post -> comment,
+search, profile, writing a post) are replayed across N concurrent sessions
+and the run is written out as JSON:
+
+    python bench.py --sessions 8 --rounds 5 --out bench_results/baseline.json
+    python bench.py --sessions 8 --rounds 5 --compare bench_results/baseline.json
+
+Latency percentiles come from the concurrent pass. DB statement counts come
+from a separate single-session calibration pass so they can be attributed to
+individual pages exactly.
+
+Besides page loads, in-page interactions are timed on their own (a formatting
+click in the post editor, posting a comment), which is where fragment-scoped
+reruns pay off; run --compare against a baseline to see the per-interaction
+change.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db
+from seed import seed_forum
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fourm.py')
+
+# Statement counting (only switched on during the calibration pass)
+_real_connect = sqlite3.connect
+_statement_lock = threading.Lock()
+_statement_count = 0
+
+
+def _count_statement(_sql):
+    global _statement_count
+    with _statement_lock:
+        _statement_count += 1
+
+
+def _counting_connect(*args, **kwargs):
+    conn = _real_connect(*args, **kwargs)
+    conn.set_trace_callback(_count_statement)
+    return conn
+
+
+class Session:
+    """One simulated browser session: an AppTest plus the timings it records"""
+
+    def __init__(self, user, post_ids, category_ids, rng):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(APP_PATH, default_timeout=120)
+        self.user = user
+        self.post_ids = post_ids
+        self.category_ids = category_ids
+        self.rng = rng
+        self.timings = []
+        self.errors = []
+
+    def visit(self, page, **state):
+        for key, value in state.items():
+            self.at.session_state[key] = value
+        self.at.session_state['page'] = page
+        self._timed(page, self.at.run)
+
+    def comment(self):
+        text_area = next(t for t in self.at.text_area if t.label == 'Add a comment')
+        text_area.input(f'Benchmark comment {self.rng.random():.6f}')
+        submit = next(b for b in self.at.button if b.label == '💬 Post Comment')
+        self._timed('comment', submit.click().run)
+
+    def format_text(self):
+        bold = next(b for b in self.at.button if b.label == '**Bold**')
+        self._timed('editor_format', bold.click().run)
+
+    def _timed(self, label, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.errors.append(f'{label}: {e!r}')
+            return
+        elapsed = time.perf_counter() - start
+        if self.at.exception:
+            self.errors.append(f'{label}: {self.at.exception[0].message}')
+        self.timings.append((label, elapsed))
+
+
+# Journeys a visitor takes through the forum
+def journey_browse(session):
+    session.visit('home')
+    session.visit('category', category_id=session.rng.choice(session.category_ids))
+    session.visit('view_post', current_post=session.rng.choice(session.post_ids))
+    session.comment()
+
+
+def journey_search(session):
+    session.visit('home')
+    term = session.rng.choice(('python', 'cache', 'user1', 'Tutorials', 'index'))
+    session.visit('search', search_query=term)
+    session.visit('view_post', current_post=session.rng.choice(session.post_ids))
+
+
+def journey_profile(session):
+    session.visit('profile')
+    session.visit('home')
+
+
+def journey_write(session):
+    session.visit('create_post')
+    session.format_text()
+    session.format_text()
+    session.visit('view_post', current_post=session.rng.choice(session.post_ids))
+    session.comment()
+
+
+JOURNEYS = [(journey_browse, 5), (journey_search, 3), (journey_profile, 2), (journey_write, 2)]
+
+
+def run_session(index, rounds, users, post_ids, category_ids, seed):
+    rng = random.Random(seed * 1000 + index)
+    session = Session(rng.choice(users), post_ids, category_ids, rng)
+    session.at.session_state['user'] = session.user
+    journeys = [journey for journey, _ in JOURNEYS]
+    weights = [weight for _, weight in JOURNEYS]
+    for _ in range(rounds):
+        rng.choices(journeys, weights)[0](session)
+    return session
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(timings):
+    pages = {}
+    for label, elapsed in timings:
+        pages.setdefault(label, []).append(elapsed * 1000)
+    summary = {}
+    for label, values in sorted(pages.items()):
+        values.sort()
+        summary[label] = {
+            'count': len(values),
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p90_ms': round(percentile(values, 90), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'max_ms': round(values[-1], 3),
+        }
+    return summary
+
+
+def calibrate_statements(users, post_ids, category_ids, seed):
+    """Run every journey once in a single session and count statements per page"""
+    global _statement_count
+    rng = random.Random(seed)
+    session = Session(users[0], post_ids, category_ids, rng)
+    session.at.session_state['user'] = session.user
+
+    counts = {}
+    timed = session._timed
+
+    def counted(label, action):
+        global _statement_count
+        with _statement_lock:
+            _statement_count = 0
+        timed(label, action)
+        counts.setdefault(label, []).append(_statement_count)
+
+    session._timed = counted
+    sqlite3.connect = _counting_connect
+    try:
+        for journey, _ in JOURNEYS:
+            journey(session)
+    finally:
+        sqlite3.connect = _real_connect
+        # Drop the traced connections so the concurrent pass runs untraced
+        db.close_pool()
+    return {label: max(values) for label, values in counts.items()}
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\n{'page':<14} {'p50 ms':>18} {'p95 ms':>18} {'statements':>14}")
+    for page, stats in current['pages'].items():
+        old = previous.get('pages', {}).get(page)
+        if not old:
+            print(f"{page:<14} {'(new)':>18}")
+            continue
+        print(f"{page:<14} {old['p50_ms']:>8.1f} -> {stats['p50_ms']:<7.1f} "
+              f"{old['p95_ms']:>8.1f} -> {stats['p95_ms']:<7.1f} "
+              f"{old.get('statements', 0):>5} -> {stats.get('statements', 0):<5}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent simulated sessions')
+    parser.add_argument('--rounds', type=int, default=5, help='journeys per session')
+    parser.add_argument('--rows', type=int, default=5000, help='synthetic corpus size (see seed.py)')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--posts', type=int)
+    parser.add_argument('--comments', type=int)
+    parser.add_argument('--max-depth', type=int, default=5, help='longest comment reply chain')
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='directory for the benchmark forum.db (default: a temp dir)')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='track Python allocations with tracemalloc (slows the run down)')
+    args = parser.parse_args(argv)
+
+    import streamlit
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='forum-bench-')
+    out_path = os.path.abspath(args.out) if args.out else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    corpus = seed_forum('forum.db', rows=args.rows, users=args.users, posts=args.posts,
+                        comments=args.comments, images=args.images, max_depth=args.max_depth,
+                        seed=args.seed, reset=True)
+    corpus.pop('seconds')
+
+    conn = _real_connect('forum.db')
+    users = [{'id': row[0], 'username': row[1], 'role': row[2]}
+             for row in conn.execute("SELECT id, username, role FROM users WHERE role = 'user'")]
+    post_ids = [row[0] for row in conn.execute('SELECT id FROM posts')]
+    category_ids = [row[0] for row in conn.execute('SELECT id FROM categories')]
+    conn.close()
+
+    print(f"Seeded {corpus} in {workdir}")
+    statements = calibrate_statements(users, post_ids, category_ids, args.seed)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(run_session, i, args.rounds, users, post_ids, category_ids, args.seed)
+                   for i in range(args.sessions)]
+        sessions = [future.result() for future in futures]
+    wall_time = time.perf_counter() - start
+    peak_traced = None
+    if args.trace_memory:
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    timings = [t for session in sessions for t in session.timings]
+    errors = [e for session in sessions for e in session.errors]
+    pages = summarize(timings)
+    for page, count in statements.items():
+        pages.setdefault(page, {})['statements'] = count
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'streamlit': streamlit.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'args': vars(args),
+            'corpus': corpus,
+        },
+        'pages': pages,
+        'requests': len(timings),
+        'errors': errors,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_rps': round(len(timings) / wall_time, 3) if wall_time else None,
+        'memory': {
+            'traced_peak_mb': round(peak_traced / (1024 * 1024), 2) if peak_traced is not None else None,
+            'max_rss_before_mb': round(rss_before / 1024, 2),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        },
+    }
+
+    print(json.dumps(results['pages'], indent=2))
+    print(f"{len(timings)} page loads in {wall_time:.2f}s, {len(errors)} errors")
+    if out_path:
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {out_path}")
+    if compare_path:
+        compare(results, compare_path)
+    return 0 if not errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,448 @@
+"""Database location, schema and pooled connections for the forum.
+
+Kept free of Streamlit so tools (seeding, benchmarks, the JSON API) can use
+the database without running the UI script.
+"""
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get('FORUM_DB', 'forum.db')
+POOL_SIZE = int(os.environ.get('FORUM_DB_POOL_SIZE', '8'))
+
+# Column order shared by the live and archive copies of posts and comments
+POST_COLUMNS = ('id, user_id, category_id, title, content, created_at, updated_at, views, '
+                'is_pinned, image_path, hot_score')
+COMMENT_COLUMNS = 'id, post_id, user_id, content, created_at, parent_id, image_path'
+
+# How many change_log entries to keep; pages further behind than this reload instead
+CHANGE_LOG_KEEP = 100000
+
+
+def archive_path(path=DB_PATH):
+    """The archive database kept next to a forum database (forum.db -> forum_archive.db)"""
+    return os.environ.get('FORUM_ARCHIVE_DB') or os.path.splitext(path)[0] + '_archive.db'
+
+
+def attach_archive(conn, path=DB_PATH):
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path(path),))
+
+
+def setup_database(path=DB_PATH):
+    """Create the schema and default rows if they don't exist yet"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    attach_archive(conn, path)
+    cursor = conn.cursor()
+    
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            bio TEXT DEFAULT '',
+            avatar TEXT DEFAULT NULL
+        )
+    ''')
+    
+    # Categories table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            color TEXT DEFAULT '#667eea'
+        )
+    ''')
+    
+    # Posts table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            category_id INTEGER DEFAULT 1,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            views INTEGER DEFAULT 0,
+            is_pinned BOOLEAN DEFAULT 0,
+            image_path TEXT DEFAULT NULL,
+            hot_score REAL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    ''')
+    # Databases created before trending existed
+    post_columns = [row[1] for row in cursor.execute('PRAGMA table_info(posts)')]
+    if 'hot_score' not in post_columns:
+        cursor.execute('ALTER TABLE posts ADD COLUMN hot_score REAL DEFAULT 0')
+    
+    # Comments table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            parent_id INTEGER DEFAULT NULL,
+            image_path TEXT DEFAULT NULL,
+            FOREIGN KEY (post_id) REFERENCES posts (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Cold threads moved out of the hot tables (see archive.py); same columns,
+    # so rows move with INSERT ... SELECT
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.posts (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            category_id INTEGER,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            views INTEGER DEFAULT 0,
+            is_pinned BOOLEAN DEFAULT 0,
+            image_path TEXT DEFAULT NULL,
+            hot_score REAL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.comments (
+            id INTEGER PRIMARY KEY,
+            post_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP,
+            parent_id INTEGER DEFAULT NULL,
+            image_path TEXT DEFAULT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_posts_user ON posts (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_comments_post ON comments (post_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_comments_user ON comments (user_id)')
+    # Archived threads' tags, kept out of the live post_tags so tag counts and listings cover live posts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.post_tags (
+            tag TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, post_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS archive.idx_archive_post_tags_post ON post_tags (post_id)')
+    
+    # Server-side sessions and cached user profiles (see sessions.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_store (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_store_expiry ON session_store (expires_at)')
+    
+    # Append-only feed of new posts and comments, for pages polling "since seq N"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            category_id INTEGER
+        )
+    ''')
+    create_change_triggers(cursor)
+    
+    # Epoch the hot scores are scaled against (see ranking.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ranking_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch REAL NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO ranking_state (id, epoch) VALUES (1, strftime('%s', 'now'))")
+    
+    # Last comment each user has seen per thread, for unread counts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS read_markers (
+            user_id INTEGER NOT NULL,
+            post_id INTEGER NOT NULL,
+            last_comment_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, post_id)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Tags: an inverted index from tag to posts, and per-tag counts kept by triggers (see tagging.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS post_tags (
+            tag TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            PRIMARY KEY (tag, post_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags (post_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tags (
+            name TEXT PRIMARY KEY,
+            post_count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tags_count ON tags (post_count)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS count_tag_insert AFTER INSERT ON post_tags BEGIN
+            INSERT INTO tags (name, post_count) VALUES (NEW.tag, 1)
+            ON CONFLICT (name) DO UPDATE SET post_count = post_count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS count_tag_delete AFTER DELETE ON post_tags BEGIN
+            UPDATE tags SET post_count = post_count - 1 WHERE name = OLD.tag;
+        END
+    ''')
+    
+    # Who watches which post or category, and the notifications fanned out to them (see fanout.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            kind TEXT NOT NULL,
+            target_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (kind, target_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            comment_id INTEGER,
+            actor_id INTEGER,
+            created_at TIMESTAMP NOT NULL,
+            is_read INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications (user_id) WHERE is_read = 0')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fanout_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    ''')
+    # A new worker starts at the current end of the feed rather than replaying it
+    cursor.execute('INSERT OR IGNORE INTO fanout_state (id, seq) SELECT 1, COALESCE(MAX(seq), 0) FROM change_log')
+    
+    # Hourly and daily activity counters, plus today's active users (see rollups.py)
+    for table in ('rollup_hourly', 'rollup_daily'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                metric TEXT NOT NULL,
+                category_id INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (metric, category_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_active_users (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Near-duplicate detection (see dedupe.py): a MinHash signature per post and
+    # comment, the LSH band buckets that find candidates, and flagged reposts
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS minhash_signatures (
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (kind, item_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS minhash_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, kind, item_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS duplicate_flags (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            item_id INTEGER NOT NULL,
+            match_kind TEXT NOT NULL,
+            match_id INTEGER NOT NULL,
+            similarity REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (kind, item_id)
+        )
+    ''')
+
+    # Insert default categories
+    cursor.execute('''
+        INSERT OR IGNORE INTO categories (id, name, description, color) VALUES
+        (1, 'General', 'General discussions', '#667eea'),
+        (2, 'Questions', 'Ask questions here', '#4CAF50'),
+        (3, 'Suggestions', 'Share your ideas', '#FF9800'),
+        (4, 'Methods', 'Helping For Peoples', '#F44336'),
+        (5, 'Tutorials', 'Step by step guides', '#9C27B0')
+    ''')
+    
+    # Create admin user if not exists
+    admin_hash = hashlib.sha256('admin123'.encode()).hexdigest()
+    cursor.execute('''
+        INSERT OR IGNORE INTO users (username, email, password_hash, role) 
+        VALUES ('admin', 'admin@forum.com', ?, 'admin')
+    ''', (admin_hash,))
+    
+    # Indexes for the listing and comment lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_category ON posts (category_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_user ON posts (user_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_hot ON posts (hot_score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_category_hot ON posts (category_id, hot_score)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post ON comments (post_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_user ON comments (user_id)')
+    # Unread counts: top-level comments after a read marker, one covered range per thread
+    # (parent_id is listed so SQLite sees the index as covering)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_top_level ON comments (post_id, id, parent_id) '
+                   'WHERE parent_id IS NULL')
+    
+    # Case-insensitive @mention lookups (see mentions.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)')
+    
+    # Moderation console filters, each followed by id so a keyset page reads in index order (see moderation.py)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_role ON users (role, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_category_id ON posts (category_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_pinned ON posts (is_pinned, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_posts_user_id ON posts (user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments (post_id, id)')
+    
+    conn.commit()
+    conn.close()
+
+
+def create_change_triggers(cursor):
+    """Log every post and comment insert into change_log, trimming old entries"""
+    trim = f'DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - {CHANGE_LOG_KEEP};'
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_post_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO change_log (kind, row_id, post_id, category_id)
+            VALUES ('post', NEW.id, NEW.id, NEW.category_id);
+            {trim}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_comment_insert AFTER INSERT ON comments BEGIN
+            INSERT INTO change_log (kind, row_id, post_id)
+            VALUES ('comment', NEW.id, NEW.post_id);
+            {trim}
+        END
+    ''')
+
+
+def drop_change_triggers(cursor):
+    """Stop logging inserts (bulk loads that shouldn't show up as live updates)"""
+    cursor.execute('DROP TRIGGER IF EXISTS log_post_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS log_comment_insert')
+
+
+def open_connection(path=DB_PATH):
+    """Open a connection configured the way the app expects"""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    attach_archive(conn, path)
+    conn.execute('PRAGMA archive.journal_mode = WAL')
+    return conn
+
+
+class ConnectionPool:
+    """A small LIFO pool of SQLite connections shared by all sessions/requests"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def fill(self):
+        """Open connections up to the pool size ahead of the first requests"""
+        opened = [self.acquire() for _ in range(self._idle.maxsize)]
+        for conn in opened:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    """Close every idle pooled connection (the pool refills on demand)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for reads"""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    """Borrow a pooled connection and commit (or roll back) when the block ends"""
+    with connection() as conn:
+        with conn:
+            yield conn
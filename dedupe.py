@@ -0,0 +1,339 @@
+"""Near-duplicate detection for posts and comments (MinHash with LSH banding).
+
+Text is cut into shingles of SHINGLE_WORDS consecutive words, each hashed to
+64 bits. The signature is a one-permutation MinHash: the hash picks one of
+NUM_HASHES slots and each slot keeps the smallest hash that landed in it
+(slots a short text leaves empty copy the next filled one). Two texts agree
+on a slot with probability close to the Jaccard similarity of their shingle
+sets, and a signature costs one hash per shingle rather than NUM_HASHES.
+
+Signatures are cut into BANDS bands of ROWS slots, and each band hashes to a
+bucket in minhash_buckets, keyed (band, bucket). A new text's candidates are
+the items sharing at least MIN_SHARED_BANDS of its buckets: BANDS primary-key
+range reads of at most BUCKET_ROWS rows each, whatever the corpus size. Only
+the MAX_CANDIDATES sharing the most have their stored signature compared, and
+the best one at or above THRESHOLD is the match. Matches are flagged but not
+indexed themselves, so a text posted a thousand times keeps one entry per
+bucket rather than a thousand. With 16 bands of 4 slots and two shared
+bands, texts 80% alike become candidates with 99.7% probability and texts 30%
+alike with under 1%.
+
+New posts and comments, and edited posts, are screened on a pooled connection
+just before their write transaction opens (a read inside it could make the
+upgrade to a write fail with SQLITE_BUSY), then recorded inside it. So two
+identical posts saved at the same moment can both pass the screen.
+FORUM_DUPLICATES picks what happens to a match:
+
+    flag    save it and add a row to duplicate_flags for the admin panel (default);
+            it's indexed if an admin dismisses the flag
+    reject  refuse it with DuplicateContent
+    off     skip detection
+
+Existing content is indexed in batches, and entries of deleted content are
+pruned afterwards (ops.py maintain does this too):
+
+    python dedupe.py scan               # index posts and comments without a signature
+    python dedupe.py prune
+    python dedupe.py bench --checks 500 # time screening against this database
+
+Texts shorter than MIN_WORDS words ("thanks!", "+1") are never checked.
+"""
+import argparse
+import hashlib
+import json
+import operator
+import os
+import random
+import re
+import struct
+import sys
+import time
+
+from db import DB_PATH, open_connection
+
+SHINGLE_WORDS = 4
+MIN_WORDS = 8
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+THRESHOLD = 0.8
+MIN_SHARED_BANDS = 2
+# Most index rows read per band and candidates compared per check, so a bucket of boilerplate stays cheap
+BUCKET_ROWS = 100
+MAX_CANDIDATES = 50
+ACTION = os.environ.get('FORUM_DUPLICATES', 'flag')
+SCAN_BATCH = 1000
+
+WORD_RE = re.compile(r'\w+')
+_SIGNATURE = struct.Struct(f'<{NUM_HASHES}Q')
+
+# One capped range read per band (params: the BANDS buckets in band order)
+_BAND_ROWS = ' UNION ALL '.join(
+    f'SELECT * FROM (SELECT kind, item_id FROM minhash_buckets WHERE band = {band} AND bucket = ? LIMIT {BUCKET_ROWS})'
+    for band in range(BANDS)
+)
+CANDIDATES_SQL = f'''
+    SELECT s.kind, s.item_id, s.signature
+    FROM (
+        SELECT b.kind, b.item_id
+        FROM ({_BAND_ROWS}) b
+        GROUP BY b.kind, b.item_id
+        HAVING COUNT(*) >= {MIN_SHARED_BANDS}
+        ORDER BY COUNT(*) DESC
+        LIMIT {MAX_CANDIDATES}
+    ) c
+    JOIN minhash_signatures s ON s.kind = c.kind AND s.item_id = c.item_id
+'''
+EXISTS_SQL = {
+    'post': 'SELECT 1 FROM posts WHERE id = ? UNION ALL SELECT 1 FROM archive.posts WHERE id = ?',
+    'comment': 'SELECT 1 FROM comments WHERE id = ? UNION ALL SELECT 1 FROM archive.comments WHERE id = ?',
+}
+# Index entries whose post or comment is gone (run by prune and ops.py maintain)
+_GONE = '''
+    (kind = 'post' AND item_id NOT IN (SELECT id FROM posts UNION ALL SELECT id FROM archive.posts))
+    OR (kind = 'comment' AND item_id NOT IN (SELECT id FROM comments UNION ALL SELECT id FROM archive.comments))
+'''
+PRUNE_STEPS = [
+    ('duplicate flags', f'DELETE FROM duplicate_flags WHERE {_GONE}'),
+    ('minhash signatures', f'DELETE FROM minhash_signatures WHERE {_GONE}'),
+    ('minhash buckets', '''
+        DELETE FROM minhash_buckets WHERE NOT EXISTS (
+            SELECT 1 FROM minhash_signatures s
+            WHERE s.kind = minhash_buckets.kind AND s.item_id = minhash_buckets.item_id
+        )
+    '''),
+]
+
+
+class DuplicateContent(ValueError):
+    """Raised when a new post or comment repeats existing content (FORUM_DUPLICATES=reject)"""
+
+    def __init__(self, match):
+        kind, item_id, similarity = match
+        super().__init__(f"This looks like a repost of an existing {kind} ({similarity:.0%} alike)")
+        self.match = match
+
+
+def signature(text):
+    """MinHash signature of text, or None if it's too short to judge"""
+    words = WORD_RE.findall((text or '').casefold())
+    if len(words) < MIN_WORDS:
+        return None
+    slots = [None] * NUM_HASHES
+    for i in range(len(words) - SHINGLE_WORDS + 1):
+        shingle = ' '.join(words[i:i + SHINGLE_WORDS]).encode()
+        hashed = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+        value, slot = divmod(hashed, NUM_HASHES)
+        if slots[slot] is None or value < slots[slot]:
+            slots[slot] = value
+    sig = list(slots)
+    for slot in range(NUM_HASHES):
+        step = 1
+        while sig[slot] is None:
+            sig[slot] = slots[(slot + step) % NUM_HASHES]
+            step += 1
+    return sig
+
+
+def buckets(sig):
+    """One signed 64-bit bucket per band"""
+    packed = _SIGNATURE.pack(*sig)
+    size = ROWS * 8
+    return [int.from_bytes(hashlib.blake2b(packed[band * size:(band + 1) * size], digest_size=8).digest(),
+                           'little', signed=True)
+            for band in range(BANDS)]
+
+
+def similarity(sig, other):
+    return sum(map(operator.eq, sig, other)) / NUM_HASHES
+
+
+def find(conn, sig, exclude=None):
+    """(kind, item_id, similarity) of the most similar indexed item at or above THRESHOLD, or None
+
+    exclude is a (kind, item_id) to skip, e.g. the post being edited.
+    """
+    scored = sorted(
+        ((similarity(sig, _SIGNATURE.unpack(row[2])), row[0], row[1])
+         for row in conn.execute(CANDIDATES_SQL, buckets(sig))),
+        reverse=True
+    )
+    for score, kind, item_id in scored:
+        if score < THRESHOLD:
+            break
+        if (kind, item_id) == exclude:
+            continue
+        # Deleted content keeps its index entries until the next prune
+        if conn.execute(EXISTS_SQL[kind], (item_id, item_id)).fetchone():
+            return kind, item_id, score
+    return None
+
+
+def screen(conn, text, exclude=None):
+    """Check new or edited text before it's saved; returns (signature, match) for record()
+
+    Raises DuplicateContent when FORUM_DUPLICATES=reject and text matches.
+    """
+    sig = signature(text) if ACTION != 'off' else None
+    match = find(conn, sig, exclude) if sig else None
+    if match and ACTION == 'reject':
+        raise DuplicateContent(match)
+    return sig, match
+
+
+def record(conn, kind, item_id, screened):
+    """Index a saved post or comment, or flag it (unindexed) if screen() found a match"""
+    sig, match = screened
+    if sig is None:
+        return
+    if match:
+        conn.execute('INSERT OR REPLACE INTO duplicate_flags (kind, item_id, match_kind, match_id, similarity) '
+                     'VALUES (?, ?, ?, ?, ?)', (kind, item_id, *match))
+        return
+    conn.execute('INSERT OR REPLACE INTO minhash_signatures (kind, item_id, signature) VALUES (?, ?, ?)',
+                 (kind, item_id, _SIGNATURE.pack(*sig)))
+    conn.executemany('INSERT OR IGNORE INTO minhash_buckets (band, bucket, kind, item_id) VALUES (?, ?, ?, ?)',
+                     [(band, bucket, kind, item_id) for band, bucket in enumerate(buckets(sig))])
+
+
+def forget(conn, kind, item_id):
+    """Drop an item's index entries and flag, e.g. before recording its edited text"""
+    row = conn.execute('SELECT signature FROM minhash_signatures WHERE kind = ? AND item_id = ?',
+                       (kind, item_id)).fetchone()
+    if row:
+        # Exact keys from the stored signature, rather than scanning the buckets for the item
+        conn.executemany('DELETE FROM minhash_buckets WHERE band = ? AND bucket = ? AND kind = ? AND item_id = ?',
+                         [(band, bucket, kind, item_id)
+                          for band, bucket in enumerate(buckets(_SIGNATURE.unpack(row[0])))])
+        conn.execute('DELETE FROM minhash_signatures WHERE kind = ? AND item_id = ?', (kind, item_id))
+    conn.execute('DELETE FROM duplicate_flags WHERE kind = ? AND item_id = ?', (kind, item_id))
+
+
+# Batch mode
+SCAN_SOURCES = [
+    ('post', "SELECT p.id, p.title || char(10) || p.content FROM {schema}.posts p"),
+    ('comment', "SELECT p.id, p.content FROM {schema}.comments p"),
+]
+
+
+def index_items(conn, kind, item_ids):
+    """Index saved items without screening them (posts or comments whose flag was dismissed)"""
+    select = dict(SCAN_SOURCES)[kind]
+    for schema in ('main', 'archive'):
+        rows = conn.execute(f'{select.format(schema=schema)} WHERE p.id IN (SELECT value FROM json_each(?))',
+                            (json.dumps(list(item_ids)),)).fetchall()
+        for item_id, text in rows:
+            record(conn, kind, item_id, (signature(text), None))
+
+
+def scan(conn, progress=None):
+    """Index (or flag) every post and comment that has neither a signature nor a flag yet, oldest first"""
+    counts = {'scanned': 0, 'indexed': 0, 'flagged': 0}
+    for kind, select in SCAN_SOURCES:
+        for schema in ('archive', 'main'):
+            after_id = 0
+            while True:
+                with conn:
+                    conn.execute('BEGIN IMMEDIATE')
+                    rows = conn.execute(f'''
+                        {select.format(schema=schema)}
+                        WHERE p.id > ? AND NOT EXISTS (
+                            SELECT 1 FROM minhash_signatures s WHERE s.kind = ? AND s.item_id = p.id
+                        ) AND NOT EXISTS (
+                            SELECT 1 FROM duplicate_flags f WHERE f.kind = ? AND f.item_id = p.id
+                        )
+                        ORDER BY p.id
+                        LIMIT ?
+                    ''', (after_id, kind, kind, SCAN_BATCH)).fetchall()
+                    for item_id, text in rows:
+                        sig = signature(text)
+                        if sig is None:
+                            continue
+                        match = find(conn, sig)
+                        record(conn, kind, item_id, (sig, match))
+                        counts['indexed'] += match is None
+                        counts['flagged'] += match is not None
+                if not rows:
+                    break
+                after_id = rows[-1][0]
+                counts['scanned'] += len(rows)
+                if progress:
+                    progress(counts)
+    return counts
+
+
+def prune(conn):
+    timings = []
+    for name, sql in PRUNE_STEPS:
+        start = time.perf_counter()
+        with conn:
+            conn.execute(sql)
+        timings.append((name, round(time.perf_counter() - start, 3)))
+    return timings
+
+
+def bench(conn, checks=500, seed=1):
+    """Time screen() on random indexed posts' own text (each one is its own best match)"""
+    rng = random.Random(seed)
+    top = conn.execute("SELECT MAX(item_id) FROM minhash_signatures WHERE kind = 'post'").fetchone()[0] or 0
+    indexed = conn.execute('SELECT COUNT(*) FROM minhash_signatures').fetchone()[0]
+    times = []
+    matched = 0
+    for _ in range(checks):
+        row = conn.execute(
+            "SELECT p.title || char(10) || p.content FROM minhash_signatures s JOIN posts p ON p.id = s.item_id "
+            "WHERE s.kind = 'post' AND s.item_id >= ? ORDER BY s.item_id LIMIT 1", (rng.randint(1, top),)
+        ).fetchone() if top else None
+        if row is None:
+            break
+        start = time.perf_counter()
+        sig = signature(row[0])
+        matched += find(conn, sig) is not None
+        times.append(time.perf_counter() - start)
+    times.sort()
+    if not times:
+        return {'indexed': indexed, 'checks': 0}
+    return {
+        'indexed': indexed,
+        'checks': len(times),
+        'matched': matched,
+        'p50_ms': round(times[len(times) // 2] * 1000, 3),
+        'p99_ms': round(times[min(len(times) - 1, int(len(times) * 0.99))] * 1000, 3),
+        'max_ms': round(times[-1] * 1000, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('scan', 'prune', 'bench'))
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--checks', type=int, default=500, help='bench: screenings to time')
+    args = parser.parse_args(argv)
+
+    conn = open_connection(args.db)
+    try:
+        if args.command == 'scan':
+            start = time.perf_counter()
+
+            def progress(counts):
+                print(f"\rscanned {counts['scanned']:,}, flagged {counts['flagged']:,}",
+                      end='', file=sys.stderr, flush=True)
+
+            counts = scan(conn, progress)
+            seconds = time.perf_counter() - start
+            print(file=sys.stderr)
+            print(f"Indexed {counts['indexed']:,} of {counts['scanned']:,} items, flagged {counts['flagged']:,} "
+                  f"in {seconds:.1f}s ({counts['scanned'] / max(seconds, 1e-9):,.0f} items/s)")
+        elif args.command == 'prune':
+            for name, seconds in prune(conn):
+                print(f"  {name:<20} {seconds:>8.3f}s")
+        else:
+            for key, value in bench(conn, args.checks).items():
+                print(f"  {key:<10} {value}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""Notification fan-out: turn new posts and comments into notification rows.
+
+Writers never touch notifications, however many people watch a thread. A
+worker follows change_log (the feed live pages already poll) from the seq
+saved in fanout_state, and fans each batch of events out with two
+INSERT ... SELECT statements that join the events to subscriptions:
+
+    comment on a watched post       -> 'reply' for every watcher of the post
+    new post in a watched category  -> 'new_post' for every watcher of the category
+
+Nobody is notified of their own posts and comments. A batch's notifications
+and the advanced seq commit together, so every event fans out exactly once,
+even with several workers running. The app runs a worker thread per process
+(set FORUM_FANOUT_IN_APP=0 to leave it to a dedicated one):
+
+    python fanout.py                 # follow the feed, polling every POLL_SECONDS
+    python fanout.py --once          # fan out what's pending and exit
+    python fanout.py bench --watchers 10000 --comments 50
+
+A worker that falls more than CHANGE_LOG_KEEP events behind skips the ones
+that were trimmed. A failed drain (the database locked by a VACUUM or a
+backup, say) is logged and retried after a backoff of up to MAX_BACKOFF
+seconds, so the worker thread never dies with it.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from db import DB_PATH, open_connection, setup_database
+
+BATCH_SIZE = 1000
+# Notifications per write transaction to aim for, so a thread with 10k+
+# watchers doesn't hold the write lock for long
+MAX_NOTIFICATIONS = 20000
+FIRST_BATCH_SIZE = 1
+POLL_SECONDS = 1.0
+MAX_BACKOFF = 60.0
+IN_APP = os.environ.get('FORUM_FANOUT_IN_APP', '1') == '1'
+
+log = logging.getLogger(__name__)
+
+
+def fan_out(conn, batch_size=BATCH_SIZE):
+    """Fan out the next batch of events (inside the caller's transaction); returns (events, notifications)"""
+    after = conn.execute('SELECT seq FROM fanout_state WHERE id = 1').fetchone()[0]
+    events, upto = conn.execute(
+        'SELECT COUNT(*), MAX(seq) FROM (SELECT seq FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?)',
+        (after, batch_size)
+    ).fetchone()
+    if not events:
+        return 0, 0
+    notified = conn.execute('''
+        INSERT INTO notifications (user_id, kind, post_id, comment_id, actor_id, created_at)
+        SELECT s.user_id, 'reply', c.post_id, c.id, c.user_id, c.created_at
+        FROM change_log l
+        JOIN comments c ON c.id = l.row_id
+        JOIN subscriptions s ON s.kind = 'post' AND s.target_id = c.post_id
+        WHERE l.seq > ? AND l.seq <= ? AND l.kind = 'comment' AND s.user_id != c.user_id
+    ''', (after, upto)).rowcount
+    notified += conn.execute('''
+        INSERT INTO notifications (user_id, kind, post_id, actor_id, created_at)
+        SELECT s.user_id, 'new_post', p.id, p.user_id, p.created_at
+        FROM change_log l
+        JOIN posts p ON p.id = l.row_id
+        JOIN subscriptions s ON s.kind = 'category' AND s.target_id = p.category_id
+        WHERE l.seq > ? AND l.seq <= ? AND l.kind = 'post' AND s.user_id != p.user_id
+    ''', (after, upto)).rowcount
+    conn.execute('UPDATE fanout_state SET seq = ? WHERE id = 1', (upto,))
+    return events, notified
+
+
+def drain(conn, batch_size=BATCH_SIZE, on_batch=None):
+    """Fan out everything pending, one write transaction per batch; returns (events, notifications)
+
+    Batch sizes adapt to how widely the last batch fanned out, aiming at
+    about MAX_NOTIFICATIONS rows per transaction (starting small, since one
+    event can mean tens of thousands of rows). on_batch(events,
+    notifications, seconds) is called per batch.
+    """
+    total_events = total_notified = 0
+    size = min(batch_size, FIRST_BATCH_SIZE)
+    while True:
+        start = time.perf_counter()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            events, notified = fan_out(conn, size)
+        if on_batch and events:
+            on_batch(events, notified, time.perf_counter() - start)
+        total_events += events
+        total_notified += notified
+        if events < size:
+            return total_events, total_notified
+        size = max(1, min(batch_size, events * MAX_NOTIFICATIONS // max(notified, 1)))
+
+
+def follow(db_path=DB_PATH, interval=POLL_SECONDS, stop=None):
+    """Drain, sleep, repeat until `stop` is set; failures back off and retry"""
+    stop = stop or threading.Event()
+    conn = open_connection(db_path)
+    backoff = interval
+    try:
+        while not stop.is_set():
+            try:
+                drain(conn)
+                backoff = interval
+            except Exception:
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                log.exception("Notification fan-out failed; retrying in %.1fs", backoff)
+            stop.wait(backoff)
+    finally:
+        conn.close()
+
+
+def start_worker(db_path=DB_PATH, interval=POLL_SECONDS):
+    """Run follow() on a daemon thread; returns the Event that stops it"""
+    stop = threading.Event()
+    threading.Thread(target=follow, args=(db_path, interval, stop), name='fanout', daemon=True).start()
+    return stop
+
+
+# Benchmark
+def bench(watchers=10000, comments=50, workdir=None):
+    """Time comment writes and their fan-out for one post with `watchers` watchers"""
+    workdir = workdir or tempfile.mkdtemp(prefix='fanout_bench_')
+    db_path = os.path.join(workdir, 'fanout.db')
+    setup_database(db_path)
+    conn = open_connection(db_path)
+    with conn:
+        conn.executemany('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                         ((f'watcher{i}', f'watcher{i}@example.com', '') for i in range(watchers)))
+        post_id = conn.execute("INSERT INTO posts (user_id, category_id, title, content) "
+                               "VALUES (1, 1, 'Busy thread', 'Everyone watches this')").lastrowid
+        conn.execute("INSERT INTO subscriptions (kind, target_id, user_id) "
+                     "SELECT 'post', ?, id FROM users", (post_id,))
+    drain(conn)
+
+    write_times = []
+    for i in range(comments):
+        start = time.perf_counter()
+        with conn:
+            conn.execute('INSERT INTO comments (post_id, user_id, content) VALUES (?, 1, ?)',
+                         (post_id, f'comment {i}'))
+        write_times.append(time.perf_counter() - start)
+
+    batches = []
+    start = time.perf_counter()
+    events, notified = drain(conn, on_batch=lambda *batch: batches.append(batch))
+    fanout_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    unread = conn.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = 0',
+                          (watchers,)).fetchone()[0]
+    badge_seconds = time.perf_counter() - start
+    conn.close()
+    write_times.sort()
+    return {
+        'watchers': watchers,
+        'comments': events,
+        'notifications': notified,
+        'comment_write_p50_ms': round(write_times[len(write_times) // 2] * 1000, 3),
+        'comment_write_max_ms': round(write_times[-1] * 1000, 3),
+        'fanout_seconds': round(fanout_seconds, 3),
+        'notifications_per_second': round(notified / max(fanout_seconds, 1e-9)),
+        'transactions': len(batches),
+        'longest_transaction_ms': round(max(seconds for _, _, seconds in batches) * 1000, 3),
+        'badge_query_ms': round(badge_seconds * 1000, 3),
+        'badge_unread': unread,
+        'workdir': workdir,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', choices=('run', 'bench'), default='run')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--once', action='store_true', help='fan out pending events and exit')
+    parser.add_argument('--interval', type=float, default=POLL_SECONDS, help='seconds between polls')
+    parser.add_argument('--watchers', type=int, default=10000, help='bench: watchers of the busy post')
+    parser.add_argument('--comments', type=int, default=50, help='bench: comments written to it')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        for key, value in bench(args.watchers, args.comments).items():
+            print(f"  {key:<26} {value}")
+        return 0
+    if args.once:
+        conn = open_connection(args.db)
+        start = time.perf_counter()
+        events, notified = drain(conn)
+        conn.close()
+        print(f"fanned out {events:,} events into {notified:,} notifications "
+              f"in {time.perf_counter() - start:.2f}s")
+        return 0
+    try:
+        follow(args.db, args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,29 @@
 import streamlit as st
-import sqlite3
-import hashlib
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from datetime import datetime
+import json
 import time
 import os
-import base64
-from PIL import Image
-import io
+import service
+import fanout
+import moderation
+import rollups
+import sessions
+import ratelimit
+import mentions
+import tagging
+from media import store_upload, remove_upload, image_url, avatar_thumbnail, pil_image, UploadError
+import warmup
+from dedupe import DuplicateContent
+
+# How often open threads and listings poll for new comments and posts
+LIVE_UPDATE_SECONDS = 5
+
+# The login survives reloads through a session token cookie; a logged-in page re-reads
+# its session this often, to pick up role changes, deleted accounts and logouts elsewhere
+SESSION_COOKIE = 'forum_session'
+SESSION_RECHECK_SECONDS = 60
 
 # Page configuration
 st.set_page_config(
@@ -16,265 +33,201 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Database setup
-def setup_database():
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            bio TEXT DEFAULT '',
-            avatar TEXT DEFAULT NULL
-        )
-    ''')
-    
-    # Categories table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            color TEXT DEFAULT '#667eea'
-        )
-    ''')
-    
-    # Posts table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            category_id INTEGER DEFAULT 1,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            views INTEGER DEFAULT 0,
-            is_pinned BOOLEAN DEFAULT 0,
-            image_path TEXT DEFAULT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (category_id) REFERENCES categories (id)
-        )
-    ''')
-    
-    # Comments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            parent_id INTEGER DEFAULT NULL,
-            image_path TEXT DEFAULT NULL,
-            FOREIGN KEY (post_id) REFERENCES posts (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Insert default categories
-    cursor.execute('''
-        INSERT OR IGNORE INTO categories (id, name, description, color) VALUES
-        (1, 'General', 'General discussions', '#667eea'),
-        (2, 'Questions', 'Ask questions here', '#4CAF50'),
-        (3, 'Suggestions', 'Share your ideas', '#FF9800'),
-        (4, 'Methods', 'Helping For Peoples', '#F44336'),
-        (5, 'Tutorials', 'Step by step guides', '#9C27B0')
-    ''')
-    
-    # Create admin user if not exists
-    admin_hash = hashlib.sha256('admin123'.encode()).hexdigest()
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (username, email, password_hash, role) 
-        VALUES ('admin', 'admin@forum.com', ?, 'admin')
-    ''', (admin_hash,))
-    
-    conn.commit()
-    conn.close()
-
-# Initialize database
-setup_database()
-
-# Create uploads directory if not exists
-if not os.path.exists('uploads'):
-    os.makedirs('uploads')
-    os.makedirs('uploads/posts')
-    os.makedirs('uploads/comments')
-    os.makedirs('uploads/avatars')
+@st.cache_resource(ttl=300)
+def load_categories():
+    """Categories only change with the schema, so every session shares one copy"""
+    return service.get_categories()
 
-# Utility functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def get_categories():
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM categories')
-    categories = cursor.fetchall()
-    conn.close()
-    return categories
-
-def get_user(user_id):
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def get_category_posts(category_id):
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, u.username, c.name as category_name, c.color as category_color
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        JOIN categories c ON p.category_id = c.id
-        WHERE p.category_id = ?
-        ORDER BY p.is_pinned DESC, p.created_at DESC
-    ''', (category_id,))
-    posts = cursor.fetchall()
-    conn.close()
-    return posts
-
-def search_posts(query):
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT p.*, u.username, c.name as category_name
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        JOIN categories c ON p.category_id = c.id
-        WHERE p.title LIKE ? OR p.content LIKE ? OR u.username LIKE ? OR c.name LIKE ?
-        ORDER BY p.created_at DESC
-    ''', (f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%'))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+# Schema, upload directories, pooled connections and the home page's rows, once per process
+@st.cache_resource
+def init_storage():
+    warmup.warm_up()
+    # Fill the app's own caches too, so the first page render hits them
+    load_categories()
+    # Notifications are written off the request path, by one worker thread per process
+    if fanout.IN_APP:
+        fanout.start_worker()
+
+init_storage()
 
+# Utility functions
 def save_uploaded_image(uploaded_file, folder='posts'):
     """Save uploaded image and return file path"""
     if uploaded_file is not None:
         try:
-            # Generate unique filename
-            file_extension = uploaded_file.name.split('.')[-1]
-            filename = f"{int(time.time())}_{hashlib.md5(uploaded_file.name.encode()).hexdigest()[:8]}.{file_extension}"
-            file_path = os.path.join('uploads', folder, filename)
-            
-            # Save file
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            return file_path
+            return store_upload(uploaded_file, folder)
+        except UploadError as e:
+            st.error(f"Image rejected: {e}")
+            return None
         except Exception as e:
             st.error(f"Error saving image: {e}")
             return None
     return None
 
+def image_source(image_path):
+    """What st.image should load; local files are decoded server-side, so set PIL's pixel cap first"""
+    url = image_url(image_path)
+    if url == image_path:
+        pil_image()
+    return url
+
 def display_image(image_path, width=400):
-    """Display image in Streamlit"""
+    """Display image in Streamlit (by URL, so the browser fetches and caches it)"""
     if image_path and os.path.exists(image_path):
         try:
-            image = Image.open(image_path)
-            st.image(image, width=width, caption="Attached Image")
+            st.image(image_source(image_path), width=width, caption="Attached Image")
         except Exception as e:
             st.error(f"Error displaying image: {e}")
     elif image_path:
         st.warning("Image not found")
 
-def format_content(content):
-    """Format content with proper line breaks and basic formatting"""
+def author_avatar(card, width=32):
+    """An author's avatar thumbnail (decoded once per process, see media.avatar_thumbnail)"""
+    thumbnail = avatar_thumbnail(card['avatar']) if card else None
+    if thumbnail:
+        st.image(thumbnail, width=width)
+    else:
+        st.write("👤")
+
+def format_content(content, mentioned=()):
+    """Format content with proper line breaks and basic formatting
+
+    @names in `mentioned` (resolved by the caller, see mentions.resolve) are highlighted.
+    """
     if not content:
         return ""
     
     # Replace multiple newlines with proper markdown line breaks
     formatted = content.replace('\n', '  \n')
+    if mentioned:
+        formatted = mentions.MENTION_RE.sub(
+            lambda m: f":blue[**{m.group(0)}**]" if m.group(1) in mentioned else m.group(0), formatted)
     return formatted
 
 # Rich Text Editor Component - UPDATED: Form se bahar
-def rich_text_editor(key="editor", default_content=""):
-    """A rich text editor using Streamlit components"""
+EDITOR_MARKUP = [
+    ("**Bold**", "bold", " **bold text** "),
+    ("*Italic*", "italic", " *italic text* "),
+    ("`Code`", "code", " `code` "),
+    ("📋 List", "list", "\n- List item 1\n- List item 2\n- List item 3\n"),
+    ("1. Number", "number", "\n1. First item\n2. Second item\n3. Third item\n"),
+    ("🔗 Link", "link", " [link text](http://url.com) "),
+]
+
+# Drafts: the editor and tags widgets are keyed '<field>_<key>', and Streamlit drops a
+# widget's state once a run doesn't draw it, so each change is also copied to the
+# plain key 'draft_<field>_<key>', which survives navigating to another page and back
+def draft_text(field, key):
+    return st.session_state.get(f'{field}_{key}', st.session_state.get(f'draft_{field}_{key}', ''))
+
+def set_draft(field, key, text):
+    st.session_state[f'{field}_{key}'] = st.session_state[f'draft_{field}_{key}'] = text
+
+def keep_draft(field, key):
+    """on_change callback of a draft widget"""
+    st.session_state[f'draft_{field}_{key}'] = st.session_state[f'{field}_{key}']
+
+def restore_draft(field, key):
+    """Call before drawing a draft widget, so it comes back with the saved text"""
+    if f'{field}_{key}' not in st.session_state:
+        st.session_state[f'{field}_{key}'] = st.session_state.get(f'draft_{field}_{key}', '')
+
+def insert_markup(key, markup):
+    """Button callback: append markup to the editor before it is redrawn"""
+    set_draft('editor', key, draft_text('editor', key) + markup)
+
+def complete_mention(key, username):
+    """Replace the @name being typed at the end of the editor with a suggestion"""
+    text = draft_text('editor', key)
+    set_draft('editor', key, text[:text.rindex('@')] + f"@{username} ")
+
+def mention_suggestions(key, content):
+    """Username buttons while the last word of the text is an @mention"""
+    words = content.split()
+    typing = words[-1] if words and not content[-1].isspace() else ''
+    match = mentions.MENTION_RE.fullmatch(typing)
+    suggestions = mentions.complete(match.group(1), limit=6) if match else []
+    if suggestions:
+        for col, username in zip(st.columns(len(suggestions)), suggestions):
+            with col:
+                st.button(f"@{username}", key=f"mention_{key}_{username}",
+                          on_click=complete_mention, args=(key, username))
+
+@st.fragment
+def rich_text_editor(key="editor"):
+    """A rich text editor using Streamlit components
+
+    Runs as a fragment, so formatting clicks only redraw the editor.
+    Read the text with draft_text('editor', key).
+    """
     
     st.markdown("**Post Editor** - Use the formatting options below:")
     
     # Formatting buttons - Form ke bahar hain
-    col1, col2, col3, col4, col5, col6 = st.columns(6)
-    
-    with col1:
-        if st.button("**Bold**", key=f"bold_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + " **bold text** "
-            st.rerun()
-    
-    with col2:
-        if st.button("*Italic*", key=f"italic_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + " *italic text* "
-            st.rerun()
-    
-    with col3:
-        if st.button("`Code`", key=f"code_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + " `code` "
-            st.rerun()
-    
-    with col4:
-        if st.button("📋 List", key=f"list_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + "\n- List item 1\n- List item 2\n- List item 3\n"
-            st.rerun()
-    
-    with col5:
-        if st.button("1. Number", key=f"number_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + "\n1. First item\n2. Second item\n3. Third item\n"
-            st.rerun()
-    
-    with col6:
-        if st.button("🔗 Link", key=f"link_{key}", use_container_width=True):
-            current_content = st.session_state.get(f'editor_{key}', default_content)
-            st.session_state[f'editor_{key}'] = current_content + " [link text](http://url.com) "
-            st.rerun()
+    for col, (label, name, markup) in zip(st.columns(len(EDITOR_MARKUP)), EDITOR_MARKUP):
+        with col:
+            st.button(label, key=f"{name}_{key}", use_container_width=True,
+                      on_click=insert_markup, args=(key, markup))
     
     # Editor area
+    restore_draft('editor', key)
     content = st.text_area(
         "Write your content:",
-        value=st.session_state.get(f'editor_{key}', default_content),
         height=400,
-        key=f"textarea_{key}",
+        key=f"editor_{key}",
+        on_change=keep_draft,
+        args=('editor', key),
         placeholder="Write your post here...\n\nYou can use:\n**Bold** text\n*Italic* text\n`Code` blocks\n- Bullet points\n1. Numbered lists\n\nAdd images below!",
         help="Use the formatting buttons above or type Markdown directly"
     )
+    mention_suggestions(key, content)
     
     # Preview section
     if content:
         with st.expander("📖 Live Preview"):
             st.markdown("**Preview:**")
-            formatted_content = format_content(content)
+            formatted_content = format_content(content, mentions.resolve([content]))
             st.markdown(formatted_content)
-    
-    return content
 
-def display_rich_content(content, image_path=None):
+def clear_editor(key):
+    for field in ('editor', 'tags'):
+        st.session_state.pop(f'{field}_{key}', None)
+        st.session_state.pop(f'draft_{field}_{key}', None)
+
+def complete_tag(key, tag):
+    """Replace the tag being typed with an autocomplete suggestion"""
+    typed = draft_text('tags', key).split(',')
+    typed[-1] = tag
+    set_draft('tags', key, ', '.join(part.strip() for part in typed) + ', ')
+
+@st.fragment
+def tag_input(key):
+    """Tags field with suggestions for the tag being typed; read it with draft_text('tags', key)"""
+    restore_draft('tags', key)
+    text = st.text_input("🏷️ Tags", key=f"tags_{key}", on_change=keep_draft, args=('tags', key),
+                         placeholder=f"Comma separated, up to {tagging.MAX_TAGS} (e.g. python, sqlite)")
+    typing = text.split(',')[-1].strip()
+    suggestions = tagging.autocomplete(typing, limit=6) if typing else []
+    if suggestions:
+        cols = st.columns(len(suggestions))
+        for col, tag in zip(cols, suggestions):
+            with col:
+                st.button(f"#{tag['name']} ({tag['post_count']})", key=f"tag_suggest_{key}_{tag['name']}",
+                          on_click=complete_tag, args=(key, tag['name']))
+
+def display_rich_content(content, image_path=None, mentioned=()):
     """Display content with rich formatting and images"""
     if image_path and os.path.exists(image_path):
         # Display image at the top
         try:
-            image = Image.open(image_path)
-            st.image(image, use_column_width=True, caption="Featured Image")
+            st.image(image_source(image_path), use_column_width=True, caption="Featured Image")
             st.write("---")
         except Exception as e:
             st.error(f"Error displaying image: {e}")
     
     # Display formatted content
     if content:
-        formatted_content = format_content(content)
+        formatted_content = format_content(content, mentioned)
         st.markdown(formatted_content)
 
 # Session state initialization
@@ -289,65 +242,212 @@ if 'category_id' not in st.session_state:
 if 'search_query' not in st.session_state:
     st.session_state.search_query = ''
 
-# Initialize editor states
-if 'editor_create' not in st.session_state:
-    st.session_state.editor_create = ""
-if 'editor_edit' not in st.session_state:
-    st.session_state.editor_edit = ""
+# Restore the login from the session cookie (tokens used to travel in the URL,
+# where they leaked into history, logs and shared links; old links just drop it)
+if 'sid' in st.query_params:
+    del st.query_params['sid']
+if 'session_token' not in st.session_state:
+    st.session_state.session_token = st.context.cookies.get(SESSION_COOKIE)
+    st.session_state.session_checked_at = 0.0
+if (st.session_state.session_token
+        and time.time() - st.session_state.session_checked_at > SESSION_RECHECK_SECONDS):
+    st.session_state.user = sessions.load_session(st.session_state.session_token)
+    st.session_state.session_checked_at = time.time()
+    if st.session_state.user is None:
+        st.session_state.session_token = None
+
+def sync_session_cookie():
+    """Make the browser's cookie match this session's token (Streamlit can read cookies, not set them)"""
+    token = st.session_state.session_token
+    if token == st.context.cookies.get(SESSION_COOKIE):
+        return
+    cookie = f"{SESSION_COOKIE}={token}; Max-Age={sessions.SESSION_TTL}" if token else f"{SESSION_COOKIE}=; Max-Age=0"
+    components.html(f"<script>parent.document.cookie = {json.dumps(cookie + '; Path=/; SameSite=Strict')}"
+                    f" + (parent.location.protocol === 'https:' ? '; Secure' : '');</script>", height=0)
+
+# Rate limiting
+def client_ip():
+    """Client address (X-Forwarded-For only counts from FORUM_TRUSTED_PROXIES)"""
+    return ratelimit.client_address(getattr(st.context, 'ip_address', None),
+                                    st.context.headers.get('X-Forwarded-For'))
+
+def client_keys():
+    """Identifiers the rate limiter knows this browser session by"""
+    keys = []
+    if st.session_state.user:
+        keys.append(f"user:{st.session_state.user['id']}")
+    ctx = get_script_run_ctx()
+    if ctx:
+        keys.append(f"session:{ctx.session_id}")
+    ip = client_ip()
+    if ip:
+        keys.append(f"ip:{ip}")
+    return keys
+
+def slow_down(action, *extra_keys):
+    """Show a slow-down message and return True if the action is over budget"""
+    decision = ratelimit.check(action, *client_keys(), *extra_keys)
+    if not decision.allowed:
+        st.warning(f"⏳ {ratelimit.describe(decision)}")
+        return True
+    return False
 
 # Authentication functions
+def start_session(user):
+    st.session_state.session_token = sessions.create_session(user)
+    st.session_state.session_checked_at = time.time()
+    st.session_state.user = user
+
 def login_user(username, password):
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'SELECT id, username, password_hash, role FROM users WHERE username = ? OR email = ?',
-        (username, username)
-    )
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user and user[2] == hash_password(password):
-        st.session_state.user = {
-            'id': user[0],
-            'username': user[1],
-            'role': user[3]
-        }
+    user = service.authenticate(username, password)
+    if user:
+        start_session(user)
         return True
     return False
 
 def register_user(username, email, password):
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    try:
-        password_hash = hash_password(password)
-        cursor.execute(
-            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-            (username, email, password_hash)
-        )
-        conn.commit()
-        
+    user = service.register(username, email, password)
+    if user:
         # Auto login
-        cursor.execute('SELECT id, username, role FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        st.session_state.user = {
-            'id': user[0],
-            'username': user[1],
-            'role': user[2]
-        }
-        conn.close()
+        start_session(user)
         return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
+    return False
 
 def logout_user():
+    flush_reads()
+    if st.session_state.session_token:
+        sessions.destroy_session(st.session_state.session_token)
+        st.session_state.session_token = None
     st.session_state.user = None
     st.session_state.page = 'home'
     # Clear editor states
-    st.session_state.editor_create = ""
-    st.session_state.editor_edit = ""
+    clear_editor('create')
+    for name in [name for name in st.session_state if name.startswith('draft_editor_edit_')]:
+        clear_editor(name[len('draft_editor_'):])
+
+# Live updates: pages remember the change_log seq they were rendered at and
+# poll for newer rows inside a fragment, so only the fragment reruns
+def start_live_feed(name):
+    """Remember the current seq; call before loading the rows the page shows"""
+    feed = st.session_state[name] = {'seq': service.latest_seq(), 'rows': [], 'seen': set()}
+    return feed
+
+def poll_live_feed(name, fetch):
+    """Append rows logged since the last poll and return everything new so far"""
+    feed = st.session_state[name]
+    rows = fetch(feed['seq'])
+    if rows:
+        feed['seq'] = max(row['seq'] for row in rows)
+        for row in rows:
+            if row['id'] not in feed['seen']:
+                feed['seen'].add(row['id'])
+                feed['rows'].append(row)
+    return feed['rows']
+
+def forget_live_row(name, row_id):
+    feed = st.session_state.get(name)
+    if feed:
+        feed['rows'] = [row for row in feed['rows'] if row['id'] != row_id]
+
+# Read markers: how far the user has read each thread opened this session,
+# saved in one batch when a listing loads rather than on every page view
+def viewer_id():
+    return st.session_state.user['id'] if st.session_state.user else None
+
+def note_read(post_id, comments):
+    if st.session_state.user:
+        pending = st.session_state.setdefault('pending_reads', {})
+        last_seen = max((comment['id'] for comment in comments), default=0)
+        pending[post_id] = max(pending.get(post_id, 0), last_seen)
+
+def flush_reads():
+    pending = st.session_state.pop('pending_reads', None)
+    if pending and st.session_state.user:
+        service.mark_read(st.session_state.user['id'], pending)
+
+def unread_badge(post):
+    return f" | **🔴 {post['unread_count']} new**" if post['unread_count'] else ""
+
+@st.fragment(run_every=LIVE_UPDATE_SECONDS)
+def live_posts(category_id=None):
+    """New posts published since the listing was loaded"""
+    posts = poll_live_feed('live_posts', lambda seq: service.posts_since(seq, category_id))
+    if not posts:
+        return
+    st.info(f"🆕 {len(posts)} new post{'s' if len(posts) != 1 else ''} since you opened this page")
+    for post in sorted(posts, key=lambda row: row['seq'], reverse=True):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.write(f"**{post['title']}** — 👤 {post['username']} | 📂 {post['category_name']} | "
+                     f"🕒 {post['created_at'][:16]}")
+        with col2:
+            if st.button("📖 Read", key=f"live_read_{post['id']}", use_container_width=True):
+                st.session_state.page = 'view_post'
+                st.session_state.current_post = post['id']
+                st.rerun()
+
+@st.fragment(run_every=LIVE_UPDATE_SECONDS)
+def live_comments(post_id):
+    """Comments posted since the thread was loaded, appended below the others"""
+    comments = poll_live_feed('live_comments', lambda seq: service.comments_since(post_id, seq))
+    note_read(post_id, comments)
+    mentioned = mentions.resolve(comment['content'] for comment in comments)
+    authors = service.author_cards(comment['user_id'] for comment in comments)
+    for comment in comments:
+        render_comment(comment, mentioned, authors)
+
+@st.fragment(run_every=60)
+def forum_stats():
+    """Home page totals, refreshed in place once a minute"""
+    stats = service.get_stats()
+
+    # Display stats
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📊 Total Posts", stats['posts'])
+    with col2:
+        st.metric("👥 Total Users", stats['users'])
+    with col3:
+        st.metric("💬 Total Comments", stats['comments'])
+
+def home_post_card(post, key_prefix="", authors=None):
+    """One post in the home page listings; authors comes from service.author_cards"""
+    with st.container():
+        # Post header with better styling
+        avatar_col, col1, col2 = st.columns([0.4, 4, 1])
+        with avatar_col:
+            author_avatar((authors or {}).get(post[1]), width=40)
+        with col1:
+            # Pinned indicator
+            pin_indicator = "📌 " if post[8] else ""
+            st.write(f"### {pin_indicator}{post[3]}")
+            
+            # Metadata
+            st.write(f"""
+            **👤 {post['username']}** | **📂 {post['category_name']}** | **👁️ {post[7]}** | **💬 {post['comment_count']}** | **🕒 {post[5][:16]}**{unread_badge(post)}
+            """)
+            
+            # Content preview with image indicator
+            if post['image_path']:
+                st.write("🖼️ *Includes images*")
+            
+            content_preview = post[4][:200] + "..." if len(post[4]) > 200 else post[4]
+            st.write(content_preview)
+        
+        with col2:
+            if st.button("📖 Read More", key=f"{key_prefix}read_{post[0]}", use_container_width=True):
+                st.session_state.page = 'view_post'
+                st.session_state.current_post = post[0]
+                st.rerun()
+            
+            # Edit button for post owners and admins
+            if service.can_edit(st.session_state.user, post[1]):
+                if st.button("✏️ Edit", key=f"{key_prefix}edit_{post[0]}", use_container_width=True):
+                    st.session_state.page = 'edit_post'
+                    st.session_state.current_post = post[0]
+                    st.rerun()
+        
+        st.divider()
 
 # Page functions
 def show_home():
@@ -367,42 +467,24 @@ def show_home():
     
     if search_btn and search_query:
         st.session_state.search_query = search_query
+        st.session_state.pop('search_results', None)
         st.session_state.page = 'search'
         st.rerun()
     
     # Stats
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM posts')
-    total_posts = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM comments')
-    total_comments = cursor.fetchone()[0]
-    
-    # Display stats
-    col1, col2, col3 = st.columns(3)
-    with col1:
-        st.metric("📊 Total Posts", total_posts)
-    with col2:
-        st.metric("👥 Total Users", total_users)
-    with col3:
-        st.metric("💬 Total Comments", total_comments)
-    
+    forum_stats()
+
     # Categories with better styling
     st.subheader("📂 Categories")
-    categories = get_categories()
-    
+    categories = load_categories()
+    post_counts = service.category_post_counts()
+
     # Create columns for categories
     cols = st.columns(len(categories))
     for idx, cat in enumerate(categories):
         with cols[idx]:
-            cursor.execute('SELECT COUNT(*) FROM posts WHERE category_id = ?', (cat[0],))
-            post_count = cursor.fetchone()[0]
-            
+            post_count = post_counts.get(cat[0], 0)
+
             # Custom CSS for category buttons
             st.markdown(f"""
                 <div style='border: 2px solid {cat[3]}; border-radius: 10px; padding: 15px; text-align: center; margin: 5px;'>
@@ -417,58 +499,30 @@ def show_home():
                 st.session_state.category_id = cat[0]
                 st.rerun()
     
-    # Recent posts with improved formatting
-    st.subheader("📝 Recent Posts")
-    cursor.execute('''
-        SELECT p.*, u.username, c.name as category_name, c.color as category_color,
-               (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comment_count
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        JOIN categories c ON p.category_id = c.id
-        ORDER BY p.is_pinned DESC, p.created_at DESC
-        LIMIT 10
-    ''')
-    posts = cursor.fetchall()
-    conn.close()
-    
-    if not posts:
-        st.info("No posts yet. Be the first to share something! 🚀")
+    # Recent and trending posts with improved formatting
+    flush_reads()
+    if st.session_state.user and st.button("✔️ Mark all read"):
+        service.mark_all_read(st.session_state.user['id'])
+    # A radio rather than st.tabs, which would run both listings' queries on every render
+    listing = st.radio("Listing", ["📝 Recent Posts", "🔥 Trending"], key="home_listing", horizontal=True,
+                       label_visibility="collapsed")
+    if listing == "📝 Recent Posts":
+        feed = start_live_feed('live_posts')
+        posts = service.list_recent_posts(10, viewer_id())
+        feed['seen'].update(post['id'] for post in posts)
+        live_posts()
+        
+        if not posts:
+            st.info("No posts yet. Be the first to share something! 🚀")
+        else:
+            authors = service.author_cards(post[1] for post in posts)
+            for post in posts:
+                home_post_card(post, authors=authors)
     else:
+        posts = service.list_trending_posts(limit=10, viewer_id=viewer_id())
+        authors = service.author_cards(post[1] for post in posts)
         for post in posts:
-            with st.container():
-                # Post header with better styling
-                col1, col2 = st.columns([4, 1])
-                with col1:
-                    # Pinned indicator
-                    pin_indicator = "📌 " if post[8] else ""
-                    st.write(f"### {pin_indicator}{post[3]}")
-                    
-                    # Metadata
-                    st.write(f"""
-                    **👤 {post[9]}** | **📂 {post[10]}** | **👁️ {post[7]}** | **💬 {post[12]}** | **🕒 {post[5][:16]}**
-                    """)
-                    
-                    # Content preview with image indicator
-                    if post[9]:  # image_path
-                        st.write("🖼️ *Includes images*")
-                    
-                    content_preview = post[4][:200] + "..." if len(post[4]) > 200 else post[4]
-                    st.write(content_preview)
-                
-                with col2:
-                    if st.button("📖 Read More", key=f"read_{post[0]}", use_container_width=True):
-                        st.session_state.page = 'view_post'
-                        st.session_state.current_post = post[0]
-                        st.rerun()
-                    
-                    # Edit button for post owners and admins
-                    if st.session_state.user and (st.session_state.user['id'] == post[1] or st.session_state.user['role'] == 'admin'):
-                        if st.button("✏️ Edit", key=f"edit_{post[0]}", use_container_width=True):
-                            st.session_state.page = 'edit_post'
-                            st.session_state.current_post = post[0]
-                            st.rerun()
-                
-                st.divider()
+            home_post_card(post, "hot_", authors)
     
     # Create post button
     if st.session_state.user:
@@ -486,7 +540,9 @@ def show_login():
         
         if submit:
             if username and password:
-                if login_user(username, password):
+                if slow_down('login', f"account:{username.lower()}"):
+                    pass
+                elif login_user(username, password):
                     st.success("Login successful!")
                     st.session_state.page = 'home'
                     time.sleep(1)
@@ -517,7 +573,7 @@ def show_register():
                 st.error("Passwords do not match!")
             elif len(password) < 6:
                 st.error("Password must be at least 6 characters!")
-            else:
+            elif not slow_down('register'):
                 if register_user(username, email, password):
                     st.success("Registration successful! You are now logged in.")
                     st.session_state.page = 'home'
@@ -533,18 +589,20 @@ def show_register():
 def show_create_post():
     st.title("✏️ Create New Post")
     
-    categories = get_categories()
+    categories = load_categories()
     category_names = [cat[1] for cat in categories]
     category_ids = [cat[0] for cat in categories]
     
     # Rich Text Editor - Form se pehle
-    content = rich_text_editor("create", st.session_state.editor_create)
+    rich_text_editor("create")
+    tag_input("create")
     
     # Image upload section
     st.subheader("🖼️ Add Featured Image")
     uploaded_image = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg', 'gif'], key="create_image")
     
     if uploaded_image:
+        pil_image()
         st.image(uploaded_image, caption="Preview", width=300)
     
     # Form for basic post details
@@ -555,28 +613,27 @@ def show_create_post():
         submit = st.form_submit_button("Create Post", type="primary")
         
         if submit:
-            if title and content:
+            content = draft_text('editor', 'create')
+            if not (title and content):
+                st.error("Please fill in both title and content!")
+            elif not slow_down('post'):
                 category_id = category_ids[category_names.index(category)]
                 image_path = save_uploaded_image(uploaded_image, 'posts')
                 
-                conn = sqlite3.connect('forum.db', check_same_thread=False)
-                cursor = conn.cursor()
-                cursor.execute(
-                    'INSERT INTO posts (user_id, category_id, title, content, image_path) VALUES (?, ?, ?, ?, ?)',
-                    (st.session_state.user['id'], category_id, title, content, image_path)
-                )
-                conn.commit()
-                conn.close()
-                
-                # Clear editor state
-                st.session_state.editor_create = ""
-                
-                st.success("Post created successfully!")
-                st.session_state.page = 'home'
-                time.sleep(1)
-                st.rerun()
-            else:
-                st.error("Please fill in both title and content!")
+                try:
+                    service.create_post(st.session_state.user['id'], category_id, title, content, image_path,
+                                        draft_text('tags', 'create'))
+                except DuplicateContent as e:
+                    remove_upload(image_path)
+                    st.error(str(e))
+                else:
+                    # Clear editor state
+                    clear_editor('create')
+                    
+                    st.success("Post created successfully!")
+                    st.session_state.page = 'home'
+                    time.sleep(1)
+                    st.rerun()
     
     if st.button("← Back to Home"):
         st.session_state.page = 'home'
@@ -589,11 +646,7 @@ def show_edit_post():
         st.rerun()
         return
     
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM posts WHERE id = ?', (st.session_state.current_post,))
-    post = cursor.fetchone()
-    conn.close()
+    post = service.get_post(st.session_state.current_post)
     
     if not post:
         st.error("Post not found!")
@@ -602,7 +655,7 @@ def show_edit_post():
         return
     
     # Check ownership
-    if st.session_state.user['id'] != post[1] and st.session_state.user['role'] != 'admin':
+    if not service.can_edit(st.session_state.user, post[1]):
         st.error("You are not authorized to edit this post!")
         st.session_state.page = 'home'
         st.rerun()
@@ -610,7 +663,7 @@ def show_edit_post():
     
     st.title("✏️ Edit Post")
     
-    categories = get_categories()
+    categories = load_categories()
     category_names = [cat[1] for cat in categories]
     category_ids = [cat[0] for cat in categories]
     
@@ -621,12 +674,16 @@ def show_edit_post():
             current_category_name = cat[1]
             break
     
-    # Initialize editor content if not already set
-    if f'editor_edit' not in st.session_state or st.session_state.editor_edit == "":
-        st.session_state.editor_edit = post[4]
+    # Drafts are per post, so one left behind by another post's editor is never saved here
+    key = f"edit_{post[0]}"
+    if f'draft_editor_{key}' not in st.session_state:
+        set_draft('editor', key, post[4])
+    if f'draft_tags_{key}' not in st.session_state:
+        set_draft('tags', key, ', '.join(tagging.get_post_tags(post[0])))
     
     # Rich Text Editor - Form se pehle
-    content = rich_text_editor("edit", st.session_state.editor_edit)
+    rich_text_editor(key)
+    tag_input(key)
     
     # Current image
     if post[9]:  # image_path
@@ -643,6 +700,7 @@ def show_edit_post():
     uploaded_image = st.file_uploader("Upload New Image", type=['png', 'jpg', 'jpeg', 'gif'], key="edit_image")
     
     if uploaded_image:
+        pil_image()
         st.image(uploaded_image, caption="New Image Preview", width=300)
     
     # Form for basic post details
@@ -653,40 +711,35 @@ def show_edit_post():
         submit = st.form_submit_button("Update Post", type="primary")
         
         if submit:
+            content = draft_text('editor', key)
             if title and content:
                 category_id = category_ids[category_names.index(category)]
                 
-                # Handle image
+                # Handle image (the service removes the replaced file after saving)
                 if remove_image and post[9]:
-                    # Remove old image
-                    if os.path.exists(post[9]):
-                        os.remove(post[9])
                     image_path = None
                 elif uploaded_image:
-                    # Upload new image
-                    if post[9] and os.path.exists(post[9]):
-                        os.remove(post[9])  # Remove old image
-                    image_path = save_uploaded_image(uploaded_image, 'posts')
+                    # Keep the old image if the new one is rejected
+                    image_path = save_uploaded_image(uploaded_image, 'posts') or post[9]
                 else:
                     # Keep existing image
                     image_path = post[9]
                 
-                conn = sqlite3.connect('forum.db', check_same_thread=False)
-                cursor = conn.cursor()
-                cursor.execute(
-                    'UPDATE posts SET title = ?, content = ?, category_id = ?, image_path = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                    (title, content, category_id, image_path, st.session_state.current_post)
-                )
-                conn.commit()
-                conn.close()
-                
-                # Clear editor state
-                st.session_state.editor_edit = ""
-                
-                st.success("Post updated successfully!")
-                st.session_state.page = 'view_post'
-                time.sleep(1)
-                st.rerun()
+                try:
+                    service.update_post(st.session_state.current_post, title, content, category_id, image_path,
+                                        draft_text('tags', key))
+                except DuplicateContent as e:
+                    if image_path != post[9]:
+                        remove_upload(image_path)
+                    st.error(str(e))
+                else:
+                    # Clear editor state
+                    clear_editor(key)
+                    
+                    st.success("Post updated successfully!")
+                    st.session_state.page = 'view_post'
+                    time.sleep(1)
+                    st.rerun()
             else:
                 st.error("Please fill in all fields!")
     
@@ -694,16 +747,92 @@ def show_edit_post():
     with col1:
         if st.button("← Back to Post"):
             # Clear editor state
-            st.session_state.editor_edit = ""
+            clear_editor(key)
             st.session_state.page = 'view_post'
             st.rerun()
     with col2:
         if st.button("← Back to Home"):
             # Clear editor state
-            st.session_state.editor_edit = ""
+            clear_editor(key)
             st.session_state.page = 'home'
             st.rerun()
 
+def render_comment(comment, mentioned=(), authors=None):
+    with st.container():
+        avatar_col, col1, col2 = st.columns([0.4, 4, 1])
+        with avatar_col:
+            author_avatar((authors or {}).get(comment['user_id']))
+        with col1:
+            st.write(f"**{comment['username']}** - {comment['created_at']}")
+            
+            # Display comment content with formatting
+            comment_content = format_content(comment['content'], mentioned)
+            st.markdown(comment_content)
+            
+            # Display comment image if exists
+            if comment['image_path']:
+                display_image(comment['image_path'], width=200)
+        
+        with col2:
+            # Delete comment button for comment owners and admins
+            if service.can_edit(st.session_state.user, comment['user_id']):
+                if st.button("🗑️ Delete", key=f"del_comment_{comment['id']}"):
+                    # Also removes the comment image if exists
+                    service.delete_comment(comment['id'])
+                    forget_live_row('live_comments', comment['id'])
+                    st.success("Comment deleted!")
+                    st.rerun(scope="fragment")
+        st.divider()
+
+@st.fragment
+def comment_thread(post_id):
+    """Comments and the comment form; adding or deleting one reruns only this region"""
+    st.subheader("💬 Comments")
+    
+    # Get comments (remembering where the live feed picks up)
+    feed = start_live_feed('live_comments')
+    comments = service.list_comments(post_id)
+    feed['seen'].update(comment['id'] for comment in comments)
+    note_read(post_id, comments)
+    
+    if not comments:
+        st.info("No comments yet. Be the first to comment! 💬")
+    else:
+        # One lookup for every @mention and one for every author on the page
+        mentioned = mentions.resolve(comment['content'] for comment in comments)
+        authors = service.author_cards(comment['user_id'] for comment in comments)
+        for comment in comments:
+            render_comment(comment, mentioned, authors)
+    live_comments(post_id)
+    
+    # Add comment form
+    if st.session_state.user:
+        with st.form("add_comment_form", clear_on_submit=True):
+            comment_content = st.text_area("Add a comment", placeholder="Share your thoughts...", height=100)
+            
+            # Comment image upload
+            comment_image = st.file_uploader("Attach Image to Comment (optional)", 
+                                           type=['png', 'jpg', 'jpeg', 'gif'],
+                                           key="comment_image")
+            
+            submit = st.form_submit_button("💬 Post Comment")
+            
+            if submit:
+                if not comment_content:
+                    st.error("Please enter a comment!")
+                elif not slow_down('comment'):
+                    image_path = save_uploaded_image(comment_image, 'comments')
+                    try:
+                        service.add_comment(post_id, st.session_state.user['id'], comment_content, image_path)
+                    except DuplicateContent as e:
+                        remove_upload(image_path)
+                        st.error(str(e))
+                    else:
+                        st.success("Comment added successfully!")
+                        st.rerun(scope="fragment")
+    else:
+        st.info("Please login to post a comment.")
+
 def show_view_post():
     if not st.session_state.current_post:
         st.error("No post selected!")
@@ -711,21 +840,8 @@ def show_view_post():
         st.rerun()
         return
     
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
-    # Increment view count
-    cursor.execute('UPDATE posts SET views = views + 1 WHERE id = ?', (st.session_state.current_post,))
-    
-    # Get post details
-    cursor.execute('''
-        SELECT p.*, u.username, c.name as category_name, c.color as category_color
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        JOIN categories c ON p.category_id = c.id
-        WHERE p.id = ?
-    ''', (st.session_state.current_post,))
-    post = cursor.fetchone()
+    # Increment view count and get post details
+    post = service.view_post(st.session_state.current_post)
     
     if not post:
         st.error("Post not found!")
@@ -738,18 +854,21 @@ def show_view_post():
         st.title(f"📌 {post[3]}")
     else:
         st.title(post[3])
+    if post['archived']:
+        st.caption("📦 This thread is archived. A new comment brings it back.")
+    watch_toggle('post', post[0], "thread")
     
     # Post metadata
     col1, col2 = st.columns([3, 1])
     with col1:
-        st.write(f"**👤 By:** {post[9]} | **📂 Category:** {post[10]} | **👁️ Views:** {post[7]} | **🕒 Posted:** {post[5]}")
+        st.write(f"**👤 By:** {post['username']} | **📂 Category:** {post['category_name']} | **👁️ Views:** {post[7]} | **🕒 Posted:** {post[5]}")
     with col2:
         if st.button("← Back to Home"):
             st.session_state.page = 'home'
             st.rerun()
     
     # Edit and Delete buttons for post owners and admins
-    if st.session_state.user and (st.session_state.user['id'] == post[1] or st.session_state.user['role'] == 'admin'):
+    if service.can_edit(st.session_state.user, post[1]):
         col1, col2 = st.columns(2)
         with col1:
             if st.button("✏️ Edit Post", use_container_width=True):
@@ -757,12 +876,8 @@ def show_view_post():
                 st.rerun()
         with col2:
             if st.button("🗑️ Delete Post", use_container_width=True):
-                cursor.execute('DELETE FROM posts WHERE id = ?', (st.session_state.current_post,))
-                cursor.execute('DELETE FROM comments WHERE post_id = ?', (st.session_state.current_post,))
-                # Remove post image if exists
-                if post[9] and os.path.exists(post[9]):
-                    os.remove(post[9])
-                conn.commit()
+                # Also removes the post's and its comments' images
+                service.delete_post(st.session_state.current_post)
                 st.success("Post deleted successfully!")
                 st.session_state.page = 'home'
                 time.sleep(1)
@@ -771,81 +886,22 @@ def show_view_post():
     st.divider()
     
     # Display content with rich formatting
-    display_rich_content(post[4], post[9])
+    display_rich_content(post[4], post['image_path'], mentions.resolve([post[4]]))
+    
+    post_tags = tagging.get_post_tags(post[0])
+    if post_tags:
+        cols = st.columns(len(post_tags) + 1)
+        for col, tag in zip(cols, post_tags):
+            with col:
+                if st.button(f"🏷️ {tag}", key=f"post_tag_{tag}"):
+                    st.session_state.tag_filter = [tag]
+                    st.session_state.page = 'tags'
+                    st.rerun()
     
     st.divider()
     
     # Comments section
-    st.subheader("💬 Comments")
-    
-    # Get comments
-    cursor.execute('''
-        SELECT c.*, u.username
-        FROM comments c
-        JOIN users u ON c.user_id = u.id
-        WHERE c.post_id = ? AND c.parent_id IS NULL
-        ORDER BY c.created_at ASC
-    ''', (st.session_state.current_post,))
-    comments = cursor.fetchall()
-    
-    if not comments:
-        st.info("No comments yet. Be the first to comment! 💬")
-    else:
-        for comment in comments:
-            with st.container():
-                col1, col2 = st.columns([4, 1])
-                with col1:
-                    st.write(f"**{comment[6]}** - {comment[4]}")
-                    
-                    # Display comment content with formatting
-                    comment_content = format_content(comment[3])
-                    st.markdown(comment_content)
-                    
-                    # Display comment image if exists
-                    if comment[6]:  # image_path in comments
-                        display_image(comment[6], width=200)
-                
-                with col2:
-                    # Delete comment button for comment owners and admins
-                    if st.session_state.user and (st.session_state.user['id'] == comment[2] or st.session_state.user['role'] == 'admin'):
-                        if st.button("🗑️ Delete", key=f"del_comment_{comment[0]}"):
-                            cursor.execute('DELETE FROM comments WHERE id = ?', (comment[0],))
-                            # Remove comment image if exists
-                            if comment[6] and os.path.exists(comment[6]):
-                                os.remove(comment[6])
-                            conn.commit()
-                            st.success("Comment deleted!")
-                            st.rerun()
-                st.divider()
-    
-    # Add comment form
-    if st.session_state.user:
-        with st.form("add_comment_form", clear_on_submit=True):
-            comment_content = st.text_area("Add a comment", placeholder="Share your thoughts...", height=100)
-            
-            # Comment image upload
-            comment_image = st.file_uploader("Attach Image to Comment (optional)", 
-                                           type=['png', 'jpg', 'jpeg', 'gif'],
-                                           key="comment_image")
-            
-            submit = st.form_submit_button("💬 Post Comment")
-            
-            if submit:
-                if comment_content:
-                    image_path = save_uploaded_image(comment_image, 'comments')
-                    cursor.execute(
-                        'INSERT INTO comments (post_id, user_id, content, image_path) VALUES (?, ?, ?, ?)',
-                        (st.session_state.current_post, st.session_state.user['id'], comment_content, image_path)
-                    )
-                    conn.commit()
-                    st.success("Comment added successfully!")
-                    st.rerun()
-                else:
-                    st.error("Please enter a comment!")
-    else:
-        st.info("Please login to post a comment.")
-    
-    conn.close()
+    comment_thread(st.session_state.current_post)
 
 # ... (Other functions remain the same - profile, admin, category, search)
 
@@ -858,75 +914,59 @@ def show_profile():
     
     st.title("👤 User Profile")
     
-    user = get_user(st.session_state.user['id'])
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
+    # Cached alongside the session, refreshed when the avatar or role changes
+    user = sessions.get_profile(st.session_state.user['id'])
     
     # User info with avatar
     col1, col2 = st.columns([1, 3])
     with col1:
-        if user[7]:  # avatar path
-            display_image(user[7], width=150)
+        if user['avatar']:
+            display_image(user['avatar'], width=150)
         else:
             st.header("👤")
     with col2:
-        st.write(f"### {user[1]}")
-        st.write(f"**Email:** {user[2]}")
-        st.write(f"**Role:** {user[4]}")
-        st.write(f"**Member since:** {user[5][:10]}")
-        if user[6]:
-            st.write(f"**Bio:** {user[6]}")
+        st.write(f"### {user['username']}")
+        st.write(f"**Email:** {user['email']}")
+        st.write(f"**Role:** {user['role']}")
+        st.write(f"**Member since:** {user['created_at'][:10]}")
+        if user['bio']:
+            st.write(f"**Bio:** {user['bio']}")
     
     # Avatar upload
     with st.expander("Update Avatar"):
         avatar_file = st.file_uploader("Upload Avatar", type=['png', 'jpg', 'jpeg'])
         if st.button("Update Avatar"):
             if avatar_file:
-                # Remove old avatar if exists
-                if user[7] and os.path.exists(user[7]):
-                    os.remove(user[7])
-                
                 avatar_path = save_uploaded_image(avatar_file, 'avatars')
-                cursor.execute('UPDATE users SET avatar = ? WHERE id = ?', (avatar_path, user[0]))
-                conn.commit()
-                st.success("Avatar updated successfully!")
-                st.rerun()
+                if avatar_path:
+                    # Also removes the old avatar if exists
+                    service.update_avatar(user['id'], avatar_path)
+                    st.success("Avatar updated successfully!")
+                    st.rerun()
     
     st.divider()
     
     # User stats
-    cursor.execute('SELECT COUNT(*) FROM posts WHERE user_id = ?', (user[0],))
-    post_count = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM comments WHERE user_id = ?', (user[0],))
-    comment_count = cursor.fetchone()[0]
+    user_stats = service.get_user_stats(user['id'])
     
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("📝 Posts", post_count)
+        st.metric("📝 Posts", user_stats['posts'])
     with col2:
-        st.metric("💬 Comments", comment_count)
+        st.metric("💬 Comments", user_stats['comments'])
     
     st.divider()
     
     # Recent posts
     st.subheader("Recent Posts")
-    cursor.execute('''
-        SELECT p.*, c.name as category_name
-        FROM posts p
-        JOIN categories c ON p.category_id = c.id
-        WHERE p.user_id = ?
-        ORDER BY p.created_at DESC
-        LIMIT 5
-    ''', (user[0],))
-    posts = cursor.fetchall()
+    posts = service.list_user_posts(user['id'], 5)
     
     if not posts:
         st.info("No posts yet.")
     else:
         for post in posts:
             with st.container():
-                st.write(f"**{post[3]}** (in {post[9]})")
+                st.write(f"**{post[3]}** (in {post['category_name']})")
                 content_preview = post[4][:100] + "..." if len(post[4]) > 100 else post[4]
                 st.write(content_preview)
                 if st.button("View", key=f"view_my_post_{post[0]}"):
@@ -935,12 +975,202 @@ def show_profile():
                     st.rerun()
                 st.divider()
     
-    conn.close()
-    
     if st.button("← Back to Home"):
         st.session_state.page = 'home'
         st.rerun()
 
+TREND_RANGES = {"Last 48 hours": ('hour', 2), "Last 30 days": ('day', 30),
+                "Last 90 days": ('day', 90), "Last 12 months": ('day', 365)}
+
+@st.fragment
+def activity_trends():
+    """Admin trend charts, read from the rollup tables rather than the raw ones"""
+    period = st.selectbox("Period", list(TREND_RANGES), index=1, key="trend_period")
+    grain, days = TREND_RANGES[period]
+    since = time.time() - days * 86400
+    since = rollups.hour_bucket(since) if grain == 'hour' else rollups.day_bucket(since)
+
+    def chart(points, labels, draw=st.line_chart):
+        """Plot (label, bucket, count) points, one series per label"""
+        buckets = {}
+        for label, bucket, count in points:
+            buckets.setdefault(bucket, {'time': bucket, **dict.fromkeys(labels, 0)})[label] = count
+        if buckets:
+            draw([buckets[bucket] for bucket in sorted(buckets)], x='time', y=labels)
+        else:
+            st.caption("No activity recorded yet.")
+
+    def metric_chart(metrics):
+        chart([(label, row['bucket'], row['count'])
+               for label, metric in metrics.items() for row in rollups.series(metric, grain, since)],
+              list(metrics))
+
+    names = {category['id']: category['name'] for category in load_categories()}
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("**Posts and comments**")
+        metric_chart({"Posts": 'posts', "Comments": 'comments'})
+        st.markdown("**Posts per category**")
+        chart([(names.get(row['category_id'], str(row['category_id'])), row['bucket'], row['count'])
+               for row in rollups.series('posts', grain, since, by_category=True)],
+              list(names.values()), draw=st.bar_chart)
+    with col2:
+        st.markdown("**Registrations and active users**")
+        # Active users are only counted per day
+        metric_chart({"Registrations": 'registrations', "Active users": 'active_users'})
+        st.markdown("**Views**")
+        metric_chart({"Views": 'views'})
+
+def reset_moderation_page(name):
+    st.session_state.pop(f'mod_pages_{name}', None)
+
+def moderation_page(name, fetch):
+    """One keyset page of a moderation listing, with Newer/Older buttons"""
+    if f'mod_notice_{name}' in st.session_state:
+        st.success(st.session_state.pop(f'mod_notice_{name}'))
+    pages = st.session_state.setdefault(f'mod_pages_{name}', [None])
+    rows = fetch(pages[-1])
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        if st.button("← Newer", key=f"mod_newer_{name}", disabled=len(pages) == 1):
+            pages.pop()
+            st.rerun(scope="fragment")
+    with col2:
+        if st.button("Older →", key=f"mod_older_{name}", disabled=len(rows) < moderation.PAGE_SIZE):
+            pages.append(rows[-1]['id'])
+            st.rerun(scope="fragment")
+    with col3:
+        st.caption(f"Page {len(pages)}")
+    return rows
+
+def selected_ids(name, rows):
+    """Ids of the rows ticked in a moderation table"""
+    if not rows:
+        st.info("Nothing matches these filters.")
+        return []
+    event = st.dataframe([dict(row) for row in rows], key=f"mod_table_{name}", hide_index=True,
+                         on_select="rerun", selection_mode="multi-row", use_container_width=True)
+    return [rows[i]['id'] for i in event.selection.rows]
+
+def finish_moderation(name, message):
+    st.session_state.pop(f'mod_table_{name}', None)
+    st.session_state[f'mod_notice_{name}'] = message
+    st.rerun(scope="fragment")
+
+@st.fragment
+def moderate_users():
+    col1, col2 = st.columns(2)
+    with col1:
+        prefix = st.text_input("Username or email starts with", key="mod_user_prefix",
+                               on_change=reset_moderation_page, args=('users',))
+    with col2:
+        role = st.selectbox("Role", ['any', *moderation.ROLES], key="mod_user_role",
+                            on_change=reset_moderation_page, args=('users',))
+    rows = moderation_page('users', lambda before_id: moderation.list_users(
+        prefix.strip(), None if role == 'any' else role, before_id))
+    chosen = selected_ids('users', rows)
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        action = st.selectbox("Action", ['Delete', 'Set role'], key="mod_user_action")
+    with col2:
+        new_role = st.selectbox("New role", moderation.ROLES, key="mod_user_new_role",
+                                disabled=action != 'Set role')
+    with col3:
+        st.write("")
+        apply = st.button(f"Apply to {len(chosen)}", key="mod_user_apply", disabled=not chosen)
+    if apply:
+        # Posts, comments and images of deleted users go too; 'admin' is always skipped
+        if action == 'Delete':
+            count = moderation.delete_users(chosen)
+            finish_moderation('users', f"Deleted {count} users")
+        else:
+            count = moderation.set_roles(chosen, new_role)
+            finish_moderation('users', f"Set {count} users to {new_role}")
+
+@st.fragment
+def moderate_posts():
+    categories = load_categories()
+    names = {category['id']: category['name'] for category in categories}
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        author = st.text_input("Author", key="mod_post_author",
+                               on_change=reset_moderation_page, args=('posts',))
+    with col2:
+        category_id = st.selectbox("Category", [None, *names], format_func=lambda c: names.get(c, 'any'),
+                                   key="mod_post_category", on_change=reset_moderation_page, args=('posts',))
+    with col3:
+        pinned = st.selectbox("Pinned", [None, True, False], key="mod_post_pinned",
+                              format_func=lambda p: {None: 'any', True: 'pinned', False: 'not pinned'}[p],
+                              on_change=reset_moderation_page, args=('posts',))
+    author_id = moderation.user_id_for(author.strip()) if author.strip() else None
+    if author.strip() and author_id is None:
+        st.warning(f"No user named {author.strip()}")
+        return
+    rows = moderation_page('posts', lambda before_id: moderation.list_posts(
+        author_id, category_id, pinned, before_id))
+    chosen = selected_ids('posts', rows)
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        action = st.selectbox("Action", ['Delete', 'Pin', 'Unpin', 'Move'], key="mod_post_action")
+    with col2:
+        target = st.selectbox("Move to", list(names), format_func=names.get, key="mod_post_target",
+                              disabled=action != 'Move')
+    with col3:
+        st.write("")
+        apply = st.button(f"Apply to {len(chosen)}", key="mod_post_apply", disabled=not chosen)
+    if apply:
+        if action == 'Delete':
+            count = moderation.delete_posts(chosen)
+            finish_moderation('posts', f"Deleted {count} posts")
+        elif action == 'Move':
+            count = moderation.move_posts(chosen, target)
+            finish_moderation('posts', f"Moved {count} posts to {names[target]}")
+        else:
+            count = moderation.set_pinned(chosen, action == 'Pin')
+            finish_moderation('posts', f"{action}ned {count} posts")
+
+@st.fragment
+def moderate_comments():
+    col1, col2 = st.columns(2)
+    with col1:
+        author = st.text_input("Author", key="mod_comment_author",
+                               on_change=reset_moderation_page, args=('comments',))
+    with col2:
+        post_id = st.number_input("Post id", min_value=0, step=1, key="mod_comment_post",
+                                  help="0 for every thread", on_change=reset_moderation_page, args=('comments',))
+    author_id = moderation.user_id_for(author.strip()) if author.strip() else None
+    if author.strip() and author_id is None:
+        st.warning(f"No user named {author.strip()}")
+        return
+    rows = moderation_page('comments', lambda before_id: moderation.list_comments(
+        author_id, int(post_id) or None, before_id))
+    chosen = selected_ids('comments', rows)
+
+    if st.button(f"Delete {len(chosen)} comments", key="mod_comment_apply", disabled=not chosen):
+        count = moderation.delete_comments(chosen)
+        finish_moderation('comments', f"Deleted {count} comments")
+
+@st.fragment
+def moderate_duplicates():
+    """Posts and comments flagged as near-duplicates of earlier content (see dedupe.py)"""
+    kind = st.selectbox("Show", [None, 'post', 'comment'], key="mod_duplicate_kind",
+                        format_func=lambda k: {None: 'posts and comments', 'post': 'posts', 'comment': 'comments'}[k],
+                        on_change=reset_moderation_page, args=('duplicates',))
+    rows = moderation_page('duplicates', lambda before_id: moderation.list_duplicates(kind, before_id))
+    chosen = selected_ids('duplicates', rows)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button(f"Dismiss {len(chosen)} flags", key="mod_duplicate_dismiss", disabled=not chosen):
+            count = moderation.dismiss_duplicates(chosen)
+            finish_moderation('duplicates', f"Dismissed {count} flags")
+    with col2:
+        if st.button(f"Delete {len(chosen)} reposts", key="mod_duplicate_delete", disabled=not chosen):
+            count = moderation.delete_duplicates(chosen)
+            finish_moderation('duplicates', f"Deleted {count} reposts")
+
 def show_admin():
     if not st.session_state.user or st.session_state.user['role'] != 'admin':
         st.error("Admin access required!")
@@ -950,77 +1180,73 @@ def show_admin():
     
     st.title("⚙️ Admin Panel")
     
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    
     # Stats
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM posts')
-    total_posts = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM comments')
-    total_comments = cursor.fetchone()[0]
+    stats = service.get_stats()
     
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("👥 Total Users", total_users)
+        st.metric("👥 Total Users", stats['users'])
     with col2:
-        st.metric("📝 Total Posts", total_posts)
+        st.metric("📝 Total Posts", stats['posts'])
     with col3:
-        st.metric("💬 Total Comments", total_comments)
+        st.metric("💬 Total Comments", stats['comments'])
     
     st.divider()
     
     # Recent activity
     st.subheader("Recent Activity")
-    cursor.execute('''
-        SELECT p.title, u.username, p.created_at 
-        FROM posts p 
-        JOIN users u ON p.user_id = u.id 
-        ORDER BY p.created_at DESC 
-        LIMIT 5
-    ''')
-    recent_posts = cursor.fetchall()
+    recent_posts = service.recent_activity(5)
     
     for post in recent_posts:
         st.write(f"📝 **{post[1]}** posted: *{post[0]}* - {post[2][:16]}")
     
     st.divider()
     
-    # User management
-    st.subheader("User Management")
-    cursor.execute('SELECT id, username, email, role, created_at FROM users ORDER BY created_at DESC')
-    users = cursor.fetchall()
+    st.subheader("Activity Trends")
+    activity_trends()
     
-    for user in users:
-        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
-        with col1:
-            st.write(f"**{user[1]}**")
-        with col2:
-            # Hide email for privacy
-            email_display = user[2][:3] + "***" + user[2].split('@')[1] if '@' in user[2] else "***"
-            st.write(email_display)
-        with col3:
-            st.write(user[3])
-        with col4:
-            if user[1] != 'admin':  # Don't allow deleting admin
-                if st.button("Delete", key=f"del_user_{user[0]}"):
-                    cursor.execute('DELETE FROM users WHERE id = ?', (user[0],))
-                    # Also delete user's posts and comments
-                    cursor.execute('DELETE FROM posts WHERE user_id = ?', (user[0],))
-                    cursor.execute('DELETE FROM comments WHERE user_id = ?', (user[0],))
-                    conn.commit()
-                    st.success(f"User {user[1]} deleted!")
-                    st.rerun()
+    st.divider()
     
-    conn.close()
+    # Moderation: filter, page through and act on many rows at once
+    st.subheader("Moderation")
+    users_tab, posts_tab, comments_tab, duplicates_tab = st.tabs(
+        ["👥 Users", "📝 Posts", "💬 Comments", "🪞 Duplicates"])
+    with users_tab:
+        moderate_users()
+    with posts_tab:
+        moderate_posts()
+    with comments_tab:
+        moderate_comments()
+    with duplicates_tab:
+        moderate_duplicates()
     
     if st.button("← Back to Home"):
         st.session_state.page = 'home'
         st.rerun()
 
+def category_post_card(post, key_prefix="cat_", authors=None):
+    """One post in a category listing; authors comes from service.author_cards"""
+    with st.container():
+        avatar_col, col1, col2 = st.columns([0.4, 4, 1])
+        with avatar_col:
+            author_avatar((authors or {}).get(post[1]))
+        with col1:
+            pin_indicator = "📌 " if post[8] else ""
+            st.write(f"**{pin_indicator}{post[3]}**")
+            st.write(f"👤 **{post['username']}** | 👁️ **{post[7]}** | 🕒 **{post[5][:16]}**{unread_badge(post)}")
+            
+            content_preview = post[4][:200] + "..." if len(post[4]) > 200 else post[4]
+            st.write(content_preview)
+            
+            if post['image_path']:
+                st.write("🖼️ *Includes images*")
+        with col2:
+            if st.button("Read More", key=f"{key_prefix}read_{post[0]}", use_container_width=True):
+                st.session_state.page = 'view_post'
+                st.session_state.current_post = post[0]
+                st.rerun()
+        st.divider()
+
 def show_category():
     if not st.session_state.category_id:
         st.error("No category selected!")
@@ -1028,10 +1254,7 @@ def show_category():
         st.rerun()
         return
     
-    conn = sqlite3.connect('forum.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute('SELECT name, description FROM categories WHERE id = ?', (st.session_state.category_id,))
-    category = cursor.fetchone()
+    category = service.get_category(st.session_state.category_id)
     
     if not category:
         st.error("Category not found!")
@@ -1039,41 +1262,71 @@ def show_category():
         st.rerun()
         return
     
-    st.title(f"📂 {category[0]}")
-    if category[1]:
-        st.write(f"*{category[1]}*")
-    
-    posts = get_category_posts(st.session_state.category_id)
-    
-    if not posts:
-        st.info(f"No posts in {category[0]} yet. Be the first to post! 🚀")
+    st.title(f"📂 {category['name']}")
+    if category['description']:
+        st.write(f"*{category['description']}*")
+    watch_toggle('category', category['id'], "category")
+    
+    flush_reads()
+    listing = st.radio("Listing", ["📝 Recent", "🔥 Trending"], key="category_listing", horizontal=True,
+                       label_visibility="collapsed")
+    if listing == "📝 Recent":
+        feed = start_live_feed('live_posts')
+        posts = service.list_category_posts(st.session_state.category_id, viewer_id=viewer_id())
+        feed['seen'].update(post['id'] for post in posts)
+        live_posts(st.session_state.category_id)
+        
+        if not posts:
+            st.info(f"No posts in {category['name']} yet. Be the first to post! 🚀")
+        else:
+            authors = service.author_cards(post[1] for post in posts)
+            for post in posts:
+                category_post_card(post, authors=authors)
     else:
+        posts = service.list_trending_posts(st.session_state.category_id, limit=20, viewer_id=viewer_id())
+        authors = service.author_cards(post[1] for post in posts)
         for post in posts:
-            with st.container():
-                col1, col2 = st.columns([4, 1])
-                with col1:
-                    pin_indicator = "📌 " if post[8] else ""
-                    st.write(f"**{pin_indicator}{post[3]}**")
-                    st.write(f"👤 **{post[9]}** | 👁️ **{post[7]}** | 🕒 **{post[5][:16]}**")
-                    
-                    content_preview = post[4][:200] + "..." if len(post[4]) > 200 else post[4]
-                    st.write(content_preview)
-                    
-                    if post[9]:  # image_path
-                        st.write("🖼️ *Includes images*")
-                with col2:
-                    if st.button("Read More", key=f"cat_read_{post[0]}", use_container_width=True):
-                        st.session_state.page = 'view_post'
-                        st.session_state.current_post = post[0]
-                        st.rerun()
-                st.divider()
-    
-    conn.close()
+            category_post_card(post, "cat_hot_", authors)
     
     if st.button("← Back to Home"):
         st.session_state.page = 'home'
         st.rerun()
 
+def show_tags():
+    st.title("🏷️ Browse by Tags")
+    
+    categories = load_categories()
+    names = {category['id']: category['name'] for category in categories}
+    selected = st.session_state.get('tag_filter', [])
+    match = st.session_state.get('tag_match', 'all')
+    
+    # Facet counts come from the tag index, for whatever is selected right now
+    per_category = tagging.category_counts(selected, match)
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        category_id = st.selectbox(
+            "Category", [None, *names], key="tag_category",
+            format_func=lambda c: "All categories" if c is None else
+            f"{names[c]} ({per_category.get(c, 0)})" if selected else names[c]
+        )
+    with col2:
+        st.radio("Match", ['all', 'any'], key="tag_match", horizontal=True,
+                 format_func={'all': "All tags (AND)", 'any': "Any tag (OR)"}.get)
+    
+    facets = {row['name']: row['post_count'] for row in tagging.facet_counts(selected, match, category_id)}
+    st.multiselect("Tags", list(dict.fromkeys([*selected, *facets])), key="tag_filter",
+                   format_func=lambda tag: f"#{tag} ({facets[tag]})" if tag in facets else f"#{tag}")
+    
+    if not selected:
+        st.info("Pick one or more tags to see their posts.")
+        return
+    posts = service.list_tagged_posts(selected, match, category_id, viewer_id=viewer_id())
+    if not posts:
+        st.info("No posts match these tags.")
+    authors = service.author_cards(post[1] for post in posts)
+    for post in posts:
+        category_post_card(post, "tag_", authors)
+
 def show_search():
     if not st.session_state.search_query:
         st.session_state.page = 'home'
@@ -1082,9 +1335,19 @@ def show_search():
     
     st.title(f"🔍 Search Results for '{st.session_state.search_query}'")
     
-    results = search_posts(st.session_state.search_query)
+    # Reruns reuse the results; only a new query costs a search (and search budget)
+    cached = st.session_state.get('search_results')
+    if cached and cached[0] == st.session_state.search_query:
+        results = cached[1]
+    elif slow_down('search'):
+        results = None
+    else:
+        results = service.search_posts(st.session_state.search_query)
+        st.session_state.search_results = (st.session_state.search_query, results)
     
-    if not results:
+    if results is None:
+        pass
+    elif not results:
         st.info("No results found. Try different keywords.")
     else:
         st.write(f"**Found {len(results)} results:**")
@@ -1094,7 +1357,7 @@ def show_search():
                 col1, col2 = st.columns([4, 1])
                 with col1:
                     st.write(f"**{post[3]}**")
-                    st.write(f"👤 **{post[9]}** | 📂 **{post[10]}** | 👁️ **{post[7]}** | 🕒 **{post[5][:16]}**")
+                    st.write(f"👤 **{post['username']}** | 📂 **{post['category_name']}** | 👁️ **{post[7]}** | 🕒 **{post[5][:16]}**")
                     
                     # Highlight search terms in content
                     content = post[4]
@@ -1127,7 +1390,63 @@ def show_search():
         st.rerun()
 
 # Sidebar
-with st.sidebar:
+@st.fragment(run_every=30)
+def notification_badge():
+    """Sidebar notifications button, its unread count refreshed in place"""
+    if not st.session_state.user:
+        return
+    unread = service.unread_notification_count(st.session_state.user['id'], cap=100)
+    label = "🔔 Notifications" + (f" ({'99+' if unread > 99 else unread})" if unread else "")
+    if st.button(label, key="notifications_button", use_container_width=True,
+                 type="primary" if unread else "secondary"):
+        st.session_state.page = 'notifications'
+        st.rerun()
+
+def show_notifications():
+    if not st.session_state.user:
+        st.session_state.page = 'login'
+        st.rerun()
+        return
+    
+    st.title("🔔 Notifications")
+    user_id = st.session_state.user['id']
+    notifications = service.list_notifications(user_id)
+    # Exactly what's listed counts as seen, not older ones or ones fanned out since
+    service.mark_notifications_read(user_id, [note['id'] for note in notifications if not note['is_read']])
+    
+    if not notifications:
+        st.info("Nothing yet. Watch a thread or a category to hear about new activity.")
+    for note in notifications:
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            marker = "🔵 " if not note['is_read'] else ""
+            if note['kind'] == 'reply':
+                st.write(f"{marker}💬 **{note['actor_name']}** replied to *{note['post_title']}* - {note['created_at'][:16]}")
+            elif note['kind'] == 'mention':
+                st.write(f"{marker}📣 **{note['actor_name']}** mentioned you in *{note['post_title']}* - {note['created_at'][:16]}")
+            else:
+                st.write(f"{marker}📝 **{note['actor_name']}** posted *{note['post_title']}* - {note['created_at'][:16]}")
+        with col2:
+            if st.button("📖 Open", key=f"note_{note['id']}", use_container_width=True):
+                st.session_state.page = 'view_post'
+                st.session_state.current_post = note['post_id']
+                st.rerun()
+
+def watch_toggle(kind, target_id, label):
+    """Watch/unwatch button for a thread or category"""
+    if not st.session_state.user:
+        return
+    user_id = st.session_state.user['id']
+    if service.is_watching(user_id, kind, target_id):
+        if st.button(f"🔕 Unwatch {label}", key=f"unwatch_{kind}_{target_id}"):
+            service.unwatch(user_id, kind, target_id)
+            st.rerun()
+    elif st.button(f"🔔 Watch {label}", key=f"watch_{kind}_{target_id}"):
+        service.watch(user_id, kind, target_id)
+        st.rerun()
+
+def show_sidebar():
+    """Account and navigation; every button here switches page with a full rerun"""
     st.title("💬 Advanced Forum")
     
     if st.session_state.user:
@@ -1138,6 +1457,8 @@ with st.sidebar:
             st.session_state.page = 'profile'
             st.rerun()
         
+        notification_badge()
+        
         if st.session_state.user['role'] == 'admin':
             if st.button("⚙️ Admin Panel", use_container_width=True):
                 st.session_state.page = 'admin'
@@ -1166,6 +1487,10 @@ with st.sidebar:
         st.session_state.page = 'home'
         st.rerun()
     
+    if st.button("🏷️ Browse Tags", use_container_width=True):
+        st.session_state.page = 'tags'
+        st.rerun()
+    
     if st.session_state.user:
         if st.button("✏️ Create Post", use_container_width=True, type="primary"):
             st.session_state.page = 'create_post'
@@ -1175,7 +1500,7 @@ with st.sidebar:
     
     # Categories quick access
     st.subheader("Quick Categories")
-    categories = get_categories()
+    categories = load_categories()
     for cat in categories:
         if st.button(f"📁 {cat[1]}", key=f"sidebar_cat_{cat[0]}", use_container_width=True):
             st.session_state.page = 'category'
@@ -1186,6 +1511,10 @@ with st.sidebar:
     st.write("**Need Help?**")
     st.write("Contact forum administrator")
 
+with st.sidebar:
+    sync_session_cookie()
+    show_sidebar()
+
 # Main content based on current page
 if st.session_state.page == 'home':
     show_home()
@@ -1207,3 +1536,7 @@ elif st.session_state.page == 'category':
     show_category()
 elif st.session_state.page == 'search':
     show_search()
+elif st.session_state.page == 'notifications':
+    show_notifications()
+elif st.session_state.page == 'tags':
+    show_tags()
@@ -0,0 +1,251 @@
+"""Image upload handling for the forum.
+
+Uploads are streamed to a temp file in fixed-size chunks, checked against
+per-folder byte and pixel limits while they stream (so decompression bombs are
+rejected from their header, before PIL ever decodes them) and atomically
+renamed into place once they pass.
+
+Stored images are served by the API's /media route; image_url() turns a
+stored path into the URL pages should hand to the browser. Avatars shown next
+to posts and comments go through avatar_thumbnail(), which decodes each one
+once per process and keeps the small PNGs in a shared LRU cache. PIL itself
+is only imported when the first image is decoded (pil_image()).
+"""
+import functools
+import hashlib
+import io
+import os
+import re
+import secrets
+import struct
+import tempfile
+
+UPLOAD_ROOT = 'uploads'
+UPLOAD_FOLDERS = ('posts', 'comments', 'avatars')
+
+CHUNK_SIZE = 64 * 1024
+# JPEG dimensions live in the SOF marker, which can sit behind a large EXIF block
+HEADER_PEEK = 256 * 1024
+
+# Limits per upload role (the folder the image is stored in)
+UPLOAD_LIMITS = {
+    'posts': {'max_bytes': 8 * 1024 * 1024, 'max_pixels': 40_000_000, 'types': ('png', 'jpg', 'gif')},
+    'comments': {'max_bytes': 4 * 1024 * 1024, 'max_pixels': 20_000_000, 'types': ('png', 'jpg', 'gif')},
+    'avatars': {'max_bytes': 1 * 1024 * 1024, 'max_pixels': 4_000_000, 'types': ('png', 'jpg')},
+}
+
+# Public base URL of the API's /media route, e.g. http://localhost:8000/media.
+# When unset, pages fall back to passing local paths to st.image.
+MEDIA_URL = os.environ.get('FORUM_MEDIA_URL', '').rstrip('/')
+
+# Names written by store_upload: content hash, random suffix, detected type.
+# Files with these names never change, so they can be cached forever.
+IMMUTABLE_NAME = re.compile(r'^([0-9a-f]{32})_[0-9a-f]{8}\.(png|jpg|gif)$')
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif'}
+
+# Largest pixel count any stored image may have; used to cap PIL at display time
+MAX_IMAGE_PIXELS = max(limits['max_pixels'] for limits in UPLOAD_LIMITS.values())
+
+# Avatar thumbnails: edge length in pixels, and how many the process keeps
+AVATAR_THUMB_SIZE = 64
+AVATAR_CACHE_SIZE = 1024
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class UploadError(ValueError):
+    """Raised when an upload is rejected (too large, not an image, too many pixels)."""
+
+
+def sniff_image_type(head):
+    """Return 'png', 'jpg' or 'gif' from the file's magic bytes, or None"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'GIF87a') or head.startswith(b'GIF89a'):
+        return 'gif'
+    return None
+
+
+def read_image_size(kind, head):
+    """Return (width, height) parsed from the header bytes.
+
+    Returns None when more bytes are needed and raises UploadError when the
+    header is malformed.
+    """
+    if kind == 'png':
+        if len(head) < 24:
+            return None
+        if head[12:16] != b'IHDR':
+            raise UploadError("PNG header is missing its IHDR chunk")
+        return struct.unpack('>II', head[16:24])
+
+    if kind == 'gif':
+        if len(head) < 10:
+            return None
+        return struct.unpack('<HH', head[6:10])
+
+    if kind == 'jpg':
+        i = 2
+        while i + 4 <= len(head):
+            if head[i] != 0xFF:
+                raise UploadError("Corrupt JPEG marker stream")
+            marker = head[i + 1]
+            if marker == 0xFF:  # fill byte
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # markers without a payload
+                i += 2
+                continue
+            segment_length = struct.unpack('>H', head[i + 2:i + 4])[0]
+            if marker in _JPEG_SOF_MARKERS:
+                if i + 9 > len(head):
+                    return None
+                height, width = struct.unpack('>HH', head[i + 5:i + 9])
+                return width, height
+            i += 2 + segment_length
+        return None
+
+    raise UploadError(f"Unsupported image type: {kind}")
+
+
+def store_upload(fileobj, folder='posts'):
+    """Stream an uploaded image into uploads/<folder>/ and return its path.
+
+    The file name starts with the SHA-256 of the content so it can be served
+    with immutable caching; a random suffix keeps every upload its own file.
+    Raises UploadError if the upload breaks the folder's limits.
+    """
+    limits = UPLOAD_LIMITS[folder]
+    max_bytes = limits['max_bytes']
+
+    declared_size = getattr(fileobj, 'size', None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadError(f"Image is larger than {max_bytes // (1024 * 1024)} MB")
+
+    if hasattr(fileobj, 'seek'):
+        fileobj.seek(0)
+
+    target_dir = os.path.join(UPLOAD_ROOT, folder)
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix='.upload-', suffix='.part')
+
+    digest = hashlib.sha256()
+    head = bytearray()
+    total = 0
+    kind = None
+    size = None
+
+    def check_header(final):
+        nonlocal kind, size
+        if kind is None:
+            if len(head) < 8 and not final:
+                return
+            kind = sniff_image_type(bytes(head))
+            if kind not in limits['types']:
+                raise UploadError("File is not a supported image")
+        if size is None:
+            size = read_image_size(kind, bytes(head))
+            if size is None:
+                if final or len(head) >= HEADER_PEEK:
+                    raise UploadError("Could not read image dimensions")
+                return
+            width, height = size
+            if width == 0 or height == 0:
+                raise UploadError("Image has no pixels")
+            if width * height > limits['max_pixels']:
+                raise UploadError(f"Image is too large ({width}x{height} pixels)")
+
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise UploadError(f"Image is larger than {max_bytes // (1024 * 1024)} MB")
+                if size is None and len(head) < HEADER_PEEK:
+                    head += chunk[:HEADER_PEEK - len(head)]
+                    check_header(final=False)
+                digest.update(chunk)
+                out.write(chunk)
+            check_header(final=True)
+            out.flush()
+            os.fsync(out.fileno())
+
+        filename = f"{digest.hexdigest()[:32]}_{secrets.token_hex(4)}.{kind}"
+        file_path = os.path.join(target_dir, filename)
+        os.replace(tmp_path, file_path)
+        return file_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_upload(file_path):
+    """Delete a stored upload, ignoring paths that are already gone"""
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def resolve_upload(folder, filename):
+    """Map a /media/<folder>/<filename> request onto a stored file path, or None"""
+    if folder not in UPLOAD_FOLDERS or filename.startswith('.') or os.path.basename(filename) != filename:
+        return None
+    return os.path.join(UPLOAD_ROOT, folder, filename)
+
+
+def image_url(file_path):
+    """URL the browser should load a stored image from"""
+    if not MEDIA_URL or not file_path:
+        return file_path
+    folder, filename = os.path.split(os.path.relpath(file_path, UPLOAD_ROOT))
+    url = f"{MEDIA_URL}/{folder}/{filename}"
+    if not IMMUTABLE_NAME.match(filename):
+        # Older uploads aren't content-addressed; version them by mtime instead
+        try:
+            url += f"?v={int(os.path.getmtime(file_path))}"
+        except OSError:
+            pass
+    return url
+
+
+def pil_image():
+    """PIL.Image, imported on first use (pages without images never load it)
+
+    Capped so it refuses to decode anything bigger than the upload limits allow.
+    """
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    return Image
+
+
+@functools.lru_cache(maxsize=AVATAR_CACHE_SIZE)
+def _thumbnail(file_path, mtime, size):
+    Image = pil_image()
+    with Image.open(file_path) as image:
+        image.draft('RGB', (size, size))
+        image = image.convert('RGBA')
+        image.thumbnail((size, size))
+    out = io.BytesIO()
+    image.save(out, 'PNG', optimize=True)
+    return out.getvalue()
+
+
+def avatar_thumbnail(file_path, size=AVATAR_THUMB_SIZE):
+    """PNG bytes of a small square-bounded avatar, or None if it's missing or unreadable
+
+    Cached by path and mtime, so a page full of one author's comments decodes
+    their avatar once, and a replaced file is picked up.
+    """
+    if not file_path:
+        return None
+    try:
+        return _thumbnail(file_path, os.path.getmtime(file_path), size)
+    except Exception:
+        # Missing, unreadable or oversized files fall back to no avatar
+        return None
@@ -0,0 +1,133 @@
+"""@mentions: username autocomplete, batch resolution and a notification hook.
+
+Autocomplete reads an in-memory prefix index instead of running
+`username LIKE 'x%'` on every keystroke: a sorted list of casefolded
+usernames, so completing a prefix is one bisect and a short slice. Each
+process loads it on first use; register adds to it and the moderation
+delete path removes from it. Another process's changes only arrive when this
+one reloads, which it does once the index is INDEX_MAX_AGE seconds old.
+
+Rendering resolves every @name in a batch of texts with one query, so only
+real users are highlighted. Names match case-insensitively, like
+autocomplete (an exact-case match wins when both exist). Saving a post or comment resolves its
+mentions inside the same transaction and hands the events to each function
+in `hooks`; the default one stores 'mention' notifications.
+"""
+import bisect
+import json
+import re
+import threading
+import time
+
+from db import connection
+
+# Names may contain . and - but end on a word character, so "thanks @bob." mentions bob
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.-]*\w)')
+MAX_MENTIONS = 20
+INDEX_MAX_AGE = 300
+
+
+class PrefixIndex:
+    """Sorted (casefolded name, name) pairs, searched with bisect"""
+
+    def __init__(self, names=()):
+        self.entries = sorted((name.casefold(), name) for name in names)
+        self.loaded_at = time.monotonic()
+
+    def add(self, name):
+        entry = (name.casefold(), name)
+        i = bisect.bisect_left(self.entries, entry)
+        if i == len(self.entries) or self.entries[i] != entry:
+            self.entries.insert(i, entry)
+
+    def remove(self, name):
+        entry = (name.casefold(), name)
+        i = bisect.bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def complete(self, prefix, limit=8):
+        folded = prefix.casefold()
+        names = []
+        for i in range(bisect.bisect_left(self.entries, (folded,)), len(self.entries)):
+            key, name = self.entries[i]
+            if not key.startswith(folded) or len(names) == limit:
+                break
+            names.append(name)
+        return names
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """This process's index, (re)loaded when missing or older than INDEX_MAX_AGE"""
+    global _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _index.loaded_at > INDEX_MAX_AGE:
+            with connection() as conn:
+                _index = PrefixIndex(row[0] for row in conn.execute('SELECT username FROM users'))
+        return _index
+
+
+def complete(prefix, limit=8):
+    return get_index().complete(prefix, limit) if prefix else []
+
+
+def user_added(username):
+    if _index is not None:
+        with _index_lock:
+            _index.add(username)
+
+
+def users_removed(usernames):
+    if _index is not None:
+        with _index_lock:
+            for username in usernames:
+                _index.remove(username)
+
+
+# Resolution
+def extract(text):
+    """Distinct @names in text, in order of appearance"""
+    return list(dict.fromkeys(MENTION_RE.findall(text or '')))[:MAX_MENTIONS]
+
+
+def resolve(texts, conn=None):
+    """{name as written: user_id} for every @name in texts that is a real user, in one query"""
+    names = list(dict.fromkeys(name for text in texts for name in extract(text)))
+    if not names:
+        return {}
+    # CROSS JOIN keeps json_each outermost, so each name is an idx_users_username_nocase lookup;
+    # exact-case matches sort last, so they win in the dict
+    sql = '''
+        SELECT j.value, u.id FROM json_each(?) j
+        CROSS JOIN users u ON u.username = j.value COLLATE NOCASE
+        ORDER BY u.username = j.value
+    '''
+    if conn is not None:
+        return dict(conn.execute(sql, (json.dumps(names),)).fetchall())
+    with connection() as conn:
+        return dict(conn.execute(sql, (json.dumps(names),)).fetchall())
+
+
+def store_notifications(conn, events):
+    conn.executemany('''
+        INSERT INTO notifications (user_id, kind, post_id, comment_id, actor_id, created_at)
+        VALUES (?, 'mention', ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', [(event['user_id'], event['post_id'], event['comment_id'], event['actor_id']) for event in events])
+
+
+# Called as hook(conn, events) inside the saving transaction
+hooks = [store_notifications]
+
+
+def record(conn, text, actor_id, post_id, comment_id=None):
+    """Resolve the mentions in newly saved text and pass them to the hooks"""
+    events = [{'user_id': user_id, 'actor_id': actor_id, 'post_id': post_id, 'comment_id': comment_id}
+              for user_id in dict.fromkeys(resolve([text], conn).values()) if user_id != actor_id]
+    if events:
+        for hook in hooks:
+            hook(conn, events)
+    return events
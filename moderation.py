@@ -0,0 +1,249 @@
+"""Moderation console queries and bulk actions.
+
+Listings are paged with keyset pagination (id < the last id of the previous
+page). Each single filter has an index on (column, id) that reads the page in
+order: role through idx_users_role, author through idx_posts_user_id and
+idx_comments_user, category through idx_posts_category_id, pinned through
+idx_posts_pinned and thread through idx_comments_post_id, so with one filter
+a page costs the same on page 1 and page 1000. Username/email prefixes use
+the users' unique indexes. Emails are listed masked.
+
+Bulk actions take a list of ids and run one set-based statement per table
+(the ids go in as a JSON array expanded with json_each), all inside one
+transaction, so a hundred selected rows cost the same handful of statements
+as one. Deletions cover both tiers; files are removed after the commit.
+The built-in 'admin' account can't be deleted or demoted.
+"""
+import json
+
+import dedupe
+import mentions
+import sessions
+from db import connection, transaction
+from media import remove_upload
+
+PAGE_SIZE = 50
+ROLES = ('user', 'admin')
+
+IN_IDS = 'IN (SELECT value FROM json_each(?))'
+# First three characters and the domain, as the admin panel always showed it
+MASKED_EMAIL = ("CASE WHEN instr(u.email, '@') THEN substr(u.email, 1, 3) || '***' || "
+                "substr(u.email, instr(u.email, '@') + 1) ELSE '***' END")
+
+
+def _where(filters, before_id, alias):
+    """WHERE clause and params from (condition, *params) filters plus the keyset bound"""
+    if before_id is not None:
+        filters.append((f'{alias}.id < ?', before_id))
+    if not filters:
+        return '', []
+    clause = 'WHERE ' + ' AND '.join(condition for condition, *_ in filters)
+    return clause, [param for _, *params in filters for param in params]
+
+
+# Listings
+def list_users(prefix=None, role=None, before_id=None, limit=PAGE_SIZE):
+    """Users, newest first; prefix matches the start of the username (or email, if it has an @)"""
+    filters = []
+    if prefix:
+        column = 'email' if '@' in prefix else 'username'
+        # A range rather than LIKE, so the unique index on the column is used
+        filters.append((f'u.{column} >= ? AND u.{column} < ?', prefix, prefix + '\U0010ffff'))
+    if role:
+        filters.append(('u.role = ?', role))
+    clause, params = _where(filters, before_id, 'u')
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT u.id, u.username, {MASKED_EMAIL} as email, u.role, u.created_at
+            FROM users u
+            {clause}
+            ORDER BY u.id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+
+def user_id_for(username):
+    with connection() as conn:
+        row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+    return row[0] if row else None
+
+
+def list_posts(author_id=None, category_id=None, pinned=None, before_id=None, limit=PAGE_SIZE):
+    """Live posts, newest first, filtered by author, category and pinned flag"""
+    filters = []
+    if author_id is not None:
+        filters.append(('p.user_id = ?', author_id))
+    if category_id is not None:
+        filters.append(('p.category_id = ?', category_id))
+    if pinned is not None:
+        filters.append(('p.is_pinned = ?', int(pinned)))
+    clause, params = _where(filters, before_id, 'p')
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT p.id, p.title, u.username, c.name as category_name, p.is_pinned, p.views, p.created_at
+            FROM posts p
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            {clause}
+            ORDER BY p.id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+
+def list_comments(author_id=None, post_id=None, before_id=None, limit=PAGE_SIZE):
+    """Live comments, newest first, filtered by author and thread"""
+    filters = []
+    if author_id is not None:
+        filters.append(('c.user_id = ?', author_id))
+    if post_id is not None:
+        filters.append(('c.post_id = ?', post_id))
+    clause, params = _where(filters, before_id, 'c')
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT c.id, c.post_id, u.username, substr(c.content, 1, 120) as content, c.created_at
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            {clause}
+            ORDER BY c.id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+
+def list_duplicates(kind=None, before_id=None, limit=PAGE_SIZE):
+    """Near-duplicate flags, newest first, with an excerpt of the flagged text and its author"""
+    filters = [('f.kind = ?', kind)] if kind else []
+    clause, params = _where(filters, before_id, 'f')
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT f.id, f.kind, f.item_id, u.username,
+                   substr(COALESCE(p.title, c.content), 1, 120) as excerpt,
+                   f.match_kind, f.match_id, round(f.similarity, 2) as similarity, f.created_at
+            FROM duplicate_flags f
+            LEFT JOIN posts p ON f.kind = 'post' AND p.id = f.item_id
+            LEFT JOIN comments c ON f.kind = 'comment' AND c.id = f.item_id
+            LEFT JOIN users u ON u.id = COALESCE(p.user_id, c.user_id)
+            {clause}
+            ORDER BY f.id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+
+# Bulk actions
+def _column(conn, sql, *params):
+    return [row[0] for row in conn.execute(sql, params) if row[0] is not None]
+
+
+def delete_users(user_ids):
+    """Delete users with their posts (and those posts' comments), comments and images"""
+    with transaction() as conn:
+        ids = json.dumps(_column(
+            conn, f"SELECT id FROM users WHERE id {IN_IDS} AND username != 'admin'", json.dumps(list(user_ids))
+        ))
+        image_paths = _column(conn, f'SELECT avatar FROM users WHERE id {IN_IDS}', ids)
+        usernames = _column(conn, f'SELECT username FROM users WHERE id {IN_IDS}', ids)
+        for schema in ('main', 'archive'):
+            their_posts = f'SELECT id FROM {schema}.posts WHERE user_id {IN_IDS}'
+            image_paths += _column(conn, f'''
+                SELECT image_path FROM {schema}.posts WHERE user_id {IN_IDS}
+                UNION ALL
+                SELECT image_path FROM {schema}.comments WHERE user_id {IN_IDS} OR post_id IN ({their_posts})
+            ''', ids, ids, ids)
+            conn.execute(f'DELETE FROM {schema}.comments WHERE user_id {IN_IDS} OR post_id IN ({their_posts})',
+                         (ids, ids))
+            for table, column in (('read_markers', 'post_id'), ('notifications', 'post_id'),
+                                  (f'{schema}.post_tags', 'post_id'),
+                                  ('subscriptions', "kind = 'post' AND target_id")):
+                conn.execute(f'DELETE FROM {table} WHERE {column} IN ({their_posts})', (ids,))
+            conn.execute(f'DELETE FROM {schema}.posts WHERE user_id {IN_IDS}', (ids,))
+        for table in ('read_markers', 'subscriptions', 'notifications'):
+            conn.execute(f'DELETE FROM {table} WHERE user_id {IN_IDS}', (ids,))
+        deleted = conn.execute(f'DELETE FROM users WHERE id {IN_IDS}', (ids,)).rowcount
+    for user_id in json.loads(ids):
+        sessions.invalidate_user(user_id)
+    mentions.users_removed(usernames)
+    for image_path in image_paths:
+        remove_upload(image_path)
+    return deleted
+
+
+def set_roles(user_ids, role):
+    if role not in ROLES:
+        raise ValueError(f"Unknown role: {role}")
+    with transaction() as conn:
+        changed = _column(
+            conn, f"SELECT id FROM users WHERE id {IN_IDS} AND username != 'admin'", json.dumps(list(user_ids))
+        )
+        conn.execute(f'UPDATE users SET role = ? WHERE id {IN_IDS}', (role, json.dumps(changed)))
+    for user_id in changed:
+        sessions.invalidate_user(user_id)
+    return len(changed)
+
+
+def delete_posts(post_ids):
+    """Delete posts (either tier) with their comments and images"""
+    ids = json.dumps(list(post_ids))
+    image_paths = []
+    deleted = 0
+    with transaction() as conn:
+        for schema in ('main', 'archive'):
+            image_paths += _column(conn, f'''
+                SELECT image_path FROM {schema}.posts WHERE id {IN_IDS}
+                UNION ALL
+                SELECT image_path FROM {schema}.comments WHERE post_id {IN_IDS}
+            ''', ids, ids)
+            conn.execute(f'DELETE FROM {schema}.comments WHERE post_id {IN_IDS}', (ids,))
+            deleted += conn.execute(f'DELETE FROM {schema}.posts WHERE id {IN_IDS}', (ids,)).rowcount
+        conn.execute(f'DELETE FROM read_markers WHERE post_id {IN_IDS}', (ids,))
+        conn.execute(f'DELETE FROM notifications WHERE post_id {IN_IDS}', (ids,))
+        conn.execute(f'DELETE FROM post_tags WHERE post_id {IN_IDS}', (ids,))
+        conn.execute(f'DELETE FROM archive.post_tags WHERE post_id {IN_IDS}', (ids,))
+        conn.execute(f"DELETE FROM subscriptions WHERE kind = 'post' AND target_id {IN_IDS}", (ids,))
+    for image_path in image_paths:
+        remove_upload(image_path)
+    return deleted
+
+
+def set_pinned(post_ids, pinned):
+    with transaction() as conn:
+        return conn.execute(f'UPDATE posts SET is_pinned = ? WHERE id {IN_IDS}',
+                            (int(pinned), json.dumps(list(post_ids)))).rowcount
+
+
+def move_posts(post_ids, category_id):
+    with transaction() as conn:
+        return conn.execute(f'UPDATE posts SET category_id = ? WHERE id {IN_IDS}',
+                            (category_id, json.dumps(list(post_ids)))).rowcount
+
+
+def delete_comments(comment_ids):
+    ids = json.dumps(list(comment_ids))
+    image_paths = []
+    deleted = 0
+    with transaction() as conn:
+        for schema in ('main', 'archive'):
+            image_paths += _column(conn, f'SELECT image_path FROM {schema}.comments WHERE id {IN_IDS}', ids)
+            deleted += conn.execute(f'DELETE FROM {schema}.comments WHERE id {IN_IDS}', (ids,)).rowcount
+    for image_path in image_paths:
+        remove_upload(image_path)
+    return deleted
+
+
+def dismiss_duplicates(flag_ids):
+    """Drop flags, keeping the flagged posts and comments (which are indexed as originals from now on)"""
+    ids = json.dumps(list(flag_ids))
+    with transaction() as conn:
+        flagged = conn.execute(f'SELECT kind, item_id FROM duplicate_flags WHERE id {IN_IDS}', (ids,)).fetchall()
+        for kind in ('post', 'comment'):
+            dedupe.index_items(conn, kind, [item_id for flag_kind, item_id in flagged if flag_kind == kind])
+        return conn.execute(f'DELETE FROM duplicate_flags WHERE id {IN_IDS}', (ids,)).rowcount
+
+
+def delete_duplicates(flag_ids):
+    """Delete the flagged posts and comments (and the flags)"""
+    with connection() as conn:
+        flagged = conn.execute(f'SELECT kind, item_id FROM duplicate_flags WHERE id {IN_IDS}',
+                               (json.dumps(list(flag_ids)),)).fetchall()
+    deleted = delete_posts([item_id for kind, item_id in flagged if kind == 'post'])
+    deleted += delete_comments([item_id for kind, item_id in flagged if kind == 'comment'])
+    dismiss_duplicates(flag_ids)
+    return deleted
@@ -0,0 +1,252 @@
+"""Operations tooling: online snapshots and routine maintenance.
+
+Copying forum.db while the app writes to it can tear the copy, so snapshots
+go through SQLite's online backup API, a few hundred pages per step with a
+short sleep in between so writers are never locked out for long (a step that
+sees another connection's write restarts the copy). Each snapshot directory
+holds both database tiers, hard links (or copies) of every upload they
+reference, and a manifest listing those files:
+
+    python ops.py backup [--dest backups] [--keep 7] [--no-uploads]
+    python ops.py maintain [--vacuum]
+    python ops.py backup --every 6      # repeat every 6 hours (cron works too)
+
+The live database is copied before the archive. An archiving run in between
+then leaves a thread in both copies, which the app tolerates, rather than in
+neither. The manifest is read from the snapshot itself, so it matches the
+copied data exactly; referenced files that are already gone are listed as
+missing.
+
+maintain runs PRAGMA optimize, ANALYZE, a WAL checkpoint, a sweep of expired
+sessions, stale rollup rows, old read notifications and the duplicate-detection
+entries of deleted content (see dedupe.py), a rebase of the hot scores (see
+ranking.py), and optionally VACUUM on both
+tiers, reporting how long each step took and how the file sizes changed.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+import dedupe
+import ranking
+import rollups
+from db import DB_PATH, archive_path, open_connection
+
+BACKUP_DIR = os.environ.get('FORUM_BACKUP_DIR', 'backups')
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+NOTIFICATION_KEEP_DAYS = 90
+
+# Every column that points at a file under uploads/
+UPLOAD_COLUMNS = [('posts', 'image_path'), ('comments', 'image_path'), ('users', 'avatar')]
+ARCHIVE_UPLOAD_COLUMNS = [('archive.posts', 'image_path'), ('archive.comments', 'image_path')]
+
+
+def file_size(path):
+    """Size of a database including its WAL, 0 if it doesn't exist"""
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def backup_database(source_path, target_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    """Copy a live database page-step by page-step; returns timing stats"""
+    steps = 0
+    total_pages = 0
+
+    def progress(_status, remaining, total):
+        nonlocal steps, total_pages
+        steps += 1
+        total_pages = total
+
+    start = time.perf_counter()
+    partial = target_path + '.part'
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(partial)
+    try:
+        source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        check = target.execute('PRAGMA quick_check').fetchone()[0]
+        # A standalone copy shouldn't need its -wal file next to it
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial, target_path)
+    return {
+        'file': os.path.basename(target_path),
+        'bytes': os.path.getsize(target_path),
+        'pages': total_pages,
+        'steps': steps,
+        'quick_check': check,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def referenced_uploads(snapshot_dir):
+    """Upload paths referenced by the snapshot's posts, comments and avatars"""
+    conn = sqlite3.connect(os.path.join(snapshot_dir, 'forum.db'))
+    try:
+        columns = list(UPLOAD_COLUMNS)
+        archive_file = os.path.join(snapshot_dir, 'forum_archive.db')
+        if os.path.exists(archive_file):
+            conn.execute('ATTACH DATABASE ? AS archive', (archive_file,))
+            columns += ARCHIVE_UPLOAD_COLUMNS
+        query = ' UNION '.join(f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL'
+                               for table, column in columns)
+        return sorted(row[0] for row in conn.execute(query))
+    finally:
+        conn.close()
+
+
+def snapshot_uploads(paths, snapshot_dir, copy_files=True):
+    """Link (or copy) each referenced upload into the snapshot; returns manifest entries"""
+    entries = []
+    for path in paths:
+        entry = {'path': path}
+        try:
+            stat = os.stat(path)
+        except OSError:
+            entry['missing'] = True
+            entries.append(entry)
+            continue
+        entry['bytes'] = stat.st_size
+        entry['mtime'] = int(stat.st_mtime)
+        if copy_files:
+            target = os.path.join(snapshot_dir, os.path.normpath(path).lstrip(os.sep))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                # Stored uploads are never rewritten in place, so a hard link is a safe copy
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+        entries.append(entry)
+    return entries
+
+
+def backup(db_path=DB_PATH, dest=BACKUP_DIR, copy_uploads=True, keep=None):
+    """Take one snapshot and return its manifest"""
+    started = datetime.now(timezone.utc)
+    snapshot_dir = os.path.join(dest, started.strftime('%Y%m%dT%H%M%S.%fZ'))
+    os.makedirs(snapshot_dir)
+
+    databases = [backup_database(db_path, os.path.join(snapshot_dir, 'forum.db'))]
+    if os.path.exists(archive_path(db_path)):
+        databases.append(backup_database(archive_path(db_path), os.path.join(snapshot_dir, 'forum_archive.db')))
+
+    uploads = snapshot_uploads(referenced_uploads(snapshot_dir), snapshot_dir, copy_uploads)
+    manifest = {
+        'created_at': started.isoformat(timespec='seconds'),
+        'source': os.path.abspath(db_path),
+        'databases': databases,
+        'uploads': uploads,
+        'uploads_copied': copy_uploads,
+        'missing_uploads': sum(1 for entry in uploads if entry.get('missing')),
+    }
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if keep:
+        prune_snapshots(dest, keep)
+    manifest['snapshot'] = snapshot_dir
+    return manifest
+
+
+def prune_snapshots(dest, keep):
+    """Delete all but the newest `keep` complete snapshots"""
+    snapshots = sorted(
+        name for name in os.listdir(dest)
+        if os.path.exists(os.path.join(dest, name, 'manifest.json'))
+    )
+    for name in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(dest, name))
+
+
+def maintain(db_path=DB_PATH, vacuum=False):
+    """Run the maintenance steps and return (step, seconds) timings plus file sizes"""
+    files = [db_path, archive_path(db_path)]
+    sizes_before = {path: file_size(path) for path in files}
+    conn = open_connection(db_path)
+    steps = [
+        ('optimize', 'PRAGMA optimize', ()),
+        ('analyze', 'ANALYZE', ()),
+        ('analyze archive', 'ANALYZE archive', ()),
+        ('expired sessions', 'DELETE FROM session_store WHERE expires_at <= ?', (time.time(),)),
+        ('old hourly rollups', 'DELETE FROM rollup_hourly WHERE bucket < ?',
+         (rollups.hour_bucket(time.time() - rollups.HOURLY_KEEP_DAYS * 86400),)),
+        ('read notifications', 'DELETE FROM notifications WHERE is_read = 1 AND created_at < ?',
+         (datetime.fromtimestamp(time.time() - NOTIFICATION_KEEP_DAYS * 86400, timezone.utc)
+          .strftime('%Y-%m-%d %H:%M:%S'),)),
+        ('active user marks', 'DELETE FROM rollup_active_users WHERE day < ?',
+         (rollups.day_bucket(time.time() - 86400),)),
+        *((name, sql, ()) for name, sql in dedupe.PRUNE_STEPS),
+        ('hot score rebase', ranking.rebase, ()),
+    ]
+    if vacuum:
+        steps += [('vacuum', 'VACUUM main', ()), ('vacuum archive', 'VACUUM archive', ())]
+    steps += [
+        ('checkpoint', 'PRAGMA main.wal_checkpoint(TRUNCATE)', ()),
+        ('checkpoint archive', 'PRAGMA archive.wal_checkpoint(TRUNCATE)', ()),
+    ]
+    timings = []
+    try:
+        for name, sql, params in steps:
+            start = time.perf_counter()
+            if callable(sql):
+                sql(conn, *params)
+            else:
+                conn.execute(sql, params)
+            conn.commit()
+            timings.append((name, round(time.perf_counter() - start, 3)))
+    finally:
+        conn.close()
+    sizes = {os.path.basename(path): (sizes_before[path], file_size(path)) for path in files}
+    return {'steps': timings, 'sizes': sizes}
+
+
+def print_backup(manifest):
+    print(f"Snapshot {manifest['snapshot']}")
+    for database in manifest['databases']:
+        print(f"  {database['file']:<18} {database['bytes'] / 1e6:>9.1f} MB  {database['pages']:>8} pages "
+              f"in {database['steps']} steps, {database['seconds']:.2f}s  quick_check: {database['quick_check']}")
+    print(f"  {len(manifest['uploads'])} referenced uploads, {manifest['missing_uploads']} missing")
+
+
+def print_maintenance(report):
+    for name, seconds in report['steps']:
+        print(f"  {name:<20} {seconds:>8.3f}s")
+    for name, (before, after) in report['sizes'].items():
+        print(f"  {name:<20} {before / 1e6:>8.1f} MB -> {after / 1e6:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('backup', 'maintain'))
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--dest', default=BACKUP_DIR, help='directory for snapshots')
+    parser.add_argument('--keep', type=int, help='keep only the newest N snapshots')
+    parser.add_argument('--no-uploads', action='store_true', help='list referenced uploads without copying them')
+    parser.add_argument('--vacuum', action='store_true', help='also VACUUM both tiers (rewrites the files)')
+    parser.add_argument('--every', type=float, help='repeat every N hours instead of running once')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    while True:
+        if args.command == 'backup':
+            report = backup(args.db, args.dest, not args.no_uploads, args.keep)
+            show = print_backup
+        else:
+            report = maintain(args.db, args.vacuum)
+            show = print_maintenance
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            show(report)
+        if not args.every:
+            return 0
+        time.sleep(args.every * 3600)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Hot/trending scores for posts.
+
+Every post keeps a decayed hotness score in posts.hot_score: a new post, each
+view and each comment add a weight that halves every HALF_LIFE seconds. So
+that old scores never need touching, weights are stored pre-scaled against a
+shared epoch instead of being decayed: an event at time t adds
+
+    weight * 2 ** ((t - epoch) / HALF_LIFE)
+
+and multiplying every score by the same factor doesn't change their order.
+Ranking is then just ORDER BY hot_score DESC over an index. The scale grows
+with time, so scores are periodically re-decayed in bulk: one UPDATE
+multiplies them all down and moves the epoch forward (`rebase`). ops.py
+maintain does that, off the request path. boost() only falls back to it
+after REBASE_FORCE_AFTER half-lives without one, well before the scale could
+overflow a float (2 ** 1024):
+
+    python ranking.py rebase     # re-decay scores and move the epoch to now
+    python ranking.py rebuild    # recompute every score from views and comments
+"""
+import argparse
+import os
+import sys
+import time
+
+from db import DB_PATH, open_connection
+
+HALF_LIFE = float(os.environ.get('FORUM_HOT_HALF_LIFE_HOURS', '12')) * 3600
+
+# Score added per event
+POST_WEIGHT = 10.0
+VIEW_WEIGHT = 1.0
+COMMENT_WEIGHT = 5.0
+
+# boost() rebases inside its own transaction once the scale factor reaches
+# 2 ** REBASE_FORCE_AFTER (about 450 days with the default half-life)
+REBASE_FORCE_AFTER = 900
+
+
+def get_epoch(conn):
+    return conn.execute('SELECT epoch FROM ranking_state WHERE id = 1').fetchone()[0]
+
+
+def event_weight(weight, timestamp, epoch):
+    return weight * 2.0 ** ((timestamp - epoch) / HALF_LIFE)
+
+
+def boost(conn, post_id, weight, now=None):
+    """Add an event's weight to a post's score (inside the caller's transaction)"""
+    now = time.time() if now is None else now
+    epoch = get_epoch(conn)
+    if (now - epoch) / HALF_LIFE > REBASE_FORCE_AFTER:
+        epoch = rebase(conn, now)
+    conn.execute('UPDATE posts SET hot_score = hot_score + ? WHERE id = ?',
+                 (event_weight(weight, now, epoch), post_id))
+
+
+def rebase(conn, now=None):
+    """Decay every score to a new epoch in one statement and return the epoch"""
+    now = time.time() if now is None else now
+    factor = 2.0 ** ((get_epoch(conn) - now) / HALF_LIFE)
+    conn.execute('UPDATE posts SET hot_score = hot_score * ? WHERE hot_score != 0', (factor,))
+    conn.execute('UPDATE ranking_state SET epoch = ? WHERE id = 1', (now,))
+    return now
+
+
+def rebuild_scores(conn, now=None):
+    """Recompute every score from post and comment timestamps
+
+    Views carry no timestamp, so they count as of the post's creation.
+    """
+    now = time.time() if now is None else now
+    conn.create_function('event_weight', 3, event_weight, deterministic=True)
+    conn.execute('UPDATE ranking_state SET epoch = ? WHERE id = 1', (now,))
+    conn.execute('''
+        UPDATE posts SET hot_score =
+            event_weight(? + views * ?, CAST(strftime('%s', created_at) AS REAL), ?)
+            + COALESCE((SELECT SUM(event_weight(?, CAST(strftime('%s', c.created_at) AS REAL), ?))
+                        FROM comments c WHERE c.post_id = posts.id), 0)
+    ''', (POST_WEIGHT, VIEW_WEIGHT, now, COMMENT_WEIGHT, now))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('rebase', 'rebuild'))
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args(argv)
+
+    conn = open_connection(args.db)
+    start = time.perf_counter()
+    with conn:
+        if args.command == 'rebase':
+            rebase(conn)
+        else:
+            rebuild_scores(conn)
+    conn.close()
+    print(f"{args.command} done in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Rate limiting for logins, registrations, posting, commenting and search.
+
+Each action has a budget. Callers pass the keys a request is known by (user
+id, session, IP); the action is allowed only if every key is still within
+budget, so rotating one identifier doesn't get around the limit.
+
+Two algorithms are available per action:
+
+    bucket   token bucket: steady refill with a burst allowance (posting, search)
+    window   sliding-window counter: at most N per period (logins, registrations)
+
+The default backend keeps state in process memory and decides in a few
+microseconds. Set FORUM_RATELIMIT_BACKEND=redis://... to share budgets across
+nodes through a Redis-compatible server (each decision is one atomic script).
+
+Clients are limited by the address they connect from. X-Forwarded-For is only
+believed when the connection comes from a proxy listed in
+FORUM_TRUSTED_PROXIES (comma-separated addresses or networks, e.g.
+10.0.0.0/8); otherwise anyone could dodge the per-IP budgets by sending a new
+header with each request.
+"""
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+
+Limit = namedtuple('Limit', 'algorithm rate period burst')
+Decision = namedtuple('Decision', 'allowed retry_after')
+
+ALLOWED = Decision(True, 0.0)
+
+# Per-action budgets: rate events per period (seconds); burst is the bucket size
+LIMITS = {
+    'login': Limit('window', 5, 60, None),
+    'register': Limit('window', 3, 3600, None),
+    'post': Limit('bucket', 3, 60, 5),
+    'comment': Limit('bucket', 10, 60, 10),
+    'search': Limit('bucket', 20, 60, 10),
+    # HTTP Basic checks a password on every API call, so it gets its own larger budget
+    'api_auth': Limit('bucket', 60, 60, 30),
+}
+
+TRUSTED_PROXIES = [ipaddress.ip_network(entry.strip(), strict=False)
+                   for entry in os.environ.get('FORUM_TRUSTED_PROXIES', '').split(',') if entry.strip()]
+
+
+def _trusted(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def _window_retry(current, previous, rate, elapsed):
+    """Fraction of a period until the weighted window estimate drops below rate again"""
+    remaining = 1 - elapsed
+    needed = previous * remaining + current - rate + 1
+    # The previous window's share decays before the rollover...
+    if previous and needed / previous <= remaining:
+        return needed / previous
+    # ...otherwise wait for it, after which this window's hits decay as the previous one
+    if current:
+        return remaining + max(0, (current - rate + 1) / current)
+    return remaining
+
+
+def client_address(peer, forwarded=None):
+    """Address to limit a client by: the peer, or behind trusted proxies the last hop they didn't add"""
+    if not forwarded or not peer or not _trusted(peer):
+        return peer
+    hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+class MemoryBackend:
+    """Process-local limiter state behind one lock"""
+
+    PRUNE_EVERY = 10000
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def hit(self, key, limit, now):
+        with self._lock:
+            self._ops += 1
+            if self._ops % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            if limit.algorithm == 'bucket':
+                return self._bucket(key, limit, now)
+            return self._window(key, limit, now)
+
+    def _bucket(self, key, limit, now):
+        refill = limit.rate / limit.period
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = [float(limit.burst), now, limit]
+        tokens = min(limit.burst, state[0] + (now - state[1]) * refill)
+        state[1] = now
+        if tokens >= 1:
+            state[0] = tokens - 1
+            return ALLOWED
+        state[0] = tokens
+        return Decision(False, (1 - tokens) / refill)
+
+    def _window(self, key, limit, now):
+        # Weighted count over the current and previous fixed windows
+        window = int(now // limit.period)
+        state = self._state.get(key)
+        if state is None or state[0] < window - 1:
+            state = self._state[key] = [window, 0, 0, limit]
+        elif state[0] == window - 1:
+            state[0], state[1], state[2] = window, 0, state[1]
+        elapsed = now / limit.period - window
+        estimate = state[2] * (1 - elapsed) + state[1]
+        if estimate < limit.rate:
+            state[1] += 1
+            return ALLOWED
+        return Decision(False, _window_retry(state[1], state[2], limit.rate, elapsed) * limit.period)
+
+    def _prune(self, now):
+        """Drop keys whose state has gone back to a fresh budget"""
+        stale = []
+        for key, state in self._state.items():
+            limit = state[-1]
+            if limit.algorithm == 'bucket':
+                idle = now - state[1] >= limit.period * limit.burst / limit.rate
+            else:
+                idle = state[0] < int(now // limit.period) - 1
+            if idle:
+                stale.append(key)
+        for key in stale:
+            del self._state[key]
+
+
+_BUCKET_SCRIPT = '''
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local burst, refill, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - at) * refill)
+local retry = 0
+if tokens >= 1 then tokens = tokens - 1 else retry = (1 - tokens) / refill end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / refill) + 1)
+return tostring(retry)
+'''
+
+_WINDOW_SCRIPT = '''
+local rate, period, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local window = math.floor(now / period)
+local current = tonumber(redis.call('GET', KEYS[1] .. ':' .. window)) or 0
+local previous = tonumber(redis.call('GET', KEYS[1] .. ':' .. (window - 1))) or 0
+local elapsed = now / period - window
+local estimate = previous * (1 - elapsed) + current
+if estimate < rate then
+    redis.call('INCR', KEYS[1] .. ':' .. window)
+    redis.call('EXPIRE', KEYS[1] .. ':' .. window, period * 2)
+    return '0'
+end
+local retry = 1 - elapsed
+if previous > 0 and (estimate - rate + 1) / previous <= retry then
+    retry = (estimate - rate + 1) / previous
+elseif current > 0 then
+    retry = retry + math.max(0, (current - rate + 1) / current)
+end
+return tostring(retry * period)
+'''
+
+
+class RedisBackend:
+    """Limiter state shared through a Redis-compatible server"""
+
+    def __init__(self, client, prefix='forum:ratelimit:'):
+        self.prefix = prefix
+        self._bucket = client.register_script(_BUCKET_SCRIPT)
+        self._window = client.register_script(_WINDOW_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+
+        return cls(redis.Redis.from_url(url))
+
+    def hit(self, key, limit, now):
+        if limit.algorithm == 'bucket':
+            retry = float(self._bucket(keys=[self.prefix + key], args=[limit.burst, limit.rate / limit.period, now]))
+        else:
+            retry = float(self._window(keys=[self.prefix + key], args=[limit.rate, limit.period, now]))
+        return ALLOWED if retry == 0 else Decision(False, retry)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                spec = os.environ.get('FORUM_RATELIMIT_BACKEND', 'memory')
+                _backend = MemoryBackend() if spec == 'memory' else RedisBackend.from_url(spec)
+    return _backend
+
+
+def check(action, *keys):
+    """Spend one unit of the action's budget for every key; deny if any key is out"""
+    limit = LIMITS[action]
+    backend = get_backend()
+    now = time.time()
+    retry_after = 0.0
+    for key in keys:
+        if key is None:
+            continue
+        decision = backend.hit(f'{action}:{key}', limit, now)
+        if not decision.allowed:
+            retry_after = max(retry_after, decision.retry_after)
+    return ALLOWED if retry_after == 0 else Decision(False, retry_after)
+
+
+def describe(decision):
+    """Human-readable 'slow down' text for a denied decision"""
+    seconds = max(1, math.ceil(decision.retry_after))
+    wait = f"{seconds} seconds" if seconds < 120 else f"{math.ceil(seconds / 60)} minutes"
+    return f"You're doing that too often. Please slow down and try again in {wait}."
@@ -0,0 +1,186 @@
+"""Activity rollups: hourly and daily counters for the admin trend charts.
+
+Every post, comment, registration and view adds one to a counter row keyed by
+(metric, category_id, bucket) in rollup_hourly and rollup_daily, inside the
+transaction that wrote the event. Buckets are UTC, formatted like created_at
+('2026-01-31 14:00:00' and '2026-01-31'), and category_id is 0 for metrics
+that have no category. A chart over months then reads a few hundred daily
+rows instead of grouping the raw tables.
+
+Active users (anyone who posted or commented that day) can't be summed from
+smaller buckets, so each (day, user) is marked once in rollup_active_users and
+only the first mark counts. Marks are only needed for the current day, and
+`ops.py maintain` drops old ones along with hourly rows past HOURLY_KEEP_DAYS.
+
+Data from before the rollups existed (or from a bulk load) is rebuilt from the
+raw tables of both tiers:
+
+    python rollups.py backfill                   # posts, comments, registrations, active users
+    python rollups.py backfill --since 2025-06-01
+    python rollups.py backfill --metrics views   # approximate, see backfill_metric()
+
+Each metric is rebuilt in its own write transaction, so live increments
+recorded afterwards land on top of the rebuilt counts.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+
+from db import DB_PATH, connection, open_connection
+
+METRICS = ('posts', 'comments', 'registrations', 'views', 'active_users')
+BACKFILL_METRICS = ('posts', 'comments', 'registrations', 'active_users')
+
+HOURLY_KEEP_DAYS = 30
+
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+DAY_FORMAT = '%Y-%m-%d'
+
+# SQL expressions that bucket a created_at column the same way
+BUCKET_SQL = {'rollup_hourly': "strftime('%Y-%m-%d %H:00:00', {column})", 'rollup_daily': 'date({column})'}
+
+
+def hour_bucket(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(HOUR_FORMAT)
+
+
+def day_bucket(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(DAY_FORMAT)
+
+
+# Recording (inside the caller's transaction)
+def _add(conn, table, metric, category_id, bucket, count):
+    conn.execute(f'''
+        INSERT INTO {table} (metric, category_id, bucket, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (metric, category_id, bucket) DO UPDATE SET count = count + excluded.count
+    ''', (metric, category_id, bucket, count))
+
+
+def record(conn, metric, category_id=0, count=1, now=None):
+    """Add an event to its hourly and daily buckets"""
+    now = time.time() if now is None else now
+    _add(conn, 'rollup_hourly', metric, category_id, hour_bucket(now), count)
+    _add(conn, 'rollup_daily', metric, category_id, day_bucket(now), count)
+
+
+def record_post_event(conn, metric, post_id, now=None):
+    """record() under the category of a live post"""
+    row = conn.execute('SELECT category_id FROM posts WHERE id = ?', (post_id,)).fetchone()
+    if row:
+        record(conn, metric, row[0], now=now)
+
+
+def record_active(conn, user_id, now=None):
+    """Count a user as active today, once"""
+    now = time.time() if now is None else now
+    day = day_bucket(now)
+    marked = conn.execute('INSERT OR IGNORE INTO rollup_active_users (day, user_id) VALUES (?, ?)',
+                          (day, user_id)).rowcount
+    if marked:
+        _add(conn, 'rollup_daily', 'active_users', 0, day, 1)
+
+
+# Reading
+def series(metric, grain='day', since=None, by_category=False):
+    """(bucket, category_id, count) rows of one metric from `since` on, oldest first"""
+    table = 'rollup_hourly' if grain == 'hour' else 'rollup_daily'
+    category, group = ('category_id', ', category_id') if by_category else ('0', '')
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT bucket, {category} as category_id, SUM(count) as count
+            FROM {table}
+            WHERE metric = ? AND bucket >= ?
+            GROUP BY bucket{group}
+            ORDER BY bucket
+        ''', (metric, since or '')).fetchall()
+
+
+# Backfill
+def _backfill_sources(metric):
+    """(created_at column, category_id expression, FROM clause) per source table of a metric"""
+    if metric == 'registrations':
+        return [('created_at', '0', 'users')]
+    if metric in ('posts', 'views'):
+        return [('p.created_at', 'p.category_id', f'{schema}.posts p') for schema in ('main', 'archive')]
+    if metric == 'comments':
+        # Comments and their post always share a tier
+        return [('c.created_at', 'p.category_id', f'{schema}.comments c JOIN {schema}.posts p ON p.id = c.post_id')
+                for schema in ('main', 'archive')]
+    raise ValueError(f"Unknown metric: {metric}")
+
+
+def backfill_metric(conn, metric, since=''):
+    """Rebuild one metric's buckets from `since` on (inside the caller's transaction)
+
+    Views carry no timestamp, so they count as of the post's creation, like
+    ranking.rebuild_scores does.
+    """
+    if metric == 'active_users':
+        activity = '''
+            SELECT date(created_at) as day, user_id FROM main.posts WHERE created_at >= ?
+            UNION ALL SELECT date(created_at), user_id FROM main.comments WHERE created_at >= ?
+            UNION ALL SELECT date(created_at), user_id FROM archive.posts WHERE created_at >= ?
+            UNION ALL SELECT date(created_at), user_id FROM archive.comments WHERE created_at >= ?
+        '''
+        conn.execute("DELETE FROM rollup_daily WHERE metric = 'active_users' AND bucket >= ?", (since,))
+        conn.execute(f'''
+            INSERT INTO rollup_daily (metric, category_id, bucket, count)
+            SELECT 'active_users', 0, day, COUNT(DISTINCT user_id) FROM ({activity})
+            GROUP BY day
+        ''', (since,) * 4)
+        # Today's marks have to match the rebuilt count, or record_active() counts those users again
+        today = max(since, day_bucket(time.time()))
+        conn.execute('DELETE FROM rollup_active_users WHERE day >= ?', (today,))
+        conn.execute(f'''
+            INSERT OR IGNORE INTO rollup_active_users (day, user_id)
+            SELECT DISTINCT day, user_id FROM ({activity})
+        ''', (today,) * 4)
+        return
+    amount = 'SUM(p.views)' if metric == 'views' else 'COUNT(*)'
+    # Hourly rows older than HOURLY_KEEP_DAYS would only be pruned again
+    hourly_since = max(since, hour_bucket(time.time() - HOURLY_KEEP_DAYS * 86400))
+    for table, bucket_sql in BUCKET_SQL.items():
+        start = hourly_since if table == 'rollup_hourly' else since
+        conn.execute(f'DELETE FROM {table} WHERE metric = ? AND bucket >= ?', (metric, start))
+        for column, category, source in _backfill_sources(metric):
+            bucket = bucket_sql.format(column=column)
+            conn.execute(f'''
+                INSERT INTO {table} (metric, category_id, bucket, count)
+                SELECT ?, {category}, {bucket}, {amount}
+                FROM {source}
+                WHERE {column} >= ?
+                GROUP BY 2, 3
+                ON CONFLICT (metric, category_id, bucket) DO UPDATE SET count = count + excluded.count
+            ''', (metric, start))
+
+
+def backfill(conn, metrics=BACKFILL_METRICS, since=None, progress=None):
+    """Rebuild each metric in its own write transaction"""
+    for metric in metrics:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            backfill_metric(conn, metric, since or '')
+        if progress:
+            progress(metric)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('backfill',))
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--metrics', nargs='+', choices=METRICS, default=BACKFILL_METRICS)
+    parser.add_argument('--since', help='only rebuild buckets from this date (YYYY-MM-DD) on')
+    args = parser.parse_args(argv)
+
+    conn = open_connection(args.db)
+    start = time.perf_counter()
+    backfill(conn, args.metrics, args.since,
+             progress=lambda metric: print(f"  {metric:<14} {time.perf_counter() - start:>8.2f}s"))
+    conn.close()
+    print(f"backfill done in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
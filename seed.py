@@ -0,0 +1,289 @@
+"""Synthetic data generator for scaling and benchmark runs.
+
+Fills forum.db (or any database path) with users, posts, comments with
+parent_id reply chains and image references, using the real schema from
+db.setup_database. Everything is generated from one seeded RNG and a fixed
+clock, so the same arguments always produce the same database:
+
+    python seed.py --rows 1000 --db bench.db --reset
+    python seed.py --rows 10000000 --db big.db --reset
+
+Rows are streamed from generators straight into executemany inside a single
+transaction, so memory stays flat whatever the corpus size. Activity is
+skewed: a few prolific users write most of the content (Zipf), and a few hot
+posts collect most of the comments and views (Pareto).
+"""
+import argparse
+import bisect
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from db import DB_PATH, attach_archive, create_change_triggers, drop_change_triggers, setup_database
+from media import UPLOAD_ROOT
+from ranking import rebuild_scores
+from rollups import METRICS, backfill
+
+# Share of --rows given to each table
+ROW_SPLIT = {'users': 0.05, 'posts': 0.20, 'comments': 0.75}
+
+BATCH_SIZE = 50_000
+SEED_PASSWORD = 'password'
+
+WORDS = ('forum', 'python', 'sqlite', 'streamlit', 'question', 'answer', 'guide', 'method',
+         'tutorial', 'idea', 'cache', 'index', 'query', 'image', 'upload', 'thread', 'reply',
+         'latency', 'page', 'user', 'post', 'comment', 'search', 'profile', 'admin', 'category',
+         'review', 'deploy', 'server', 'browser', 'session', 'widget', 'layout', 'error', 'fix',
+         'release', 'feature', 'request', 'help', 'thanks', 'example', 'install', 'config')
+
+
+def tiny_png():
+    """A valid 1x1 PNG, so seeded image references decode like real uploads"""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    ihdr = struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) +
+            chunk(b'IDAT', zlib.compress(b'\x00\xff\xff\xff')) + chunk(b'IEND', b''))
+
+
+class ZipfPicker:
+    """Pick indexes 0..n-1 with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+        self.total = self.cumulative[-1]
+
+    def pick(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def batched(rows, size=BATCH_SIZE):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def seed_forum(db_path=DB_PATH, rows=None, users=None, posts=None, comments=None, images=20,
+               image_ratio=0.1, reply_ratio=0.5, max_depth=5, user_skew=1.1, post_skew=1.5,
+               days=365, end=datetime(2026, 1, 1), seed=1, reset=False, progress=None):
+    """Generate a corpus and return the number of rows written per table"""
+    if not post_skew > 1:
+        # The Pareto mean alpha / (alpha - 1) is infinite at 1 and negative below
+        raise ValueError(f"post_skew must be greater than 1, not {post_skew}")
+    for name, count in (('users', users), ('posts', posts)):
+        if count is not None and count < 1:
+            raise ValueError(f"{name} must be at least 1, not {count}")
+    rows = rows or 1000
+    users = users if users is not None else max(1, int(rows * ROW_SPLIT['users']))
+    posts = posts if posts is not None else max(1, int(rows * ROW_SPLIT['posts']))
+    comments = comments if comments is not None else int(rows * ROW_SPLIT['comments'])
+
+    setup_database(db_path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    attach_archive(conn, db_path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')
+    cursor = conn.cursor()
+
+    written = {}
+    timer = time.perf_counter()
+
+    def insert(table, sql, generator):
+        count = 0
+        for batch in batched(generator):
+            cursor.executemany(sql, batch)
+            count += len(batch)
+            if progress:
+                progress(table, count)
+        written[table] = count
+
+    cursor.execute('BEGIN')
+    try:
+        # History isn't news: keep the bulk load out of the live update feed
+        drop_change_triggers(cursor)
+        if reset:
+            cursor.execute('DELETE FROM change_log')
+            cursor.execute('DELETE FROM rollup_hourly')
+            cursor.execute('DELETE FROM rollup_daily')
+            cursor.execute('DELETE FROM read_markers')
+            cursor.execute('DELETE FROM subscriptions')
+            cursor.execute('DELETE FROM notifications')
+            cursor.execute('DELETE FROM post_tags')
+            cursor.execute('DELETE FROM archive.post_tags')
+            cursor.execute('DELETE FROM tags')
+            cursor.execute('DELETE FROM duplicate_flags')
+            cursor.execute('DELETE FROM minhash_buckets')
+            cursor.execute('DELETE FROM minhash_signatures')
+            cursor.execute('DELETE FROM archive.comments')
+            cursor.execute('DELETE FROM archive.posts')
+            cursor.execute('DELETE FROM comments')
+            cursor.execute('DELETE FROM posts')
+            cursor.execute("DELETE FROM users WHERE username != 'admin'")
+
+        first_user = (cursor.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0) + 1
+        first_post = (cursor.execute('SELECT MAX(id) FROM posts').fetchone()[0] or 0) + 1
+        first_comment = (cursor.execute('SELECT MAX(id) FROM comments').fetchone()[0] or 0) + 1
+        category_ids = [row[0] for row in cursor.execute('SELECT id FROM categories ORDER BY id')]
+        category_picker = ZipfPicker(len(category_ids), 0.8, rng)
+        user_picker = ZipfPicker(users, user_skew, rng)
+
+        start_time = end - timedelta(days=days)
+        span = days * 86400
+
+        def timestamp(offset_seconds):
+            return (start_time + timedelta(seconds=int(offset_seconds))).strftime('%Y-%m-%d %H:%M:%S')
+
+        # A pool of sentences keeps text generation cheap at ten million rows
+        sentences = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 14))).capitalize() + '.'
+                     for _ in range(4096)]
+
+        def text(min_sentences, max_sentences):
+            return ' '.join(rng.choices(sentences, k=rng.randint(min_sentences, max_sentences)))
+
+        password_hash = hashlib.sha256(SEED_PASSWORD.encode()).hexdigest()
+
+        def user_rows():
+            for i in range(users):
+                user_id = first_user + i
+                yield (user_id, f'user{user_id}', f'user{user_id}@example.com', password_hash,
+                       timestamp(span * i / users), text(0, 2))
+
+        insert('users',
+               'INSERT INTO users (id, username, email, password_hash, created_at, bio) VALUES (?, ?, ?, ?, ?, ?)',
+               user_rows())
+
+        image_paths = []
+        if images:
+            # Where the app resolves the stored paths from (the working directory), wherever the database is
+            folder = os.path.join(UPLOAD_ROOT, 'posts')
+            os.makedirs(folder, exist_ok=True)
+            png = tiny_png()
+            for i in range(images):
+                path = os.path.join(folder, f'seed_{i}.png')
+                with open(path, 'wb') as f:
+                    f.write(png)
+                image_paths.append(path)
+
+        # Pareto weights give each post its popularity (normalised to a mean of 1).
+        # They come from their own RNG so the comment pass can replay them
+        # instead of holding one weight per post in memory.
+        pareto_alpha = post_skew
+        pareto_mean = pareto_alpha / (pareto_alpha - 1)
+        comments_per_post = comments / posts
+
+        def popularity():
+            weights_rng = random.Random(seed + 1)
+            for _ in range(posts):
+                yield weights_rng.paretovariate(pareto_alpha) / pareto_mean
+
+        def post_rows():
+            for i, weight in enumerate(popularity()):
+                image_path = rng.choice(image_paths) if image_paths and rng.random() < image_ratio else None
+                created = timestamp(span * i / posts)
+                yield (first_post + i, first_user + user_picker.pick(),
+                       category_ids[category_picker.pick()], text(1, 2)[:120], text(2, 20),
+                       created, created, int(weight * rng.randint(5, 60)),
+                       1 if rng.random() < 0.001 else 0, image_path)
+
+        insert('posts',
+               'INSERT INTO posts (id, user_id, category_id, title, content, created_at, updated_at, views, '
+               'is_pinned, image_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+               post_rows())
+
+        def comment_rows():
+            comment_id = first_comment
+            for i, weight in enumerate(popularity()):
+                expected = weight * comments_per_post
+                count = int(expected) + (1 if rng.random() < expected - int(expected) else 0)
+                post_offset = span * i / posts
+                parent_id = None
+                depth = 0
+                for n in range(count):
+                    if parent_id is not None and depth < max_depth and rng.random() < reply_ratio:
+                        depth += 1
+                    else:
+                        parent_id = None
+                        depth = 0
+                    created = post_offset + (span - post_offset) * n / (count + 1)
+                    yield (comment_id, first_post + i, first_user + user_picker.pick(), text(1, 4),
+                           timestamp(created), parent_id)
+                    parent_id = comment_id
+                    comment_id += 1
+
+        insert('comments',
+               'INSERT INTO comments (id, post_id, user_id, content, created_at, parent_id) '
+               'VALUES (?, ?, ?, ?, ?, ?)',
+               comment_rows())
+        create_change_triggers(cursor)
+        # Timestamps are stored as UTC text
+        rebuild_scores(conn, now=end.replace(tzinfo=timezone.utc).timestamp())
+        cursor.execute('COMMIT')
+        # Seeded views are synthetic anyway, so let them count on their post's day
+        backfill(conn, METRICS)
+        cursor.execute('ANALYZE')
+    except BaseException:
+        if conn.in_transaction:
+            cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    written['seconds'] = round(time.perf_counter() - timer, 3)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--rows', type=int, default=1000, help='total rows, split across users/posts/comments')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--posts', type=int)
+    parser.add_argument('--comments', type=int)
+    parser.add_argument('--images', type=int, default=20, help='placeholder image files to reference')
+    parser.add_argument('--image-ratio', type=float, default=0.1, help='share of posts with an image')
+    parser.add_argument('--reply-ratio', type=float, default=0.5, help='chance a comment replies to the previous one')
+    parser.add_argument('--max-depth', type=int, default=5, help='longest parent_id reply chain')
+    parser.add_argument('--user-skew', type=float, default=1.1, help='Zipf exponent for prolific users')
+    parser.add_argument('--post-skew', type=float, default=1.5,
+                        help='Pareto shape for post popularity (lower is more skewed, must be > 1)')
+    parser.add_argument('--days', type=int, default=365, help='span of created_at timestamps')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='delete existing users, posts and comments first')
+    args = parser.parse_args(argv)
+    if not args.post_skew > 1:
+        parser.error('--post-skew must be greater than 1')
+    for name in ('users', 'posts'):
+        if getattr(args, name) is not None and getattr(args, name) < 1:
+            parser.error(f'--{name} must be at least 1')
+
+    def progress(table, count):
+        print(f'\r{table}: {count:,}', end='', file=sys.stderr, flush=True)
+
+    written = seed_forum(args.db, rows=args.rows, users=args.users, posts=args.posts, comments=args.comments,
+                         images=args.images, image_ratio=args.image_ratio, reply_ratio=args.reply_ratio,
+                         max_depth=args.max_depth, user_skew=args.user_skew,
+                         post_skew=args.post_skew, days=args.days, seed=args.seed,
+                         reset=args.reset, progress=progress)
+    print(file=sys.stderr)
+    seconds = written.pop('seconds')
+    total = sum(written.values())
+    print(f"Wrote {total:,} rows {written} in {seconds:.1f}s ({total / max(seconds, 1e-9):,.0f} rows/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
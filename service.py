@@ -0,0 +1,529 @@
+"""Forum queries and commands, shared by the Streamlit UI and the JSON API.
+
+Nothing here touches Streamlit: every function borrows a pooled connection
+from db, does its work and hands back sqlite3.Row objects (which index like
+the tuples the pages always used, and convert to dicts for JSON).
+
+Listings only cover the live tables. Reads of a single thread and search
+fall through to the archive tier (see archive.py), and writes to an archived
+thread restore it first.
+"""
+import hashlib
+import json
+import sqlite3
+
+import archive
+import dedupe
+import mentions
+import moderation
+import ranking
+import rollups
+import sessions
+import tagging
+from db import connection, transaction
+from media import remove_upload
+
+# Column list shared by every post listing, so the pages can rely on row layout
+POST_LISTING_COLUMNS = '''
+    p.*, u.username, c.name as category_name, c.color as category_color,
+    (SELECT COUNT(*) FROM comments WHERE post_id = p.id) as comment_count
+'''
+
+# Top-level comments (the ones a thread page shows) newer than the viewer's read
+# marker, NULL for threads they never opened. Listings that show it join
+# READ_MARKER_JOIN, whose parameter is the viewer's id. The count is a covered
+# range of the partial index idx_comments_top_level.
+UNREAD_COLUMN = '''
+    CASE WHEN r.last_comment_id IS NOT NULL THEN
+        (SELECT COUNT(*) FROM comments
+         WHERE post_id = p.id AND id > r.last_comment_id AND parent_id IS NULL)
+    END as unread_count
+'''
+READ_MARKER_JOIN = 'LEFT JOIN read_markers r ON r.user_id = ? AND r.post_id = p.id'
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def can_edit(user, owner_id):
+    """Owners and admins may edit or delete content"""
+    return bool(user) and (user['id'] == owner_id or user['role'] == 'admin')
+
+
+# Queries
+def get_categories():
+    with connection() as conn:
+        return conn.execute('SELECT * FROM categories').fetchall()
+
+
+def get_category(category_id):
+    with connection() as conn:
+        return conn.execute('SELECT * FROM categories WHERE id = ?', (category_id,)).fetchone()
+
+
+def get_user(user_id):
+    with connection() as conn:
+        return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+
+
+def author_cards(user_ids):
+    """{user_id: (id, username, role, avatar)} for every distinct author on a page, in one query"""
+    ids = list(dict.fromkeys(user_ids))
+    if not ids:
+        return {}
+    with connection() as conn:
+        rows = conn.execute('SELECT id, username, role, avatar FROM users '
+                            'WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)).fetchall()
+    return {row['id']: row for row in rows}
+
+
+def get_stats():
+    """Forum-wide totals (archive included) for the home page and admin panel"""
+    with connection() as conn:
+        return conn.execute('''
+            SELECT (SELECT COUNT(*) FROM posts) + (SELECT COUNT(*) FROM archive.posts) as posts,
+                   (SELECT COUNT(*) FROM users) as users,
+                   (SELECT COUNT(*) FROM comments) + (SELECT COUNT(*) FROM archive.comments) as comments
+        ''').fetchone()
+
+
+def category_post_counts():
+    """Post count per category id, in one grouped query"""
+    with connection() as conn:
+        rows = conn.execute('SELECT category_id, COUNT(*) FROM posts GROUP BY category_id').fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+def list_recent_posts(limit=10, viewer_id=None):
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT {POST_LISTING_COLUMNS}, {UNREAD_COLUMN}
+            FROM posts p
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            {READ_MARKER_JOIN}
+            ORDER BY p.is_pinned DESC, p.created_at DESC
+            LIMIT ?
+        ''', (viewer_id, limit)).fetchall()
+
+
+def list_category_posts(category_id, limit=None, viewer_id=None):
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT {POST_LISTING_COLUMNS}, {UNREAD_COLUMN}
+            FROM posts p
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            {READ_MARKER_JOIN}
+            WHERE p.category_id = ?
+            ORDER BY p.is_pinned DESC, p.created_at DESC
+            LIMIT ?
+        ''', (viewer_id, category_id, -1 if limit is None else limit)).fetchall()
+
+
+def list_user_posts(user_id, limit=5):
+    with connection() as conn:
+        return conn.execute('''
+            SELECT p.*, c.name as category_name
+            FROM posts p
+            JOIN categories c ON p.category_id = c.id
+            WHERE p.user_id = ?
+            ORDER BY p.created_at DESC
+            LIMIT ?
+        ''', (user_id, limit)).fetchall()
+
+
+def list_trending_posts(category_id=None, limit=10, viewer_id=None):
+    """Hottest posts first, read straight off the hot_score index"""
+    where = 'WHERE p.category_id = ?' if category_id is not None else ''
+    params = (viewer_id, category_id, limit) if category_id is not None else (viewer_id, limit)
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT {POST_LISTING_COLUMNS}, {UNREAD_COLUMN}
+            FROM posts p
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            {READ_MARKER_JOIN}
+            {where}
+            ORDER BY p.hot_score DESC
+            LIMIT ?
+        ''', params).fetchall()
+
+
+def list_tagged_posts(tags, match='all', category_id=None, limit=50, viewer_id=None):
+    """Newest live posts with all (or any) of tags, matched on the post_tags index"""
+    matched, params = tagging.matching_posts(tags, match)
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT {POST_LISTING_COLUMNS}, {UNREAD_COLUMN}
+            FROM ({matched}) m
+            JOIN posts p ON p.id = m.post_id
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            {READ_MARKER_JOIN}
+            WHERE ? IS NULL OR p.category_id = ?
+            ORDER BY p.created_at DESC
+            LIMIT ?
+        ''', (*params, viewer_id, category_id, category_id, limit)).fetchall()
+
+
+def search_posts(query, limit=None):
+    """Matching posts, newest first; the archive is only searched to fill up the limit"""
+    pattern = f'%{query}%'
+    results = []
+    with connection() as conn:
+        for table in ('posts', 'archive.posts'):
+            remaining = -1 if limit is None else limit - len(results)
+            if remaining == 0:
+                break
+            results += conn.execute(f'''
+                SELECT p.*, u.username, c.name as category_name
+                FROM {table} p
+                JOIN users u ON p.user_id = u.id
+                JOIN categories c ON p.category_id = c.id
+                WHERE p.title LIKE ? OR p.content LIKE ? OR u.username LIKE ? OR c.name LIKE ?
+                ORDER BY p.created_at DESC
+                LIMIT ?
+            ''', (pattern, pattern, pattern, pattern, remaining)).fetchall()
+    return results
+
+
+def get_post(post_id):
+    """The post from the live tables, else from the archive (archived = 1)"""
+    with connection() as conn:
+        for table, archived in (('posts', 0), ('archive.posts', 1)):
+            post = conn.execute(f'''
+                SELECT p.*, u.username, c.name as category_name, c.color as category_color,
+                       {archived} as archived
+                FROM {table} p
+                JOIN users u ON p.user_id = u.id
+                JOIN categories c ON p.category_id = c.id
+                WHERE p.id = ?
+            ''', (post_id,)).fetchone()
+            if post:
+                return post
+    return None
+
+
+def view_post(post_id):
+    """Count a view and return the post"""
+    with transaction() as conn:
+        conn.execute('UPDATE posts SET views = views + 1 WHERE id = ?', (post_id,))
+        ranking.boost(conn, post_id, ranking.VIEW_WEIGHT)
+        rollups.record_post_event(conn, 'views', post_id)
+    return get_post(post_id)
+
+
+def list_comments(post_id):
+    """Top-level comments of a post (live or archived), oldest first"""
+    with connection() as conn:
+        return conn.execute('''
+            SELECT c.*, u.username
+            FROM comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.post_id = ? AND c.parent_id IS NULL
+            UNION ALL
+            SELECT c.*, u.username
+            FROM archive.comments c
+            JOIN users u ON c.user_id = u.id
+            WHERE c.post_id = ? AND c.parent_id IS NULL
+            ORDER BY created_at ASC
+        ''', (post_id, post_id)).fetchall()
+
+
+# Live updates
+def latest_seq():
+    """The newest change_log sequence number (0 when nothing was logged yet)"""
+    with connection() as conn:
+        return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+
+
+def comments_since(post_id, seq):
+    """New top-level comments of a post logged after seq, oldest first"""
+    with connection() as conn:
+        return conn.execute('''
+            SELECT l.seq, c.*, u.username
+            FROM change_log l
+            JOIN comments c ON c.id = l.row_id
+            JOIN users u ON c.user_id = u.id
+            WHERE l.seq > ? AND l.kind = 'comment' AND l.post_id = ? AND c.parent_id IS NULL
+            ORDER BY l.seq
+        ''', (seq, post_id)).fetchall()
+
+
+def posts_since(seq, category_id=None):
+    """Posts logged after seq (optionally in one category), newest first"""
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT l.seq, {POST_LISTING_COLUMNS}
+            FROM change_log l
+            JOIN posts p ON p.id = l.row_id
+            JOIN users u ON p.user_id = u.id
+            JOIN categories c ON p.category_id = c.id
+            WHERE l.seq > ? AND l.kind = 'post' AND (? IS NULL OR l.category_id = ?)
+            ORDER BY l.seq DESC
+        ''', (seq, category_id, category_id)).fetchall()
+
+
+def get_comment(comment_id):
+    with connection() as conn:
+        return (conn.execute('SELECT * FROM comments WHERE id = ?', (comment_id,)).fetchone()
+                or conn.execute('SELECT * FROM archive.comments WHERE id = ?', (comment_id,)).fetchone())
+
+
+def get_user_stats(user_id):
+    with connection() as conn:
+        return conn.execute('''
+            SELECT (SELECT COUNT(*) FROM posts WHERE user_id = ?)
+                   + (SELECT COUNT(*) FROM archive.posts WHERE user_id = ?) as posts,
+                   (SELECT COUNT(*) FROM comments WHERE user_id = ?)
+                   + (SELECT COUNT(*) FROM archive.comments WHERE user_id = ?) as comments
+        ''', (user_id, user_id, user_id, user_id)).fetchone()
+
+
+def recent_activity(limit=5):
+    with connection() as conn:
+        return conn.execute('''
+            SELECT p.title, u.username, p.created_at
+            FROM posts p
+            JOIN users u ON p.user_id = u.id
+            ORDER BY p.created_at DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+
+
+def list_users():
+    with connection() as conn:
+        return conn.execute(
+            'SELECT id, username, email, role, created_at FROM users ORDER BY created_at DESC'
+        ).fetchall()
+
+
+# Subscriptions and notifications (fanned out by fanout.py)
+def is_watching(user_id, kind, target_id):
+    with connection() as conn:
+        return conn.execute('SELECT 1 FROM subscriptions WHERE kind = ? AND target_id = ? AND user_id = ?',
+                            (kind, target_id, user_id)).fetchone() is not None
+
+
+def unread_notification_count(user_id, cap=100):
+    """Unread notifications, counted off the partial index and stopping at `cap`"""
+    with connection() as conn:
+        return conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM notifications WHERE user_id = ? AND is_read = 0 LIMIT ?
+            )
+        ''', (user_id, cap)).fetchone()[0]
+
+
+def list_notifications(user_id, limit=50):
+    """Newest notifications first, with the actor's name and the post title (live or archived)"""
+    with connection() as conn:
+        return conn.execute('''
+            SELECT n.*, u.username as actor_name,
+                   COALESCE(p.title, (SELECT title FROM archive.posts WHERE id = n.post_id)) as post_title
+            FROM notifications n
+            LEFT JOIN users u ON u.id = n.actor_id
+            LEFT JOIN posts p ON p.id = n.post_id
+            WHERE n.user_id = ?
+            ORDER BY n.id DESC
+            LIMIT ?
+        ''', (user_id, limit)).fetchall()
+
+
+# Authentication
+def authenticate(username, password):
+    """Return the session user dict for valid credentials, otherwise None"""
+    with connection() as conn:
+        user = conn.execute(
+            'SELECT id, username, password_hash, role FROM users WHERE username = ? OR email = ?',
+            (username, username)
+        ).fetchone()
+    if user and user['password_hash'] == hash_password(password):
+        return {'id': user['id'], 'username': user['username'], 'role': user['role']}
+    return None
+
+
+def register(username, email, password):
+    """Create an account and return its session user dict, or None if taken"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                (username, email, hash_password(password))
+            )
+            rollups.record(conn, 'registrations')
+    except sqlite3.IntegrityError:
+        return None
+    mentions.user_added(username)
+    return {'id': cursor.lastrowid, 'username': username, 'role': 'user'}
+
+
+# Commands
+def create_post(user_id, category_id, title, content, image_path=None, tags=()):
+    """Save a post and return its id; raises dedupe.DuplicateContent for a rejected repost"""
+    # Screened before the write transaction: a read there would make its upgrade to a write fail
+    # at once (SQLITE_BUSY, no busy timeout) if another writer committed in between
+    with connection() as conn:
+        screened = dedupe.screen(conn, f'{title}\n{content}')
+    with transaction() as conn:
+        cursor = conn.execute(
+            'INSERT INTO posts (user_id, category_id, title, content, image_path) VALUES (?, ?, ?, ?, ?)',
+            (user_id, category_id, title, content, image_path)
+        )
+        tagging.set_post_tags(conn, cursor.lastrowid, tagging.normalize_tags(tags))
+        ranking.boost(conn, cursor.lastrowid, ranking.POST_WEIGHT)
+        _watch(conn, user_id, 'post', cursor.lastrowid)
+        mentions.record(conn, content, user_id, cursor.lastrowid)
+        dedupe.record(conn, 'post', cursor.lastrowid, screened)
+        rollups.record(conn, 'posts', category_id)
+        rollups.record_active(conn, user_id)
+    return cursor.lastrowid
+
+
+def update_post(post_id, title, content, category_id, image_path, tags=None):
+    """Save an edited post (tags=None keeps its tags); a replaced or removed image file is deleted
+
+    Raises dedupe.DuplicateContent if the edit turns it into a rejected repost.
+    """
+    with connection() as conn:
+        screened = dedupe.screen(conn, f'{title}\n{content}', exclude=('post', post_id))
+    with transaction() as conn:
+        archive.restore_thread(conn, post_id)
+        row = conn.execute('SELECT image_path FROM posts WHERE id = ?', (post_id,)).fetchone()
+        conn.execute(
+            'UPDATE posts SET title = ?, content = ?, category_id = ?, image_path = ?, '
+            'updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (title, content, category_id, image_path, post_id)
+        )
+        if tags is not None:
+            tagging.set_post_tags(conn, post_id, tagging.normalize_tags(tags))
+        # Re-index the edited text (and re-flag it or clear its flag)
+        dedupe.forget(conn, 'post', post_id)
+        dedupe.record(conn, 'post', post_id, screened)
+    if row and row[0] != image_path:
+        remove_upload(row[0])
+
+
+def delete_post(post_id):
+    """Delete a post with its comments and their images"""
+    with transaction() as conn:
+        archive.restore_thread(conn, post_id)
+        image_paths = [row[0] for row in conn.execute(
+            'SELECT image_path FROM posts WHERE id = ? UNION ALL '
+            'SELECT image_path FROM comments WHERE post_id = ?',
+            (post_id, post_id)
+        )]
+        conn.execute('DELETE FROM comments WHERE post_id = ?', (post_id,))
+        conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+        conn.execute('DELETE FROM read_markers WHERE post_id = ?', (post_id,))
+        conn.execute("DELETE FROM subscriptions WHERE kind = 'post' AND target_id = ?", (post_id,))
+        conn.execute('DELETE FROM notifications WHERE post_id = ?', (post_id,))
+        conn.execute('DELETE FROM post_tags WHERE post_id = ?', (post_id,))
+    for image_path in image_paths:
+        remove_upload(image_path)
+
+
+def add_comment(post_id, user_id, content, image_path=None):
+    """Save a comment and return its id; raises dedupe.DuplicateContent for a rejected repost"""
+    with connection() as conn:
+        screened = dedupe.screen(conn, content)
+    with transaction() as conn:
+        # A new comment makes an archived thread active again
+        archive.restore_thread(conn, post_id)
+        cursor = conn.execute(
+            'INSERT INTO comments (post_id, user_id, content, image_path) VALUES (?, ?, ?, ?)',
+            (post_id, user_id, content, image_path)
+        )
+        comment_id = cursor.lastrowid
+        ranking.boost(conn, post_id, ranking.COMMENT_WEIGHT)
+        # Writing a comment means having read the thread up to it
+        _advance_read_markers(conn, user_id, [(post_id, comment_id)])
+        # Commenters hear about later replies
+        _watch(conn, user_id, 'post', post_id)
+        mentions.record(conn, content, user_id, post_id, comment_id)
+        dedupe.record(conn, 'comment', comment_id, screened)
+        rollups.record_post_event(conn, 'comments', post_id)
+        rollups.record_active(conn, user_id)
+    return comment_id
+
+
+def _advance_read_markers(conn, user_id, markers):
+    conn.executemany('''
+        INSERT INTO read_markers (user_id, post_id, last_comment_id) VALUES (?, ?, ?)
+        ON CONFLICT (user_id, post_id) DO UPDATE
+        SET last_comment_id = MAX(last_comment_id, excluded.last_comment_id)
+    ''', [(user_id, post_id, last_comment_id) for post_id, last_comment_id in markers])
+
+
+def mark_read(user_id, markers):
+    """Record {post_id: last seen comment id} for a user in one transaction; markers only move forward"""
+    with transaction() as conn:
+        _advance_read_markers(conn, user_id, markers.items())
+
+
+def mark_all_read(user_id):
+    """Catch every thread the user has opened up to its latest comment"""
+    with transaction() as conn:
+        conn.execute('''
+            UPDATE read_markers SET last_comment_id =
+                (SELECT COALESCE(MAX(id), read_markers.last_comment_id) FROM comments
+                 WHERE post_id = read_markers.post_id)
+            WHERE user_id = ?
+        ''', (user_id,))
+
+
+def _watch(conn, user_id, kind, target_id):
+    conn.execute('INSERT OR IGNORE INTO subscriptions (kind, target_id, user_id) VALUES (?, ?, ?)',
+                 (kind, target_id, user_id))
+
+
+def watch(user_id, kind, target_id):
+    """Subscribe to a post's replies or a category's new posts"""
+    with transaction() as conn:
+        _watch(conn, user_id, kind, target_id)
+
+
+def unwatch(user_id, kind, target_id):
+    with transaction() as conn:
+        conn.execute('DELETE FROM subscriptions WHERE kind = ? AND target_id = ? AND user_id = ?',
+                     (kind, target_id, user_id))
+
+
+def mark_notifications_read(user_id, notification_ids):
+    """Mark the given notifications of the user as read (the ones a page listed)"""
+    with transaction() as conn:
+        conn.execute('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0 '
+                     'AND id IN (SELECT value FROM json_each(?))', (user_id, json.dumps(list(notification_ids))))
+
+
+def delete_comment(comment_id):
+    with transaction() as conn:
+        row = (conn.execute('SELECT image_path FROM comments WHERE id = ?', (comment_id,)).fetchone()
+               or conn.execute('SELECT image_path FROM archive.comments WHERE id = ?', (comment_id,)).fetchone())
+        conn.execute('DELETE FROM comments WHERE id = ?', (comment_id,))
+        conn.execute('DELETE FROM archive.comments WHERE id = ?', (comment_id,))
+    if row:
+        remove_upload(row[0])
+
+
+def update_avatar(user_id, avatar_path):
+    """Point the user at a new avatar and remove the old file"""
+    with transaction() as conn:
+        row = conn.execute('SELECT avatar FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn.execute('UPDATE users SET avatar = ? WHERE id = ?', (avatar_path, user_id))
+    sessions.invalidate_user(user_id)
+    if row and row[0] != avatar_path:
+        remove_upload(row[0])
+
+
+def set_role(user_id, role):
+    with transaction() as conn:
+        conn.execute('UPDATE users SET role = ? WHERE id = ?', (role, user_id))
+    sessions.invalidate_user(user_id)
+
+
+def delete_user(user_id):
+    """Delete a user along with their posts (and those posts' comments), comments and images, in both tiers"""
+    moderation.delete_users([user_id])
@@ -0,0 +1,245 @@
+"""Server-side sessions with signed tokens and a pluggable store.
+
+A login creates a random session id, stores it server-side and hands the
+client "<id>.<hmac>" as its token. Forged or mangled tokens are rejected by
+the signature check without touching the store. The store also caches each
+user's profile (username, role, avatar, ...) so pages don't re-query the
+users table on every rerun; invalidate_user() drops that cache when the
+avatar or role changes.
+
+Pick the store with FORUM_SESSION_STORE:
+
+    memory              in-process LRU with TTL (single node, lost on restart)
+    sqlite (default)    session_store table in forum.db (shared by every node on it)
+    redis://host:port   any Redis-compatible server (Redis, Valkey, KeyDB, ...)
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from db import DB_PATH, connection, transaction
+
+SESSION_TTL = 7 * 24 * 3600
+PROFILE_TTL = 300
+
+_SECRET_FILE = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), '.forum_secret')
+
+
+class MemoryStore:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteStore:
+    """Key/value rows in the session_store table of the forum database"""
+
+    PURGE_EVERY = 500
+
+    def __init__(self):
+        self._writes = 0
+
+    def get(self, key):
+        with connection() as conn:
+            row = conn.execute(
+                'SELECT value FROM session_store WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO session_store (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute('DELETE FROM session_store WHERE expires_at <= ?', (now,))
+
+    def delete(self, key):
+        with transaction() as conn:
+            conn.execute('DELETE FROM session_store WHERE key = ?', (key,))
+
+
+class RedisStore:
+    """Any client with Redis' get/setex/delete commands"""
+
+    def __init__(self, client, prefix='forum:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.setex(self.prefix + key, int(ttl), json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def make_store(spec):
+    if spec == 'memory':
+        return MemoryStore()
+    if spec == 'sqlite':
+        return SQLiteStore()
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore.from_url(spec)
+    raise ValueError(f"Unknown session store: {spec}")
+
+
+def _load_secret():
+    secret = os.environ.get('FORUM_SECRET_KEY')
+    if secret:
+        return secret.encode()
+    # Share one generated key between restarts (and nodes using the same data directory)
+    if not os.path.exists(_SECRET_FILE):
+        # Written in full under a temporary name, then linked into place: processes starting
+        # together never see a partial key, and whichever links first wins
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(_SECRET_FILE), prefix='.forum_secret-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secrets.token_bytes(32))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp_path, _SECRET_FILE)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(tmp_path)
+    with open(_SECRET_FILE, 'rb') as f:
+        key = f.read()
+    if not key:
+        raise RuntimeError(f"{_SECRET_FILE} is empty; delete it or set FORUM_SECRET_KEY")
+    return key
+
+
+_store = None
+_secret = None
+_init_lock = threading.Lock()
+
+
+def get_store():
+    global _store, _secret
+    if _store is None:
+        with _init_lock:
+            if _store is None:
+                _secret = _load_secret()
+                _store = make_store(os.environ.get('FORUM_SESSION_STORE', 'sqlite'))
+    return _store
+
+
+def _sign(session_id):
+    get_store()
+    digest = hmac.new(_secret, session_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:24]).decode().rstrip('=')
+
+
+def _verify(token):
+    """Return the session id of a correctly signed token, else None"""
+    session_id, _, signature = (token or '').partition('.')
+    if not session_id or not signature:
+        return None
+    if not hmac.compare_digest(_sign(session_id), signature):
+        return None
+    return session_id
+
+
+def _fetch_profile(user_id):
+    with connection() as conn:
+        row = conn.execute(
+            'SELECT id, username, email, role, created_at, bio, avatar FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def get_profile(user_id):
+    """The user's cached profile (no password hash), loaded on a miss"""
+    store = get_store()
+    profile = store.get(f'user:{user_id}')
+    if profile is None:
+        profile = _fetch_profile(user_id)
+        if profile is not None:
+            store.set(f'user:{user_id}', profile, PROFILE_TTL)
+    return profile
+
+
+def invalidate_user(user_id):
+    """Forget the cached profile so the next request sees the new avatar/role"""
+    get_store().delete(f'user:{user_id}')
+
+
+def session_user(profile):
+    """The small user dict pages keep in st.session_state.user"""
+    return {'id': profile['id'], 'username': profile['username'], 'role': profile['role']}
+
+
+def create_session(user):
+    """Start a session for a logged-in user and return its signed token"""
+    session_id = secrets.token_urlsafe(24)
+    get_store().set(f'session:{session_id}', {'user_id': user['id'], 'created_at': time.time()}, SESSION_TTL)
+    return f'{session_id}.{_sign(session_id)}'
+
+
+def load_session(token):
+    """Return the session's user dict (id, username, role) or None"""
+    session_id = _verify(token)
+    if session_id is None:
+        return None
+    session = get_store().get(f'session:{session_id}')
+    if session is None:
+        return None
+    profile = get_profile(session['user_id'])
+    if profile is None:
+        # The account is gone
+        destroy_session(token)
+        return None
+    return session_user(profile)
+
+
+def destroy_session(token):
+    session_id = _verify(token)
+    if session_id is not None:
+        get_store().delete(f'session:{session_id}')
@@ -0,0 +1,124 @@
+"""Post tags: normalization, the post_tags inverted index, facets and autocomplete.
+
+post_tags holds one (tag, post_id) row per tag on a post and is keyed by tag,
+so the posts carrying a tag are one range of its primary key;
+idx_post_tags_post gives a post's own tags. The tags table keeps a post count
+per tag, maintained by triggers on post_tags, and its primary key on name is
+the prefix index autocomplete reads.
+
+Filtering finds the matching post ids from post_tags alone (an intersection
+via GROUP BY ... HAVING COUNT(*) = n for match='all', a union for 'any') and
+only then joins posts by primary key, for the category and the listing
+columns. Facet counts group post_tags over those same ids. Archived threads'
+tags move to archive.post_tags (see archive.py), so counts, filtered results
+and facets all cover live posts; a post's own tags are read from both tiers.
+"""
+import json
+import re
+
+from db import connection
+
+MAX_TAGS = 5
+MAX_TAG_LENGTH = 30
+# How many prefix matches autocomplete ranks by popularity
+AUTOCOMPLETE_SCAN = 200
+
+IN_TAGS = 'IN (SELECT value FROM json_each(?))'
+
+
+def normalize_tags(text):
+    """Tags from free text ("Python, #SQLite help"): lowercase, deduplicated, at most MAX_TAGS"""
+    if not isinstance(text, str):
+        text = ','.join(text)
+    tags = []
+    for word in re.split(r'[,\s]+', text.lower()):
+        tag = re.sub(r'[^a-z0-9_-]', '', word.lstrip('#'))[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:MAX_TAGS]
+
+
+def set_post_tags(conn, post_id, tags):
+    """Make a post's tags exactly `tags` (inside the caller's transaction)"""
+    current = {row[0] for row in conn.execute('SELECT tag FROM post_tags WHERE post_id = ?', (post_id,))}
+    wanted = set(tags)
+    conn.executemany('DELETE FROM post_tags WHERE tag = ? AND post_id = ?',
+                     [(tag, post_id) for tag in current - wanted])
+    conn.executemany('INSERT OR IGNORE INTO post_tags (tag, post_id) VALUES (?, ?)',
+                     [(tag, post_id) for tag in wanted - current])
+
+
+def get_post_tags(post_id):
+    with connection() as conn:
+        return [row[0] for row in conn.execute(
+            'SELECT tag FROM post_tags WHERE post_id = ? UNION SELECT tag FROM archive.post_tags WHERE post_id = ? '
+            'ORDER BY tag', (post_id, post_id))]
+
+
+def autocomplete(prefix, limit=10):
+    """The most used tags starting with prefix, read off the tags primary key"""
+    prefix = normalize_tags(prefix)[:1]
+    if not prefix:
+        return []
+    with connection() as conn:
+        return conn.execute('''
+            SELECT name, post_count FROM (
+                SELECT name, post_count FROM tags
+                WHERE name >= ? AND name < ? AND post_count > 0
+                ORDER BY name
+                LIMIT ?
+            )
+            ORDER BY post_count DESC, name
+            LIMIT ?
+        ''', (prefix[0], prefix[0] + '\U0010ffff', AUTOCOMPLETE_SCAN, limit)).fetchall()
+
+
+def popular_tags(limit=30):
+    with connection() as conn:
+        return conn.execute('SELECT name, post_count FROM tags WHERE post_count > 0 '
+                            'ORDER BY post_count DESC LIMIT ?', (limit,)).fetchall()
+
+
+def matching_posts(tags, match='all'):
+    """SQL selecting the post_id of posts with all (or any) of tags, and its params"""
+    tags = json.dumps(list(tags))
+    if match == 'any':
+        return f'SELECT DISTINCT post_id FROM post_tags WHERE tag {IN_TAGS}', [tags]
+    return (f'SELECT post_id FROM post_tags WHERE tag {IN_TAGS} '
+            f'GROUP BY post_id HAVING COUNT(*) = (SELECT COUNT(DISTINCT value) FROM json_each(?))', [tags, tags])
+
+
+def facet_counts(tags=(), match='all', category_id=None, limit=30):
+    """(name, post_count) of the tags on the live posts matching the filter, most common first"""
+    if not tags and category_id is None:
+        return popular_tags(limit)
+    if tags:
+        matched, params = matching_posts(tags, match)
+    else:
+        matched, params = 'SELECT id as post_id FROM posts WHERE category_id = ?', [category_id]
+        category_id = None
+    with connection() as conn:
+        return conn.execute(f'''
+            SELECT t.tag as name, COUNT(*) as post_count
+            FROM ({matched}) m
+            JOIN posts p ON p.id = m.post_id
+            JOIN post_tags t ON t.post_id = m.post_id
+            WHERE ? IS NULL OR p.category_id = ?
+            GROUP BY t.tag
+            ORDER BY post_count DESC, t.tag
+            LIMIT ?
+        ''', (*params, category_id, category_id, limit)).fetchall()
+
+
+def category_counts(tags, match='all'):
+    """{category_id: live posts matching the tags}"""
+    if not tags:
+        return {}
+    matched, params = matching_posts(tags, match)
+    with connection() as conn:
+        rows = conn.execute(f'''
+            SELECT p.category_id, COUNT(*) FROM ({matched}) m
+            JOIN posts p ON p.id = m.post_id
+            GROUP BY p.category_id
+        ''', params).fetchall()
+    return {row[0]: row[1] for row in rows}
@@ -0,0 +1,262 @@
+"""Bulk export and import of a whole forum as JSON Lines.
+
+Moving a forum used to mean copying forum.db. An export is instead a stream
+of JSON lines that any forum database (or another tool) can load:
+
+    python transfer.py export forum.jsonl.gz [--db forum.db]
+    python transfer.py import forum.jsonl.gz --db new.db [--reset]
+    python transfer.py export - | gzip > forum.jsonl.gz    # "-" is stdout/stdin
+
+The first line is a header, then each table follows as a
+{"table": ..., "columns": [...]} line and one JSON array per row, and a final
+{"end": ...} line carries the row counts. Tables are users, categories, posts,
+comments, the archive tier and post_tags of both; the "uploads" section is a
+manifest of the image files the rows reference (path, bytes, mtime; files
+themselves travel separately, e.g. with ops.py backup).
+
+Export reads everything in one read transaction, so the file is a consistent
+snapshot while the app keeps writing, and pulls rows with fetchmany in
+CHUNK_ROWS chunks, writing each chunk with one call: memory stays flat
+whatever the size. Import drops the secondary indexes and triggers of the
+loaded tables, inserts with executemany in one transaction per BATCH_SIZE
+rows, then lets db.setup_database recreate indexes and triggers, recounts
+tags, recomputes hot scores against this database's epoch and backfills the
+rollups (run dedupe.py scan to index the imported text for duplicate
+detection). Rows replace rows with the same key, so the default categories
+and admin account are overwritten by the exported ones; --reset empties the
+forum first.
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+
+from db import DB_PATH, attach_archive, setup_database
+from ranking import rebuild_scores
+from rollups import METRICS, backfill
+
+FORMAT_VERSION = 1
+CHUNK_ROWS = 5000
+BATCH_SIZE = 50_000
+
+# In load order: rows only reference tables that come before them
+TABLES = ('users', 'categories', 'posts', 'comments', 'archive.posts', 'archive.comments', 'post_tags',
+          'archive.post_tags')
+UPLOAD_COLUMNS = [('users', 'avatar'), ('posts', 'image_path'), ('comments', 'image_path'),
+                  ('archive.posts', 'image_path'), ('archive.comments', 'image_path')]
+
+# Emptied by --reset, dependants first (rows derived from the content go too)
+RESET_TABLES = ('session_store', 'change_log', 'rollup_hourly', 'rollup_daily', 'rollup_active_users',
+                'read_markers', 'subscriptions', 'notifications', 'post_tags', 'tags', 'duplicate_flags',
+                'minhash_buckets', 'minhash_signatures', 'archive.post_tags', 'archive.comments', 'archive.posts',
+                'comments', 'posts', 'users', 'categories')
+
+
+def open_stream(path, mode):
+    """Text stream for a path ('-' is stdin/stdout, .gz is gzip-compressed)"""
+    if path == '-':
+        return open((sys.stdin if mode == 'r' else sys.stdout).fileno(), mode, encoding='utf-8', closefd=False)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', compresslevel=6, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def table_columns(conn, table):
+    schema, _, name = table.rpartition('.')
+    return [row[1] for row in conn.execute(f"PRAGMA {schema or 'main'}.table_info({name})")]
+
+
+# Export
+def export_lines(conn, counts, progress=None):
+    """Yield the export as chunks of JSON lines, reading inside the caller's read transaction
+
+    Rows written per section are recorded in counts.
+    """
+    exported_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    yield json.dumps({'format': FORMAT_VERSION, 'exported_at': exported_at, 'tables': [*TABLES, 'uploads']}) + '\n'
+    uploads = ' UNION '.join(f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL'
+                             for table, column in UPLOAD_COLUMNS)
+    for table in (*TABLES, 'uploads'):
+        if table == 'uploads':
+            columns = ['path', 'bytes', 'mtime']
+            cursor = conn.execute(f'SELECT * FROM ({uploads}) ORDER BY 1')
+        else:
+            columns = table_columns(conn, table)
+            cursor = conn.execute(f'SELECT {", ".join(columns)} FROM {table}')
+        yield json.dumps({'table': table, 'columns': columns}) + '\n'
+        count = 0
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            if table == 'uploads':
+                rows = [upload_entry(row[0]) for row in rows]
+            yield ''.join(json.dumps(list(row), separators=(',', ':')) + '\n' for row in rows)
+            count += len(rows)
+            if progress:
+                progress(table, count)
+        counts[table] = count
+    yield json.dumps({'end': True, 'counts': counts}) + '\n'
+
+
+def upload_entry(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, stat.st_size, int(stat.st_mtime)]
+
+
+def export_forum(db_path=DB_PATH, target='-', progress=None):
+    """Write the forum to target; returns row counts per section and seconds"""
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    attach_archive(conn, db_path)
+    counts = {}
+    try:
+        # One snapshot for every table, without blocking writers (WAL)
+        conn.execute('BEGIN')
+        with open_stream(target, 'w') as out:
+            for chunk in export_lines(conn, counts, progress):
+                out.write(chunk)
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    counts['seconds'] = round(time.perf_counter() - start, 3)
+    return counts
+
+
+# Import
+def drop_deferred(conn):
+    """Drop secondary indexes and triggers on the loaded tables (setup_database recreates them)"""
+    for schema in ('main', 'archive'):
+        names = {table.rpartition('.')[2] for table in TABLES
+                 if table.startswith('archive.') == (schema == 'archive')}
+        for kind, name in conn.execute(
+            f"SELECT type, name FROM {schema}.sqlite_master WHERE type IN ('index', 'trigger') "
+            f"AND sql IS NOT NULL AND tbl_name IN (SELECT value FROM json_each(?))", (json.dumps(sorted(names)),)
+        ).fetchall():
+            conn.execute(f'DROP {kind.upper()} {schema}.{name}')
+
+
+def import_forum(source='-', db_path=DB_PATH, reset=False, batch_size=BATCH_SIZE, progress=None):
+    """Load an export into db_path; returns rows per table, missing uploads and seconds"""
+    start = time.perf_counter()
+    setup_database(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    attach_archive(conn, db_path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    written = {}
+    missing_uploads = 0
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if reset:
+            for table in RESET_TABLES:
+                conn.execute(f'DELETE FROM {table}')
+        drop_deferred(conn)
+        conn.execute('COMMIT')
+
+        table = sql = None
+        batch = []
+
+        def flush():
+            if batch:
+                with conn:
+                    conn.execute('BEGIN')
+                    conn.executemany(sql, batch)
+                written[table] = written.get(table, 0) + len(batch)
+                if progress:
+                    progress(table, written[table])
+                batch.clear()
+
+        with open_stream(source, 'r') as lines:
+            header = json.loads(next(lines))
+            if header.get('format') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported export format: {header.get('format')!r}")
+            for line in lines:
+                record = json.loads(line)
+                if isinstance(record, list):
+                    if table == 'uploads':
+                        missing_uploads += not os.path.exists(record[0])
+                        continue
+                    batch.append([record[i] for i in keep])
+                    if len(batch) >= batch_size:
+                        flush()
+                    continue
+                flush()
+                if record.get('end'):
+                    break
+                table = record['table']
+                if table == 'uploads':
+                    continue
+                if table not in TABLES:
+                    raise ValueError(f"Unknown table in export: {table}")
+                # Columns this database doesn't have (a newer export) are left out
+                existing = set(table_columns(conn, table))
+                keep = [i for i, column in enumerate(record['columns']) if column in existing]
+                columns = [record['columns'][i] for i in keep]
+                sql = (f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) '
+                       f'VALUES ({", ".join("?" * len(columns))})')
+            else:
+                raise ValueError("Export is truncated (no end line)")
+    finally:
+        conn.close()
+        # Recreates the dropped indexes and triggers, even after a failed load
+        setup_database(db_path)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    attach_archive(conn, db_path)
+    try:
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute('DELETE FROM tags')
+            conn.execute('INSERT INTO tags (name, post_count) SELECT tag, COUNT(*) FROM post_tags GROUP BY tag')
+            # Imported history isn't news: the fan-out worker starts after it
+            conn.execute('UPDATE fanout_state SET seq = (SELECT COALESCE(MAX(seq), 0) FROM change_log)')
+            # Exported hot scores are scaled against the source's epoch; recompute them against ours
+            rebuild_scores(conn)
+        backfill(conn, METRICS)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    written['missing_uploads'] = missing_uploads
+    written['seconds'] = round(time.perf_counter() - start, 3)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('file', help="JSONL file (.gz to compress), or - for stdout/stdin")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--reset', action='store_true', help='import: empty the forum first')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='import: rows per transaction')
+    args = parser.parse_args(argv)
+
+    def progress(table, count):
+        print(f'\r{table}: {count:,}' + ' ' * 10, end='', file=sys.stderr, flush=True)
+
+    if args.command == 'export':
+        report = export_forum(args.db, args.file, progress)
+    else:
+        report = import_forum(args.file, args.db, args.reset, args.batch_size, progress)
+    print(file=sys.stderr)
+    seconds = report.pop('seconds')
+    missing = report.pop('missing_uploads', None)
+    total = sum(count for table, count in report.items() if table != 'uploads')
+    verb = 'Exported' if args.command == 'export' else 'Imported'
+    print(f"{verb} {total:,} rows {report} in {seconds:.1f}s ({total / max(seconds, 1e-9):,.0f} rows/s)",
+          file=sys.stderr)
+    if missing:
+        print(f"{missing:,} referenced uploads are not present here; copy uploads/ across", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Mark-and-sweep garbage collection for orphaned uploads.
+
+Files under uploads/ that no post, comment or avatar references (in either
+database tier) are leaked disk space: images of edits and deletions from
+before those paths cleaned up after themselves, abandoned .part files from
+interrupted uploads, and so on. The collector:
+
+    1. walks uploads/ with os.scandir, keeping files older than --min-age
+       (younger ones may belong to an upload whose row isn't committed yet)
+    2. marks every path the database references, streamed row by row
+    3. sweeps the unmarked candidates: deletes them, or moves them into a
+       quarantine directory, at most --rate files per second
+
+Walking before marking means a file referenced by the time the mark runs is
+always kept.
+
+    python upload_gc.py --dry-run
+    python upload_gc.py --quarantine uploads_quarantine --rate 50
+    python upload_gc.py --json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+from db import DB_PATH, open_connection
+from media import UPLOAD_ROOT
+from ops import ARCHIVE_UPLOAD_COLUMNS, UPLOAD_COLUMNS
+
+MIN_AGE = 3600
+
+
+def scan_uploads(root=UPLOAD_ROOT, min_age=MIN_AGE, now=None):
+    """Yield (path, size) for every regular file under root older than min_age"""
+    cutoff = (time.time() if now is None else now) - min_age
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime < cutoff:
+                        yield os.path.abspath(entry.path), stat.st_size
+
+
+def referenced_paths(conn):
+    """Every upload path the live and archived rows point at, made absolute"""
+    marked = set()
+    for table, column in UPLOAD_COLUMNS + ARCHIVE_UPLOAD_COLUMNS:
+        for (path,) in conn.execute(f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL'):
+            marked.add(os.path.abspath(path))
+    return marked
+
+
+def sweep(orphans, quarantine=None, rate=None, root=UPLOAD_ROOT):
+    """Delete or quarantine orphans, pacing to `rate` files/second; returns bytes reclaimed"""
+    reclaimed = 0
+    interval = 1.0 / rate if rate else 0
+    for path, size in orphans:
+        started = time.monotonic()
+        try:
+            if quarantine:
+                target = os.path.join(quarantine, os.path.relpath(path, root))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+        reclaimed += size
+        if interval:
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+    return reclaimed
+
+
+def collect(db_path=DB_PATH, root=UPLOAD_ROOT, min_age=MIN_AGE, dry_run=False, quarantine=None, rate=None):
+    """Run one collection and return its report"""
+    start = time.perf_counter()
+    root = os.path.abspath(root)
+    candidates = list(scan_uploads(root, min_age))
+    conn = open_connection(db_path)
+    try:
+        marked = referenced_paths(conn)
+    finally:
+        conn.close()
+    # Never re-collect what an earlier run quarantined under the same root
+    kept_aside = os.path.join(os.path.abspath(quarantine), '') if quarantine else None
+    orphans = [(path, size) for path, size in candidates
+               if path not in marked and not (kept_aside and path.startswith(kept_aside))]
+
+    folders = {}
+    for path, size in orphans:
+        folder = os.path.relpath(os.path.dirname(path), root)
+        count, total = folders.get(folder, (0, 0))
+        folders[folder] = (count + 1, total + size)
+
+    orphan_bytes = sum(size for _, size in orphans)
+    reclaimed = 0 if dry_run else sweep(orphans, quarantine, rate, root)
+    return {
+        'dry_run': dry_run,
+        'action': 'quarantine' if quarantine else 'delete',
+        'scanned': len(candidates),
+        'referenced': len(marked),
+        'orphans': len(orphans),
+        'orphan_bytes': orphan_bytes,
+        'reclaimed_bytes': reclaimed,
+        'folders': {folder: {'files': count, 'bytes': size} for folder, (count, size) in sorted(folders.items())},
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--root', default=UPLOAD_ROOT, help='upload directory to sweep')
+    parser.add_argument('--min-age', type=float, default=MIN_AGE, help='ignore files younger than this (seconds)')
+    parser.add_argument('--dry-run', action='store_true', help='report orphans without touching them')
+    parser.add_argument('--quarantine', help='move orphans into this directory instead of deleting them')
+    parser.add_argument('--rate', type=float, help='remove at most this many files per second')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = collect(args.db, args.root, args.min_age, args.dry_run, args.quarantine, args.rate)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    verb = 'would reclaim' if args.dry_run else ('quarantined' if args.quarantine else 'reclaimed')
+    amount = report['orphan_bytes'] if args.dry_run else report['reclaimed_bytes']
+    print(f"Scanned {report['scanned']:,} files, {report['referenced']:,} referenced paths, "
+          f"{report['orphans']:,} orphans: {verb} {amount / 1e6:.2f} MB in {report['seconds']:.2f}s")
+    for folder, stats in report['folders'].items():
+        print(f"  {folder:<20} {stats['files']:>8,} files {stats['bytes'] / 1e6:>10.2f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Cold-start warm-up and import-time benchmark.
+
+A fresh node pays for its first request: byte-compiling modules, creating
+the schema, opening SQLite connections and reading the home page's rows
+from disk. warm_up() does that work ahead of time. The API calls it from its
+lifespan, before it accepts requests. The Streamlit app calls it once per
+process from init_storage. Run it as a pre-start step or readiness probe too,
+so .pyc files and the database pages are on disk and in the OS cache before
+the node takes traffic:
+
+    python warmup.py && streamlit run fourm.py    # FORUM_DB picks the database
+    python warmup.py --imports [--repeat 5]    # import time of each dependency
+
+Heavy, page-specific dependencies are not imported at startup. PIL loads on
+the first image (media.pil_image), so the login and register pages never pay
+for it. --imports measures each module in a fresh interpreter
+(python -X importtime), so the numbers show what a cold start pays. Importing
+fourm runs the whole Streamlit script, so every interpreter runs in a
+throwaway directory with its own FORUM_DB; the real database is never touched.
+"""
+import argparse
+import compileall
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# What fourm.py and api.py import, cheapest first, plus what they now defer
+IMPORT_TARGETS = ['db', 'media', 'service', 'fanout', 'api', 'PIL.Image', 'streamlit', 'fourm']
+DEFERRED = {'PIL.Image'}
+
+
+def warm_up():
+    """Do the first request's one-off work now; returns (step, seconds) timings"""
+    import db
+    import mentions
+    import service
+    from media import UPLOAD_FOLDERS, UPLOAD_ROOT
+
+    steps = [
+        ('schema', db.setup_database),
+        ('upload folders', lambda: [os.makedirs(os.path.join(UPLOAD_ROOT, folder), exist_ok=True)
+                                    for folder in UPLOAD_FOLDERS]),
+        ('connection pool', db.get_pool().fill),
+        ('categories', service.get_categories),
+        ('recent posts', lambda: service.list_recent_posts(10)),
+        ('trending posts', lambda: service.list_trending_posts(limit=10)),
+        ('stats', service.get_stats),
+        ('mention index', mentions.get_index),
+    ]
+    timings = []
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        timings.append((name, round(time.perf_counter() - start, 4)))
+    return timings
+
+
+def import_time(module, repeat=3):
+    """Median cumulative import time of module in fresh interpreters, in ms (None if it won't import)"""
+    samples = []
+    for _ in range(repeat):
+        # fourm creates its database and uploads on import, so give each run a scratch directory for both
+        with tempfile.TemporaryDirectory() as scratch:
+            env = {key: value for key, value in os.environ.items() if key != 'FORUM_ARCHIVE_DB'}
+            env.update(FORUM_DB=os.path.join(scratch, 'forum.db'),
+                       PYTHONPATH=os.pathsep.join(filter(None, [APP_DIR, env.get('PYTHONPATH')])))
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                    cwd=scratch, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        # Lines read "import time: self [us] | cumulative | name"; the last one is the module itself
+        top = [line for line in result.stderr.splitlines()
+               if line.startswith('import time:') and line.rsplit('|', 1)[1].strip() == module]
+        samples.append(int(top[-1].split('|')[1]) / 1000)
+    return round(statistics.median(samples), 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--imports', action='store_true',
+                        help='benchmark import times instead of warming up (each run uses a temporary FORUM_DB)')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per module')
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        for module in IMPORT_TARGETS:
+            ms = import_time(module, args.repeat)
+            note = ' (loaded on first use)' if module in DEFERRED else ''
+            print(f"  {module:<12} {'not installed' if ms is None else f'{ms:>8.1f} ms'}{note}")
+        return 0
+
+    start = time.perf_counter()
+    compileall.compile_dir(APP_DIR, maxlevels=0, quiet=1)
+    timings = [('byte-compile', round(time.perf_counter() - start, 4)), *warm_up()]
+    for name, seconds in timings:
+        print(f"  {name:<16} {seconds * 1000:>8.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())